@@ -2,13 +2,16 @@
 import os
 import aws_cdk as cdk
 
+from stacks import game_image, regions
 from stacks.rtcw_on_demand import RtcwOnDemandStack
 from mysettings import settings
 
 app = cdk.App()
-for region_code, region_name in settings["regions"].items():
-    RtcwOnDemandStack(app, "RtcwOnDemandStack" + region_code, 
-                      env=cdk.Environment(account=settings["account"], region=region_name), 
+if settings.get("game_image") and app.node.try_get_context("skip_image_check") is None:
+    game_image.check_pushed(settings)
+for region in regions.load(settings):
+    RtcwOnDemandStack(app, "RtcwOnDemandStack" + region.code, 
+                      env=cdk.Environment(account=settings["account"], region=region.name), 
                       settings = settings)
 
 cdk.Tags.of(app).add("purpose", "rtcwdemand")
@@ -0,0 +1,59 @@
+# Scheduled refresh of the map cache (see stacks/map_cache.py).
+# Rebuilds the manifest when the config ref, CONF_CHECKVERSION or MAPS change.
+# Files are stored once under objects/<sha256>; maps already in the cache are
+# not downloaded again.
+set -eu
+CACHE_DIR=${CACHE_DIR:-/cache}
+MAPSERVER=${MAPSERVER:-}
+work=$(mktemp -d)
+
+# a pinned commit is not listed by ls-remote, use it as is
+commit=$(git ls-remote "$SETTINGSURL" "$SETTINGS_REF" | head -n1 | cut -f1)
+[ -n "$commit" ] || commit=$SETTINGS_REF
+source="$commit $CONF_CHECKVERSION $MAPS"
+if [ -f "$CACHE_DIR/source" ] && [ "$(cat "$CACHE_DIR/source")" = "$source" ]; then
+    echo "cache-refresh: up to date ($source)"
+    exit 0
+fi
+echo "cache-refresh: refreshing for $source"
+
+mkdir -p "$CACHE_DIR/objects" "$work/main"
+touch "$CACHE_DIR/manifest"
+git clone --quiet "$SETTINGSURL" "$work/settings"
+git -C "$work/settings" checkout --quiet "$commit"
+rm -rf "$work/settings/.git"
+
+: > "$work/manifest"
+for map in $(echo "$MAPS" | tr ':' ' '); do
+    cached=$(grep " main/$map.pk3\$" "$CACHE_DIR/manifest" | head -n1 || true)
+    if [ -n "$cached" ]; then
+        echo "$cached" >> "$work/manifest"
+    elif [ -n "$MAPSERVER" ]; then
+        curl -fsSL -o "$work/main/$map.pk3" "$MAPSERVER/$map.pk3"
+    fi
+done
+
+cd "$work"
+find settings main -type f | sort | while read -r path; do
+    hash=$(sha256sum "$path" | cut -d' ' -f1)
+    size=$(wc -c < "$path" | tr -d ' ')
+    if [ ! -f "$CACHE_DIR/objects/$hash" ]; then
+        cp "$path" "$CACHE_DIR/objects/$hash.part"
+        mv "$CACHE_DIR/objects/$hash.part" "$CACHE_DIR/objects/$hash"
+    fi
+    echo "$hash $size $path" >> "$work/manifest"
+done
+
+# swap the manifest in atomically, tasks booting meanwhile read either version
+cp "$CACHE_DIR/manifest" "$CACHE_DIR/manifest.previous"
+cp "$work/manifest" "$CACHE_DIR/manifest.part"
+mv "$CACHE_DIR/manifest.part" "$CACHE_DIR/manifest"
+echo "$source" > "$CACHE_DIR/source"
+
+# drop objects neither manifest refers to
+for object in "$CACHE_DIR"/objects/*; do
+    name=$(basename "$object")
+    grep -q "^$name " "$CACHE_DIR/manifest" "$CACHE_DIR/manifest.previous" || rm -f "$object"
+done
+echo "cache-refresh: $(wc -l < "$CACHE_DIR/manifest" | tr -d ' ') file(s) in the manifest"
+rm -rf "$work"
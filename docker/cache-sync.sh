@@ -0,0 +1,31 @@
+# Runs before the game entrypoint when the map cache is mounted (see stacks/map_cache.py).
+# Copies the files listed in the cache manifest ("sha256 size path" lines) into
+# GAME_DIR, skipping the ones the image already has with the same hash, then
+# execs the original entrypoint.
+CACHE_DIR=${CACHE_DIR:-/cache}
+GAME_DIR=${GAME_DIR:-/home/game}
+manifest="$CACHE_DIR/manifest"
+
+if [ -f "$manifest" ]; then
+    copied=0
+    kept=0
+    while read -r hash size path; do
+        target="$GAME_DIR/$path"
+        if [ -f "$target" ] && [ "$(wc -c < "$target" | tr -d ' ')" = "$size" ] \
+                && [ "$(sha256sum "$target" | cut -d' ' -f1)" = "$hash" ]; then
+            kept=$((kept + 1))
+            continue
+        fi
+        mkdir -p "$(dirname "$target")"
+        if cp "$CACHE_DIR/objects/$hash" "$target.part" && mv "$target.part" "$target"; then
+            copied=$((copied + 1))
+        else
+            echo "cache-sync: could not copy $path"
+        fi
+    done < "$manifest"
+    echo "cache-sync: copied $copied file(s), $kept unchanged"
+else
+    echo "cache-sync: no manifest in $CACHE_DIR, starting without the cache"
+fi
+
+exec "$@"
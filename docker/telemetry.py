@@ -0,0 +1,133 @@
+"""Telemetry sidecar of a game task.
+
+Samples the game container's CPU, CPU throttling, memory and network from
+the ECS task metadata endpoint v4 and the server's player count (getstatus
+on localhost), and prints one JSON line per sample. The lines carry EMF
+metadata, and tools/rightsize.py reads them back to recommend task sizes.
+Standard library only; stacks/telemetry.py runs it with `python3 -c`.
+"""
+import json
+import os
+import socket
+import sys
+import time
+import urllib.request
+
+METADATA = os.environ["ECS_CONTAINER_METADATA_URI_V4"]
+GAME_CONTAINER = os.environ.get("GAME_CONTAINER", "RTCWProTask")
+PORT = int(os.environ.get("RTCW_PORT", "27960"))
+INTERVAL = int(os.environ.get("TELEMETRY_SECONDS", "30"))
+# empty servers are sampled every IDLE_EVERY intervals only
+IDLE_EVERY = int(os.environ.get("TELEMETRY_IDLE_EVERY", "10"))
+PROFILE = os.environ.get("PROFILE", "default")
+REGION = os.environ.get("AWS_REGION", "")
+
+
+def get(path):
+    with urllib.request.urlopen(METADATA + path, timeout=2) as response:
+        return json.loads(response.read().decode())
+
+
+def player_count():
+    """(human players, getstatus reply time in ms), or (None, None) when the server does not answer.
+
+    The server answers in its frame loop, so a slow reply means stalled frames.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(1.0)
+    try:
+        started = time.monotonic()
+        sock.sendto(b"\xff\xff\xff\xffgetstatus\n", ("127.0.0.1", PORT))
+        data = sock.recv(65535)
+        elapsed = (time.monotonic() - started) * 1000
+    except OSError:
+        return None, None
+    finally:
+        sock.close()
+    lines = data.decode("latin-1").strip("\n").split("\n")[2:]
+    # bots report a ping of 0
+    players = sum(1 for line in lines if len(line.split(" ", 2)) == 3 and line.split(" ", 2)[1] != "0")
+    return players, round(elapsed, 1)
+
+
+def game_stats(task):
+    docker_id = next(container["DockerId"] for container in task["Containers"] if container["Name"] == GAME_CONTAINER)
+    return get("/task/stats")[docker_id]
+
+
+def counters(stats):
+    cpu = stats["cpu_stats"]
+    networks = (stats.get("networks") or {}).values()
+    return {"cpu_ns": cpu["cpu_usage"]["total_usage"],
+            "throttled_ns": (cpu.get("throttling_data") or {}).get("throttled_time", 0),
+            "rx_packets": sum(n.get("rx_packets", 0) for n in networks),
+            "tx_packets": sum(n.get("tx_packets", 0) for n in networks),
+            "rx_dropped": sum(n.get("rx_dropped", 0) for n in networks),
+            "tx_dropped": sum(n.get("tx_dropped", 0) for n in networks),
+            "at": time.monotonic()}
+
+
+def working_set(memory_stats):
+    """Memory in use without the reclaimable page cache, in bytes."""
+    details = memory_stats.get("stats") or {}
+    inactive = details.get("inactive_file", details.get("total_inactive_file", 0))
+    return max(memory_stats.get("usage", 0) - inactive, 0)
+
+
+def sample(task, previous, current, memory):
+    seconds = current["at"] - previous["at"]
+    limits = task.get("Limits") or {}
+    cpu_limit = float(limits.get("CPU") or 0.25)  # vCPU
+    return {"telemetry": 1,
+            "Region": REGION,
+            "Profile": PROFILE,
+            "task": task["TaskARN"].split("/")[-1],
+            "cpu_limit": cpu_limit * 1024,
+            "memory_limit": limits.get("Memory") or 512,
+            "CpuUtilization": round((current["cpu_ns"] - previous["cpu_ns"]) / 1e9 / seconds / cpu_limit * 100, 2),
+            "ThrottledMs": round((current["throttled_ns"] - previous["throttled_ns"]) / 1e6, 1),
+            "MemoryMiB": round(memory / 1048576.0, 1),
+            "RxPackets": round((current["rx_packets"] - previous["rx_packets"]) / seconds, 1),
+            "TxPackets": round((current["tx_packets"] - previous["tx_packets"]) / seconds, 1),
+            "DroppedPackets": (current["rx_dropped"] - previous["rx_dropped"]) + (current["tx_dropped"] - previous["tx_dropped"])}
+
+
+def emf(line):
+    names = ["CpuUtilization", "ThrottledMs", "MemoryMiB", "RxPackets", "TxPackets", "DroppedPackets", "Players", "StatusMs"]
+    units = {"CpuUtilization": "Percent", "ThrottledMs": "Milliseconds", "StatusMs": "Milliseconds",
+             "MemoryMiB": "Megabytes", "RxPackets": "Count/Second", "TxPackets": "Count/Second"}
+    line["_aws"] = {"Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{"Namespace": "rtcwdemand/telemetry",
+                                           "Dimensions": [["Region", "Profile"]],
+                                           "Metrics": [{"Name": name, "Unit": units.get(name, "Count")}
+                                                       for name in names if line.get(name) is not None]}]}
+    return line
+
+
+def main():
+    task = get("/task")
+    previous = None
+    count = 0
+    while True:
+        time.sleep(INTERVAL)
+        try:
+            stats = game_stats(task)
+            current = counters(stats)
+        except Exception as ex:  # the game container is not up yet, gone, or the endpoint hiccuped
+            sys.stderr.write("telemetry: " + repr(ex) + "\n")
+            continue
+        if previous is None:
+            previous = current
+            continue
+        count += 1
+        players, status_ms = player_count()
+        if players or count % IDLE_EVERY == 0:
+            line = sample(task, previous, current, working_set(stats["memory_stats"]))
+            line.update(Players=players, StatusMs=status_ms)
+            sys.stdout.write(json.dumps(emf(line), separators=(",", ":")) + "\n")
+            sys.stdout.flush()
+        previous = current
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import logging
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rtcwcommon.clients import get_client, default_region
+from rtcwcommon.state import get_store
+from rtcwcommon import batch, instrument, lifecycle, profiles, regions, servicecount, slots
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger('batch')
+logger.setLevel(log_level)
+
+PROTECTION_MINUTES = 10
+
+@instrument.handler("batchlambda")
+def handler(event, context):
+    """Start, report and tear down a tournament batch of servers across regions.
+
+    POST /batch {"name": "cup", "hold_hours": 10, "servers": [{"region": "us-east-1", "count": 4, "profile": "6v6"}, ...]}
+    GET /batch/{id} returns the manifest, DELETE /batch/{id} stops every server of the batch.
+    """
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Processing event " + json.dumps(event))
+
+    resource = event.get("resource", "Unknown")
+    method = event.get("httpMethod", "GET")
+    try:
+        if resource == "/batch" and method == "POST":
+            return start_batch(json.loads(event.get("body") or "{}"))
+        batch_id = (event.get("pathParameters") or {}).get("id", "")
+        region = batch.home_region(batch_id)
+        if resource != "/batch/{id}" or not regions.known(region or ""):
+            return respond({"message": "No such batch."}, 404)
+        item = batch.get(get_store(region), batch_id)
+        if item is None:
+            return respond({"message": "No such batch."}, 404)
+        if method == "DELETE":
+            return respond(stop_batch(batch_id, item))
+        return respond(manifest(batch_id, item))
+    except ValueError as ex:
+        return respond({"message": str(ex)}, 400)
+    except Exception as ex:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        logger.error("Batch request failed\n" + template.format(type(ex).__name__, ex.args))
+        return respond({"message": "Batch request failed."}, 500)
+
+
+def respond(result, status_code=200):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json'
+        },
+        'body': json.dumps(result)
+    }
+
+
+def parse_entries(body):
+    """Validated [{"region", "count", "profile"}] of a batch request; raises ValueError."""
+    entries = []
+    for entry in body.get("servers") or []:
+        region = entry.get("region")
+        profile = entry.get("profile") or profiles.default()
+        count = entry.get("count", 1)
+        if not regions.known(region or ""):
+            raise ValueError("Unknown region " + str(region) + ", pick one of " + ", ".join(regions.names()) + ".")
+        if profile not in profiles.names():
+            raise ValueError("Unknown profile " + profile + ", pick one of " + ", ".join(profiles.names()) + ".")
+        if not isinstance(count, int) or not 0 < count <= regions.capacity(region):
+            raise ValueError("Count for " + region + " must be between 1 and " + str(regions.capacity(region)) + ".")
+        entries.append({"region": region, "count": count, "profile": profile})
+    if not entries:
+        raise ValueError("No servers requested.")
+    return entries
+
+
+def start_batch(body):
+    """Reserve the batch's slots and scale every region at once; returns the manifest so far."""
+    entries = parse_entries(body)
+    hold_hours = min(float(body.get("hold_hours", batch.DEFAULT_HOLD_HOURS)), batch.MAX_HOLD_HOURS)
+    now = time.time()
+    until = now + hold_hours * 3600
+    batch_id = batch.new_id(default_region())
+    item = batch.record(get_store(default_region()), batch_id, body.get("name") or batch_id, entries, until, now)
+
+    per_region = {}
+    for entry in entries:
+        per_region.setdefault(entry["region"], []).append(entry)
+    with ThreadPoolExecutor(max_workers=len(per_region)) as pool:
+        started = list(pool.map(lambda region: start_region(region, per_region[region], batch_id, until, now),
+                                sorted(per_region)))
+
+    result = manifest(batch_id, item)
+    result["started"] = [entry for entries_started in started for entry in entries_started]
+    missing = sum(entry["count"] - entry["started"] for entry in result["started"])
+    result["message"] = ("Starting " + str(result["requested"] - missing) + " server(s)"
+                         + (", " + str(missing) + " could not be started, the regions are full." if missing else ".")
+                         + " Poll GET /batch/" + batch_id + " for the manifest.")
+    logger.info(batch_id + ": " + result["message"])
+    return respond(result)
+
+
+def start_region(region, entries, batch_id, until, now):
+    """Reserve slots and raise the services of one region; the started count per entry."""
+    store = get_store(region)
+    ecs = get_client('ecs', region)
+    rtcw_cluster = os.environ['ECS_CLUSTER_NAME']
+    zone_name = os.environ["DNS_HOSTED_ZONE_NAME"]
+    capacity = regions.capacity(region)
+    started = []
+    for entry in entries:
+        reserved = []
+        for index in range(entry["count"]):
+            request_id = batch_id + "#" + entry["profile"] + "#" + str(index)
+            slot = slots.reserve(store, region, zone_name, capacity, request_id, now,
+                                 profile=entry["profile"], batch_id=batch_id, batch_until=until)
+            if slot is None:
+                break
+            reserved.append(slot)
+        service = profiles.start_service(os.environ['ECS_SERVICE_NAME'], entry["profile"])
+        try:
+            # one update_service for the whole entry
+            desired_count = servicecount.increment(store, ecs, rtcw_cluster, service, capacity, count=len(reserved)) if reserved else None
+        except Exception:
+            desired_count = None
+            logger.exception("Could not scale " + service + " in " + region)
+        if desired_count is None:
+            for slot in reserved:
+                slots.cancel(store, slot)
+            reserved = []
+        for slot in reserved:
+            lifecycle.record_start(store, now, slot["request_id"], batch_id=batch_id)
+        logger.info(batch_id + ": " + str(len(reserved)) + " of " + str(entry["count"]) + " " + entry["profile"] + " in " + region)
+        started.append(dict(entry, started=len(reserved)))
+    return started
+
+
+def manifest(batch_id, item):
+    """Hostnames and, once playable, IPs of every server of the batch."""
+    with ThreadPoolExecutor(max_workers=len(item["regions"])) as pool:
+        found = list(pool.map(lambda region: batch.servers(get_store(region), region, batch_id), item["regions"]))
+    servers = [server for region_servers in found for server in region_servers]
+    requested = sum(entry["count"] for entry in item["entries"])
+    return {"id": batch_id, "name": item["name"], "state": item["state"], "hold_until": int(item["hold_until"]),
+            "requested": requested, "ready": bool(servers) and all(server["ready"] for server in servers),
+            "servers": servers}
+
+
+def stop_batch(batch_id, item):
+    """Scale every region of the batch down by its servers, leaving the others running."""
+    with ThreadPoolExecutor(max_workers=len(item["regions"])) as pool:
+        stopped = dict(zip(item["regions"], pool.map(lambda region: stop_region(region, batch_id), item["regions"])))
+    batch.mark_stopped(get_store(batch.home_region(batch_id)), batch_id)
+    total = sum(stopped.values())
+    logger.info(batch_id + ": stopping " + str(total) + " server(s).")
+    return {"id": batch_id, "stopped": stopped, "message": "Stopping " + str(total) + " server(s)."}
+
+
+def stop_region(region, batch_id):
+    """Stop the batch's servers in one region; returns how many."""
+    store = get_store(region)
+    ecs = get_client('ecs', region)
+    base_service = os.environ['ECS_SERVICE_NAME']
+    rtcw_cluster = os.environ['ECS_CLUSTER_NAME']
+    mine = [slot for slot in store.query("slot") if slot.get("batch_id") == batch_id]
+    if not mine:
+        return 0
+
+    task_arns = ecs.list_tasks(cluster=rtcw_cluster, desiredStatus="RUNNING")["taskArns"]
+    tasks = ecs.describe_tasks(cluster=rtcw_cluster, tasks=task_arns)["tasks"] if task_arns else []
+    tasks = [task for task in tasks if profiles.of_task(base_service, task)]
+    batch_tasks = {slot["task_arn"] for slot in mine if slot.get("task_arn")}
+
+    per_service = {}
+    for task in tasks:
+        if task["taskArn"] in batch_tasks:
+            service = task["group"].split(":", 1)[1]
+            per_service[service] = per_service.get(service, 0) + 1
+    for slot in mine:
+        if not slot.get("task_arn"):
+            # no task yet, give the launch it was waiting for back
+            service = profiles.start_service(base_service, slot.get("profile") or profiles.default())
+            per_service[service] = per_service.get(service, 0) + 1
+            slots.cancel(store, slot)
+
+    # tasks we keep are protected so the services scale in the batch's ones
+    keep = [task["taskArn"] for task in tasks if task["taskArn"] not in batch_tasks]
+    servicecount.protect(ecs, rtcw_cluster, keep, PROTECTION_MINUTES)
+    for service, count in per_service.items():
+        servicecount.decrement(store, ecs, rtcw_cluster, service, count)
+    # leftovers are the idle reaper's again
+    for slot in mine:
+        if slot.get("task_arn"):
+            slots.annotate(store, slot, batch_until=time.time())
+    return len(mine)
+
+
+if __name__ == "__main__":
+
+    # Local testing only #
+    event_start = {
+        "resource": "/batch",
+        "httpMethod": "POST",
+        "body": json.dumps({"name": "local cup", "servers": [{"region": "us-east-1", "count": 2}]})
+        }
+    started = json.loads(handler(event_start, None)["body"])
+    print(started)
+    print(handler({"resource": "/batch/{id}", "httpMethod": "GET", "pathParameters": {"id": started["id"]}}, None))
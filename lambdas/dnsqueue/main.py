@@ -0,0 +1,47 @@
+import logging
+import json
+from rtcwcommon import dns, instrument
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger('dnsqueue')
+logger.setLevel(log_level)
+logging.getLogger('rtcwcommon').setLevel(log_level)
+
+@instrument.handler("dnsqueue")
+def handler(event, context):
+    """Apply a batch of queued DNS intents, one ChangeBatch per hosted zone."""
+
+    intents = []
+    message_ids = {}
+    for record in event.get("Records", []):
+        try:
+            intent = json.loads(record["body"])
+            if not isinstance(intent, dict) or "zone" not in intent:
+                raise ValueError("no zone")
+        except (ValueError, KeyError):
+            logger.error("Dropping malformed DNS intent: " + record.get("body", ""))
+            continue
+        intents.append(intent)
+        message_ids[id(intent)] = record["messageId"]
+
+    logger.info("Received " + str(len(intents)) + " DNS intent(s).")
+    failed = dns.apply_intents(intents)
+    
+    # only the messages of changes that failed go back to the queue; applied and
+    # superseded ones must not come back and overwrite newer state
+    failures = [{"itemIdentifier": message_ids[id(intent)]} for intent in failed]
+    
+    return {"batchItemFailures": failures}
+
+
+if __name__ == "__main__":
+    
+    # Local testing only #
+    def message(message_id, action, ip, updated_at):
+        body = {"action": action, "name": "na.example.com", "ip": ip, "zone": "Z1ABCD", "updated_at": updated_at}
+        return {"messageId": message_id, "body": json.dumps(body)}
+    
+    event_sqs = {"Records": [message("1", "UPSERT", "1.2.3.4", "2021-07-07T19:38:27.321Z"),
+                             message("2", "DELETE", "1.2.3.4", "2021-07-07T19:44:16.522Z")]}
+    print(handler(event_sqs, None))
@@ -0,0 +1,205 @@
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rtcwcommon.clients import get_client
+from rtcwcommon.state import get_store
+from rtcwcommon import dns, instrument, lifecycle, metrics, prewarm, profiles, regions, slots
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger('dnsreconcile')
+logger.setLevel(log_level)
+logging.getLogger('rtcwcommon').setLevel(log_level)
+
+TASK_RETENTION = 24 * 3600
+ready_timeout = int(os.environ.get("READY_TIMEOUT", "150"))
+# younger tasks and bindings are still r53lambda's, it may be waiting for the server to answer
+SETTLE_SECONDS = ready_timeout + 60
+
+@instrument.handler("dnsreconcile")
+def handler(event, context):
+    """Bring the server records of the hosted zone in line with the running tasks.
+
+    Runs every few minutes from the main region. r53lambda keeps the records
+    up to date task by task; this catches what it missed when an event never
+    arrived or its change failed: records of servers that are gone are
+    deleted, live servers without a (correct) record get one, and slots of
+    stopped tasks are freed. All record changes go out as one ChangeBatch.
+    Regions behind a static endpoint have fixed records and are skipped.
+    {"dry_run": true} only reports the changes, and leaves the slots alone.
+    """
+
+    zone_id = os.environ["DNS_HOSTED_ZONE"]
+    zone_name = os.environ["DNS_HOSTED_ZONE_NAME"]
+    now = time.time()
+    managed = [region for region in regions.names() if not regions.static_port(region, 1)]
+    if not managed:
+        return "No region without a static endpoint, nothing to reconcile."
+
+    # records first: a change made after this listing makes a DELETE below no longer match, so it is not applied
+    records = list_records(zone_id, zone_name, managed)
+    with ThreadPoolExecutor(max_workers=len(managed)) as pool:
+        results = list(pool.map(lambda region: region_servers(region, zone_name, now, event.get("dry_run")), managed))
+
+    desired = {}
+    settling = set()
+    released = 0
+    for servers, busy, freed in results:
+        desired.update(servers)
+        settling.update(busy)
+        released += freed
+    changes = diff(records, desired, settling)
+
+    summary = (str(len(records)) + " record(s), " + str(len(desired)) + " live server(s), "
+               + str(len(changes)) + " change(s), " + str(released) + " slot(s) freed")
+    if event.get("dry_run"):
+        for change in changes:
+            logger.info("Would " + change["Action"] + " " + change["ResourceRecordSet"]["Name"] + " "
+                        + change["ResourceRecordSet"]["ResourceRecords"][0]["Value"])
+        return summary + " (dry run)."
+    if changes and not dns.apply_changes(zone_id, changes):
+        logger.error("Some record changes failed, the next run retries them.")
+    metrics.emit({"RecordsUpserted": len([c for c in changes if c["Action"] == "UPSERT"]),
+                  "RecordsDeleted": len([c for c in changes if c["Action"] == "DELETE"]),
+                  "SlotsFreed": released},
+                 {"Function": "dnsreconcile"}, unit="Count")
+    return summary + "."
+
+
+def list_records(zone_id, zone_name, managed):
+    """{hostname: (ip, ttl)} of the A records named like the servers of the managed regions, one paged listing."""
+    pattern = re.compile("^(" + "|".join(re.escape(regions.prefix(region)) for region in managed) + r")\d+\."
+                         + re.escape(zone_name.rstrip(".").lower()) + "$")
+    records = {}
+    kwargs = {"HostedZoneId": zone_id, "MaxItems": "300"}
+    while True:
+        response = dns.call("list_resource_record_sets", **kwargs)
+        for record in response["ResourceRecordSets"]:
+            name = record["Name"].rstrip(".").lower()
+            if record["Type"] == "A" and record.get("ResourceRecords") and pattern.match(name):
+                records[name] = (record["ResourceRecords"][0]["Value"], record.get("TTL", dns.TTL))
+        if not response.get("IsTruncated"):
+            return records
+        kwargs.update(StartRecordName=response["NextRecordName"], StartRecordType=response["NextRecordType"])
+
+
+def running_tasks(region):
+    """Game server tasks of the region that are not stopping, as describe_tasks returns them."""
+    ecs = get_client('ecs', region)
+    cluster = os.environ["ECS_CLUSTER_NAME"]
+    task_arns = []
+    kwargs = {"cluster": cluster, "desiredStatus": "RUNNING"}
+    while True:
+        response = ecs.list_tasks(**kwargs)
+        task_arns.extend(response["taskArns"])
+        if not response.get("nextToken"):
+            break
+        kwargs["nextToken"] = response["nextToken"]
+    tasks = []
+    for start in range(0, len(task_arns), 100):
+        tasks.extend(ecs.describe_tasks(cluster=cluster, tasks=task_arns[start:start + 100])["tasks"])
+    # only game servers, not e.g. the map cache refresher
+    return [task for task in tasks if profiles.of_task(os.environ["ECS_SERVICE_NAME"], task)]
+
+
+def public_ips(region, tasks):
+    """{task arn: public ip} from the tasks' ENIs, in one call."""
+    enis = {}
+    for task in tasks:
+        for attachment in task.get("attachments", []):
+            for keypair in attachment.get("details", []):
+                if keypair["name"] == "networkInterfaceId":
+                    enis[keypair["value"]] = task["taskArn"]
+    if not enis:
+        return {}
+    ec2 = get_client('ec2', region)
+    response = ec2.describe_network_interfaces(NetworkInterfaceIds=list(enis))
+    return {enis[interface["NetworkInterfaceId"]]: interface["Association"]["PublicIp"]
+            for interface in response["NetworkInterfaces"] if interface.get("Association", {}).get("PublicIp")}
+
+
+def region_servers(region, zone_name, now, dry_run=False):
+    """({hostname: ip} of the region's settled servers, hostnames to leave alone, slots freed).
+
+    A slot whose task is no longer running missed its STOPPED event and is
+    freed. A settled task without a slot or an address missed its RUNNING
+    event; it is bound and published here.
+    """
+    store = get_store(region)
+    tasks = {task["taskArn"]: task for task in running_tasks(region)}
+    bound = {slot["task_arn"]: slot for slot in store.query("slot") if slot.get("task_arn")}
+
+    servers = {}
+    settling = set()
+    unpublished = []
+    for task_arn, task in tasks.items():
+        slot = bound.get(task_arn)
+        started_at = lifecycle.parse_time(task.get("startedAt"))
+        if task["lastStatus"] != "RUNNING" or started_at is None or started_at > now - SETTLE_SECONDS:
+            if slot:
+                settling.add(slot["hostname"].rstrip(".").lower())
+            continue
+        if slot and slot.get("ip"):
+            servers[slot["hostname"].rstrip(".").lower()] = slot["ip"]
+        else:
+            unpublished.append(task)
+
+    freed = 0
+    for task_arn, slot in bound.items():
+        # a task bound after the listing is not in it yet
+        if task_arn in tasks or slot["bound_at"] > now - SETTLE_SECONDS:
+            continue
+        if dry_run:
+            logger.info("Would free slot " + str(slot["number"]) + " of " + task_arn + ".")
+            freed += 1
+            continue
+        released = slots.release(store, task_arn)
+        if released is None:
+            continue
+        logger.info("Task " + task_arn + " is gone, freeing slot " + str(released["number"]) + ".")
+        if released.get("prewarm_id"):
+            prewarm.record_stop(store, released, now)
+        task = store.get("task", task_arn) or {"region": region}
+        task.pop("pk", None)
+        task.pop("sk", None)
+        task.update({"dns_deleted": True, "expires_at": int(now) + TASK_RETENTION})
+        store.put("task", task_arn, task)
+        freed += 1
+
+    addresses = public_ips(region, unpublished) if unpublished else {}
+    for task in unpublished:
+        task_arn = task["taskArn"]
+        if dry_run:
+            logger.info("Would publish " + task_arn + " at " + addresses.get(task_arn, "no public ip") + ".")
+            continue
+        placement = profiles.of_task(os.environ["ECS_SERVICE_NAME"], task)
+        slot = slots.bind(store, region, zone_name, regions.capacity(region), task_arn, now, placement[0])
+        if slot is None or task_arn not in addresses:
+            logger.error("Could not publish " + task_arn + ": " + ("no free slot." if slot is None else "no public ip."))
+            continue
+        ip = addresses[task_arn]
+        logger.info("Task " + task_arn + " has no record yet, publishing " + slot["hostname"] + " " + ip)
+        store.put("task", task_arn, {"ip": ip, "record_name": slot["hostname"], "slot": slot["number"],
+                                     "region": region, "published": True})
+        slots.annotate(store, slot, ip=ip, started_at=lifecycle.parse_time(task.get("startedAt")), published_at=now)
+        servers[slot["hostname"].rstrip(".").lower()] = ip
+    return servers, settling, freed
+
+
+def diff(records, desired, settling):
+    """Changes taking records ({hostname: (ip, ttl)}) to desired ({hostname: ip}), leaving the settling hostnames alone."""
+    changes = []
+    for name, ip in sorted(desired.items()):
+        if records.get(name, (None,))[0] != ip:
+            changes.append(dns.record_change("UPSERT", name, ip))
+    for name, (ip, ttl) in sorted(records.items()):
+        if name not in desired and name not in settling:
+            # DELETE must match the current record, so one changed since the listing is kept
+            changes.append(dns.record_change("DELETE", name, ip, ttl))
+    return changes
+
+
+if __name__ == "__main__":
+    print(handler({"dry_run": True}, None))
@@ -1,39 +1,56 @@
-import boto3
 import logging
 import json
 import os
+import time
+from rtcwcommon.clients import get_client, default_region
+from rtcwcommon.state import get_store
+from rtcwcommon import batch, instrument, prewarm, profiles, q3status, servicecount
 
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
 logger = logging.getLogger('ecsdecrement')
 logger.setLevel(log_level)
-max_count = 1
 
+IDLE_RETENTION = 24 * 3600
+PROTECTION_MINUTES = 10
+# a server silent for this long is hung, not busy
+SILENT_WINDOW = 30 * 60
+
+@instrument.handler("ecsdecrement")
 def handler(event, context):
-    """Decrement service based on a region."""
+    """Scale a region's service down to the servers that still have players.
+
+    Runs every few minutes as an idle reaper ({"event": "idle-check"}), which
+    only stops servers that have been empty for IDLE_MINUTES, and once a day
+    from the cron as a safety net, which stops every empty server. Servers of
+    a tournament batch are left to the batch's teardown (DELETE /batch/{id}).
+    A server that does not answer getstatus may still have players and is
+    kept, until it has been silent for SILENT_MINUTES: then it is taken to be
+    hung and stopped like an idle one.
+    """
 
-    logger.debug("Processing event " + json.dumps(event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Processing event " + json.dumps(event))
    
     try:
-        region = "us-east-1"
-        if event.get("detail-type", "Unknown") == "Scheduled Event":
+        region = default_region()
+        if event.get("event") == "idle-check":
+            logger.info("Event type: idle check.")
+            force = False
+        elif event.get("detail-type", "Unknown") == "Scheduled Event":
             logger.info("Event type: decrement via schedule.")
             region = event["region"]
+            force = True
+        else:
+            raise ValueError('Unknown invocation event!')
             
-        pro_service = os.environ['ECS_SERVICE_NAME']
-        rtcw_cluster = os.environ['ECS_CLUSTER_NAME']
-
-        ecs = boto3.client('ecs', region_name=region)
-        current_services= ecs.describe_services(cluster=rtcw_cluster, services = [pro_service])
-        desired_count = current_services["services"][0]["desiredCount"]
-
-        response = ecs.update_service(cluster=rtcw_cluster, service=pro_service, desiredCount=0)
-        message = "Server is being taken down by a scheduled event."
-        logger.debug(response)
+        idle_window = int(os.environ.get("IDLE_MINUTES", "15")) * 60
+        silent_window = int(os.environ.get("SILENT_MINUTES", str(SILENT_WINDOW // 60))) * 60
+        message = reap(region, idle_window, force, silent_window)
     except Exception as ex:
         template = "An exception of type {0} occurred. Arguments:\n{1!r}"
         error_msg = template.format(type(ex).__name__, ex.args)
-        message = "Failed to add a server\n" + error_msg        
+        message = "Failed to take a server down\n" + error_msg        
     
     logger.info(message)
     return {
@@ -45,6 +62,107 @@ def handler(event, context):
     }
 
 
+def reap(region, idle_window, force, silent_window=SILENT_WINDOW):
+    """Stop the idle servers of a region, across all its services; never one with players on it.
+
+    A server that has not answered getstatus for silent_window is stopped too.
+    """
+    base_service = os.environ['ECS_SERVICE_NAME']
+    rtcw_cluster = os.environ['ECS_CLUSTER_NAME']
+
+    ecs = get_client('ecs', region)
+    service_names = [name for name, profile, spot in profiles.services(base_service)]
+    current_services = ecs.describe_services(cluster=rtcw_cluster, services=service_names)
+    desired_count = sum(service["desiredCount"] for service in current_services["services"])
+    if desired_count == 0:
+        return "No servers running."
+
+    task_arns = ecs.list_tasks(cluster=rtcw_cluster, desiredStatus="RUNNING")["taskArns"]
+    tasks = ecs.describe_tasks(cluster=rtcw_cluster, tasks=task_arns)["tasks"] if task_arns else []
+    # only game servers, not e.g. the map cache refresher
+    tasks = [task for task in tasks if profiles.of_task(base_service, task)]
+    running = [task for task in tasks if task["lastStatus"] == "RUNNING"]
+
+    addresses = task_addresses(region, running)
+    statuses = q3status.query_many(list(set(addresses.values())))
+
+    store = get_store()
+    now = time.time()
+    # pre-warmed servers nobody claimed yet wait for their predicted players, and
+    # tournament servers for their batch's teardown, even from the daily cron
+    bound = [slot for slot in store.query("slot") if slot.get("task_arn")]
+    held = {slot["task_arn"] for slot in bound if prewarm.held(slot, now)}
+    in_batch = {slot["task_arn"] for slot in bound if batch.held(slot, now)}
+    idle_tasks = []
+    for task in running:
+        task_arn = task["taskArn"]
+        status = statuses.get(addresses.get(task_arn))
+        # no answer is no player count: a server dropping packets may well have players, keep it for a while
+        players = q3status.player_count(status) if status else None
+        item = {"players": players, "responding": status is not None, "checked_at": now, "expires_at": int(now + IDLE_RETENTION)}
+        previous = store.get("idle", task_arn) or {}
+        reapable = task_arn not in in_batch and task_arn not in held
+        if players is None:
+            item["silent_since"] = previous.get("silent_since", now)
+            if "idle_since" in previous:
+                item["idle_since"] = previous["idle_since"]
+            if reapable and now - item["silent_since"] >= silent_window:
+                idle_tasks.append(task_arn)
+        elif players == 0:
+            item["idle_since"] = previous.get("idle_since", now)
+            if reapable and (force or now - item["idle_since"] >= idle_window):
+                idle_tasks.append(task_arn)
+        store.put("idle", task_arn, item)
+        if status:
+            logger.info(task_arn + ": " + str(players) + " player(s)")
+        else:
+            logger.info(task_arn + ": not responding for " + str(int(now - item["silent_since"])) + "s, "
+                        + ("stopping" if task_arn in idle_tasks else "kept"))
+
+    if not idle_tasks:
+        return "No idle servers, " + str(desired_count) + " kept."
+
+    # tasks we keep are protected so the service scales in the idle ones
+    keep = [task["taskArn"] for task in tasks if task["taskArn"] not in idle_tasks]
+    servicecount.protect(ecs, rtcw_cluster, keep, PROTECTION_MINUTES)
+    per_service = {}
+    for task in tasks:
+        if task["taskArn"] in idle_tasks:
+            service = task["group"].split(":", 1)[1]
+            per_service[service] = per_service.get(service, 0) + 1
+    for service, count in per_service.items():
+        servicecount.decrement(store, ecs, rtcw_cluster, service, count)
+    return "Taking down " + str(len(idle_tasks)) + " idle server(s), " + str(len(keep)) + " kept."
+
+
+def task_addresses(region, tasks):
+    """{task arn: (public ip, port)}, from the state store or the task's ENI.
+
+    Servers behind a static endpoint are queried through their slot's port.
+    """
+    port = int(os.environ.get("RTCW_PORT", "27960"))
+    store = get_store()
+    addresses = {}
+    enis = {}
+    for task in tasks:
+        item = store.get("task", task["taskArn"])
+        if item and item.get("ip") and not item.get("dns_deleted"):
+            addresses[task["taskArn"]] = (item["ip"], item.get("port", port))
+            continue
+        for attachment in task.get("attachments", []):
+            for keypair in attachment.get("details", []):
+                if keypair["name"] == "networkInterfaceId":
+                    enis[keypair["value"]] = task["taskArn"]
+    if enis:
+        ec2 = get_client('ec2', region)
+        response = ec2.describe_network_interfaces(NetworkInterfaceIds=list(enis))
+        for interface in response["NetworkInterfaces"]:
+            ip = interface.get("Association", {}).get("PublicIp")
+            if ip:
+                addresses[enis[interface["NetworkInterfaceId"]]] = (ip, port)
+    return addresses
+
+
 if __name__ == "__main__":
     event_stop = { "version": "0",
         "id": "53dc4d37-cffa-4f76-80c9-8b7d4a4d2eaa",
@@ -59,3 +177,4 @@ if __name__ == "__main__":
         "detail": {}
     }
     print(handler(event_stop, None))
+    print(handler({"event": "idle-check"}, None))
@@ -1,24 +1,40 @@
-import boto3
 import logging
 import json
 import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from rtcwcommon.clients import get_client, default_region
+from rtcwcommon.state import get_store
+from rtcwcommon import instrument, lifecycle, metrics, nearest, prewarm, profiles, regions, slots, servicecount, idempotency
 
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
 logger = logging.getLogger('ecsguy')
 logger.setLevel(log_level)
-max_count = 1
 
+# API Gateway gives up after 29 seconds
+wait_seconds = int(os.environ.get("WAIT_SECONDS", "25"))
+WAIT_INTERVAL = 2
+prewarm_enabled = os.environ.get("PREWARM", "false") == "true"
+# /start/auto picks the region for the caller
+AUTO_REGION = "auto"
+
+@instrument.handler("ecslambda")
 def handler(event, context):
-    """Increment service based on a region."""
+    """Increment service based on a region and reserve the server's slot."""
 
-    logger.info("Processing event " + json.dumps(event))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Processing event " + json.dumps(event))
+    result = {}
    
     try:
         increment = False
 
-        if event.get("resource", "Unknown") == "/start/{region}":
+        if event.get("resource", "Unknown") == "/wait/{token}":
+            return wait_for_server(event["pathParameters"]["token"])
+        elif event.get("resource", "Unknown") == "/start/{region}":
             logger.info("Event type: increment via API.")
             increment = True
             if "region" in event["pathParameters"]:
@@ -30,23 +46,49 @@ def handler(event, context):
         else:
             raise ValueError('Uknown invocation event!')
 
-        pro_service = os.environ['ECS_SERVICE_NAME']
-        rtcw_cluster = os.environ['ECS_CLUSTER_NAME']
+        if region != AUTO_REGION and not regions.known(region):
+            return respond({"message": "Unknown region " + region + ", pick one of " + ", ".join(regions.names()) + " or auto."}, 400)
+        profile = (event.get("queryStringParameters") or {}).get("profile") or event.get("profile") or profiles.default()
+        if profile not in profiles.names():
+            return respond({"message": "Unknown profile " + profile + ", pick one of " + ", ".join(profiles.names()) + "."}, 400)
+        result.update(region=region, profile=profile)
+        if region == AUTO_REGION:
+            # the region is only known once picked, keep the request's key next to this API
+            store = get_store(default_region())
+        elif region != default_region():
+            # latency routing sent the request to another region's API, served with cross-region calls
+            logger.info("Serving " + region + " from " + default_region() + ".")
+            metrics.emit({"CrossRegionStart": 1}, {"Region": region}, unit="Count")
+            store = get_store(region)
+        else:
+            store = get_store(region)
+        key = idempotency.key_from_event(event, region + "#" + profile)
+        previous = idempotency.begin(store, key) if key else None
+        if previous:
+            logger.info("Repeated request " + key + ", returning the earlier response.")
+            return respond(dict(previous, duplicate=True))
 
-        ecs = boto3.client('ecs', region_name=region)
-        current_services= ecs.describe_services(cluster=rtcw_cluster, services = [pro_service])
-        desired_count = current_services["services"][0]["desiredCount"]
+        try:
+            if region == AUTO_REGION:
+                message = start_nearest(event, profile, context, result)
+            else:
+                record_demand(store)
+                message = start_server(store, region, profile, context, result)
+        except Exception:
+            if key:
+                idempotency.abandon(store, key)
+            raise
+        if key and "hostname" in result:
+            idempotency.finish(store, key, dict(result, message=message))
+        elif key:
+            idempotency.abandon(store, key)
 
-        if desired_count < max_count:
-            desired_count +=1
-            response = ecs.update_service(cluster=rtcw_cluster, service=pro_service, desiredCount=desired_count)
-            logger.debug(response)
-            message = "Server requested. Takes about 2 minutes."
-            logger.info(message)
-        else:
-            message = "Maximum number of servers is already in flight for this region."
-            logger.info(message)
+        query = event.get("queryStringParameters") or {}
+        if "token" in result and query.get("wait", "").lower() in ("true", "1", "yes"):
+            return wait_for_server(result["token"])
 
+    except idempotency.InProgress:
+        message = "The same request is already being processed."
     except Exception as ex:
         template = "An exception of type {0} occurred. Arguments:\n{1!r}"
         error_msg = template.format(type(ex).__name__, ex.args)
@@ -54,16 +96,172 @@ def handler(event, context):
         logger.error(err_message)
         now = datetime.now()
         message = "Failed to add a server. UTC time: " + now.strftime("%d/%m/%Y %H:%M:%S")  
-       
+    
+    result["message"] = message
+    return respond(result)
+
+
+def respond(result, status_code=200):
     return {
-        'statusCode': 200,
+        'statusCode': status_code,
         'headers': {
-            'Content-Type': 'text/plain'
+            'Content-Type': 'application/json'
         },
-        'body': message
+        'body': json.dumps(result)
     }
 
 
+def start_server(store, region, profile, context, result):
+    """Reserve a slot and add a server of the size profile to the region; returns the message."""
+    pro_service = profiles.start_service(os.environ['ECS_SERVICE_NAME'], profile)
+    rtcw_cluster = os.environ['ECS_CLUSTER_NAME']
+    max_count = regions.capacity(region)
+    request_id = context.aws_request_id if context else uuid.uuid4().hex
+
+    if prewarm_enabled:
+        slot = prewarm.claim(store, request_id, profile=profile)
+        metrics.emit({"PrewarmHit": 1 if slot else 0}, {"Region": region}, unit="Count")
+        if slot:
+            result.update(slot_fields(slot), token=make_token(region, slot["number"], request_id))
+            if slot.get("ip"):
+                message = "Server is ready. Connect to " + slots.address(slot)
+            else:
+                message = "Server is already starting. Connect to " + slots.address(slot)
+            logger.info("Claimed pre-warmed slot " + str(slot["number"]) + ". " + message)
+            return message
+
+    with instrument.phase("reserve"):
+        slot = slots.reserve(store, region, os.environ["DNS_HOSTED_ZONE_NAME"], max_count, request_id, profile=profile)
+    if slot is None:
+        message = "Maximum number of servers is already in flight for this region."
+        logger.info(message)
+        return message
+
+    try:
+        ecs = get_client('ecs', region)
+        with instrument.phase("scale"):
+            desired_count = servicecount.increment(store, ecs, rtcw_cluster, pro_service, max_count)
+    except Exception:
+        slots.cancel(store, slot)
+        raise
+    if desired_count is None:
+        slots.cancel(store, slot)
+        message = "Maximum number of servers is already in flight for this region."
+        logger.info(message)
+        return message
+
+    record_start(region, context)
+    result.update(slot_fields(slot), token=make_token(region, slot["number"], request_id))
+    message = "Server requested. Takes about 2 minutes. Connect to " + slots.address(slot)
+    logger.info(message)
+    return message
+
+
+def start_nearest(event, profile, context, result):
+    """Start in the caller's closest region, or the least loaded one when that is full; returns the message.
+
+    result gets the region picked and why: "latency" (the latency table),
+    "api_region" (no table entry, the region serving the request) or
+    "least_loaded".
+    """
+    ip = nearest.client_ip(event)
+    candidates, selected = nearest.candidates(ip, regions.names(), default_region())
+    best = candidates[0]
+    logger.info("Regions for " + str(ip) + " by " + selected + ": " + ", ".join(candidates))
+    result.update(nearest=best)
+
+    tried = []
+    if region_load(best) < 1:
+        message = start_server(get_store(best), best, profile, context, result)
+        if "slot" in result:
+            result.update(region=best, selected=selected)
+            record_demand(get_store(best))
+            return "Picked " + best + ". " + message
+        tried.append(best)
+
+    others = [region for region in candidates if region not in tried]
+    with ThreadPoolExecutor(max_workers=max(1, len(others))) as pool:
+        loads = dict(zip(others, pool.map(region_load, others)))
+    # sorted() is stable, so equally loaded regions stay in latency order
+    for region in sorted(others, key=lambda region: loads[region]):
+        if loads[region] >= 1:
+            break
+        message = start_server(get_store(region), region, profile, context, result)
+        if "slot" in result:
+            result.update(region=region, selected="least_loaded")
+            record_demand(get_store(region))
+            metrics.emit({"AutoFallback": 1}, {"Region": best}, unit="Count")
+            return "Picked " + region + ", " + best + " is full. " + message
+
+    # the players were still there, count them where they would have played
+    record_demand(get_store(best))
+    message = "Every region is at its maximum number of servers."
+    logger.info(message)
+    return message
+
+
+def region_load(region):
+    """Share of the region's slots in use, 1 when it is full."""
+    return min(1.0, slots.in_use(get_store(region)) / float(regions.capacity(region)))
+
+
+def slot_fields(slot):
+    """slot, hostname and, behind a static endpoint, port of a slot for the response."""
+    fields = {"slot": slot["number"], "hostname": slot["hostname"]}
+    if slot.get("port"):
+        fields["port"] = slot["port"]
+    return fields
+
+
+def make_token(region, number, request_id):
+    return region + "." + str(number) + "." + request_id
+
+
+def wait_for_server(token):
+    """Hold the request until the server behind token is playable, up to wait_seconds.
+
+    Answers 200 with the IP once r53lambda has seen the server answer getstatus
+    and published its record, or 202 with the token to poll /wait/{token} again.
+    """
+    try:
+        region, number, request_id = token.split(".", 2)
+    except ValueError:
+        return respond({"message": "Malformed token."}, 400)
+    # the token comes from the caller, only known regions get a store and clients
+    if not regions.known(region):
+        return respond({"message": "No such server request, it may have expired or stopped."}, 404)
+    store = get_store(region)
+    deadline = time.time() + wait_seconds
+    while True:
+        slot = store.get("slot", number, consistent=True)
+        if slot is None or slot.get("request_id") != request_id:
+            return respond({"message": "No such server request, it may have expired or stopped."}, 404)
+        if slot.get("ip"):
+            return respond(dict(slot_fields(slot), region=region, ip=slot["ip"], ready=True,
+                                message="Server is ready. Connect to " + slots.address(slot)))
+        if time.time() + WAIT_INTERVAL > deadline:
+            return respond(dict(slot_fields(slot), region=region, ready=False, token=token, poll="/wait/" + token,
+                                message="Server is still starting, poll again."), 202)
+        time.sleep(WAIT_INTERVAL)
+
+
+def record_demand(store):
+    """Count the request in the start history the pre-warm forecast is made from, once per start request."""
+    try:
+        prewarm.record_request(store)
+    except Exception as ex:
+        logger.warning("Could not record start history: " + repr(ex))
+
+
+def record_start(region, context):
+    """Remember when the server was asked for, to measure time-to-playable."""
+    try:
+        request_id = context.aws_request_id if context else uuid.uuid4().hex
+        lifecycle.record_start(get_store(region), request_id=request_id)
+    except Exception as ex:
+        logger.warning("Could not record start request: " + repr(ex))
+
+
 if __name__ == "__main__":
     
     # Local testing only #
@@ -73,6 +271,8 @@ if __name__ == "__main__":
         "resource": "/start/{region}",
         "pathParameters": {
             "region": "us-east-1"
-            }
+            },
+        "headers": {"Idempotency-Key": "local-test"}
         }
     print(handler(event_api, None))
+    print(handler(event_api, None))  # same key, same answer and no extra server
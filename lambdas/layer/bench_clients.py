@@ -0,0 +1,70 @@
+"""Measure per-invocation client setup cost, before and after the client pool.
+
+"before" builds a fresh boto3 client on every simulated invocation, the way
+the lambdas used to. "after" goes through rtcwcommon.clients.get_client.
+No AWS calls are made, only client construction is timed.
+
+    python lambdas/layer/bench_clients.py --iterations 200
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "python"))
+
+SERVICES = [("ecs", "us-east-1"), ("ecs", "eu-west-2"), ("ec2", "us-east-1"), ("route53", "us-east-1")]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, samples):
+    ms = [s * 1000 for s in samples]
+    print("%-8s mean %8.3f ms  p50 %8.3f ms  p95 %8.3f ms  max %8.3f ms"
+          % (name, statistics.mean(ms), percentile(ms, 50), percentile(ms, 95), max(ms)))
+
+
+def cold_import_time(statement):
+    code = "import time; t = time.perf_counter(); %s; print(time.perf_counter() - t)" % statement
+    env = dict(os.environ, PYTHONPATH=sys.path[0])
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+    return float(out.stdout.strip())
+
+
+def run(iterations):
+    import boto3
+    from rtcwcommon import clients
+
+    before = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for service, region in SERVICES:
+            boto3.client(service, region_name=region)
+        before.append(time.perf_counter() - start)
+
+    clients.reset()
+    after = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for service, region in SERVICES:
+            clients.get_client(service, region)
+        after.append(time.perf_counter() - start)
+
+    print("Client setup per invocation (%d invocations, %d clients each):" % (iterations, len(SERVICES)))
+    report("before", before)
+    report("after", after)
+    print("Cold import: boto3 %.1f ms, rtcwcommon.clients %.1f ms"
+          % (cold_import_time("import boto3") * 1000,
+             cold_import_time("import rtcwcommon.clients") * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    run(parser.parse_args().iterations)
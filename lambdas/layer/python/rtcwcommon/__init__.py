@@ -0,0 +1 @@
+"""Code shared by the rtcwdemand lambdas, shipped as a Lambda layer."""
@@ -0,0 +1,67 @@
+"""Tournament batches: many servers across regions, started and stopped together.
+
+A batch is a "batch" item in the state store of the region that took the
+request, keyed by an id that starts with that region ("us-east-1.3f2a..."),
+so any region's API can find it. Its slots carry the batch_id and a
+batch_until hold: the idle reaper and the daily cron leave them alone (see
+held()) until the batch is torn down or the hold runs out, so empty servers
+between matches stay up for the whole event.
+"""
+import time
+import uuid
+
+DEFAULT_HOLD_HOURS = 12
+MAX_HOLD_HOURS = 48
+RETENTION = 7 * 24 * 3600
+
+
+def new_id(region):
+    return region + "." + uuid.uuid4().hex[:12]
+
+
+def home_region(batch_id):
+    """Region whose store holds the batch item, None for a malformed id."""
+    region, _, rest = batch_id.partition(".")
+    return region if rest else None
+
+
+def held(slot, now=None):
+    """True while the slot belongs to a batch that has not been torn down or run out."""
+    now = now or time.time()
+    return bool(slot.get("batch_id")) and slot.get("batch_until", 0) > now
+
+
+def record(store, batch_id, name, entries, until, now=None):
+    now = now or time.time()
+    item = {"name": name, "entries": entries, "regions": sorted({entry["region"] for entry in entries}),
+            "created_at": now, "hold_until": until, "state": "running", "expires_at": int(until + RETENTION)}
+    store.put("batch", batch_id, item)
+    return item
+
+
+def get(store, batch_id):
+    return store.get("batch", batch_id, consistent=True)
+
+
+def mark_stopped(store, batch_id, now=None):
+    item = get(store, batch_id)
+    if item:
+        item.update(state="stopped", stopped_at=now or time.time())
+        store.put("batch", batch_id, {k: v for k, v in item.items() if k not in ("pk", "sk")})
+    return item
+
+
+def servers(store, region, batch_id):
+    """Manifest entries of the batch's slots in one region, by slot number."""
+    found = []
+    for slot in sorted(store.query("slot"), key=lambda slot: slot["number"]):
+        if slot.get("batch_id") != batch_id:
+            continue
+        server = {"region": region, "slot": slot["number"], "hostname": slot["hostname"],
+                  "profile": slot.get("profile"), "ready": bool(slot.get("ip"))}
+        if slot.get("port"):
+            server["port"] = slot["port"]
+        if slot.get("ip"):
+            server["ip"] = slot["ip"]
+        found.append(server)
+    return found
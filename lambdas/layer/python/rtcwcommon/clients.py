@@ -0,0 +1,83 @@
+"""Region-keyed boto3 client pool.
+
+Clients are built on first use and kept for the life of the container, so a
+warm invocation reuses the session, the resolved endpoint and the open TLS
+connection instead of paying for them again. boto3 itself is only imported
+when the first client is requested. Every boto3 client is timed by
+rtcwcommon.instrument.
+"""
+import os
+import threading
+
+from rtcwcommon import instrument
+
+CONNECT_TIMEOUT = 2
+READ_TIMEOUT = 5
+MAX_ATTEMPTS = 5
+# services whose callers pace and retry every request themselves (rtcwcommon.dns)
+SELF_RETRYING = {"route53"}
+
+_clients = {}
+_lock = threading.Lock()
+_session = None
+_configs = {}
+_factory = None
+
+
+def default_region():
+    return os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-east-1"
+
+
+def _get_session():
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+
+def _get_config(service):
+    # one attempt and no adaptive client-side throttling, so only the caller's limiter paces them
+    retries = {"total_max_attempts": 1, "mode": "standard"} if service in SELF_RETRYING else {"max_attempts": MAX_ATTEMPTS, "mode": "adaptive"}
+    key = retries["mode"]
+    config = _configs.get(key)
+    if config is None:
+        from botocore.config import Config
+        config = _configs[key] = Config(connect_timeout=CONNECT_TIMEOUT,
+                                        read_timeout=READ_TIMEOUT,
+                                        tcp_keepalive=True,
+                                        retries=retries)
+    return config
+
+
+def get_client(service, region=None):
+    """Return a cached client for (service, region), creating it if needed."""
+    key = (service, region or default_region())
+    client = _clients.get(key)
+    if client is None:
+        # sessions are not thread safe, so creation is serialised
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                if _factory:
+                    client = _factory(service, key[1])
+                else:
+                    client = instrument.attach(_get_session().client(service, region_name=key[1], config=_get_config(service)), service)
+                _clients[key] = client
+    return client
+
+
+def reset():
+    """Forget all cached clients. Only meant for benchmarks and local runs."""
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
+
+
+def use_factory(factory):
+    """Build clients with factory(service, region) instead of boto3, e.g. fakes
+    for the load simulator. None goes back to boto3."""
+    global _factory
+    reset()
+    _factory = factory
@@ -0,0 +1,200 @@
+"""Route53 record changes for game server hostnames.
+
+Producers call submit(), which puts a DNS intent on the rtcwdemand DNS queue
+when DNS_QUEUE_URL is set and applies it directly otherwise. The queue
+consumers coalesce intents per hosted zone (last writer wins per record
+name) and apply each zone's changes as one ChangeBatch. Every Route53
+request goes through call(), which paces it with a token bucket holding the
+process's share of the per-account request rate and is the only place that
+retries throttling: the route53 clients are built without botocore retries.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from rtcwcommon.clients import get_client
+
+logger = logging.getLogger("rtcwcommon.dns")
+
+TTL = 60
+COMMENT = "RTCW server"
+# Route53 allows 5 requests per second per account, the DNS queue's consumers share it
+RATE_PER_SECOND = float(os.environ.get("DNS_RATE_PER_SECOND", "4"))
+MAX_ATTEMPTS = 6
+RETRYABLE_ERRORS = ("Throttling", "ThrottlingException", "PriorRequestNotComplete")
+
+
+class TokenBucket:
+    """Blocking token bucket; acquire() waits until a token is available."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """Empty the bucket, e.g. after being throttled anyway."""
+        with self.lock:
+            self._refill()
+            self.tokens = 0
+
+
+bucket = TokenBucket(RATE_PER_SECOND)
+
+
+def record_change(action, name, ip, ttl=TTL):
+    return {"Action": action,
+            "ResourceRecordSet": {"Name": name,
+                                  "Type": "A",
+                                  "TTL": ttl,
+                                  "ResourceRecords": [{"Value": ip}]}}
+
+
+def make_intent(action, name, ip, zone_id=None, updated_at=None):
+    """Describe a change; updated_at orders intents for the same name."""
+    return {"action": action,
+            "name": name,
+            "ip": ip,
+            "zone": zone_id or os.environ["DNS_HOSTED_ZONE"],
+            "updated_at": updated_at or time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())}
+
+
+def coalesce(intents):
+    """Group intents by zone, keeping only the latest intent per record name.
+
+    Returns {zone_id: [intent, ...]}. Intents with equal timestamps keep the
+    one seen last.
+    """
+    latest = {}
+    for intent in intents:
+        key = (intent["zone"], intent["name"].rstrip(".").lower())
+        current = latest.get(key)
+        if current is None or intent["updated_at"] >= current["updated_at"]:
+            latest[key] = intent
+    zones = {}
+    for (zone, _), intent in sorted(latest.items()):
+        zones.setdefault(zone, []).append(intent)
+    return zones
+
+
+def _error_code(err):
+    return getattr(err, "response", {}).get("Error", {}).get("Code", "")
+
+
+def _is_benign(change, err):
+    action = change["Action"]
+    # a DELETE whose value no longer matches lost to a newer change of the record
+    return ((action == "DELETE" and ("but it was not found" in str(err) or "values provided do not match" in str(err)))
+            or (action == "CREATE" and "but it already exists" in str(err)))
+
+
+def call(operation, **kwargs):
+    """Make a Route53 request, e.g. call("list_resource_record_sets", HostedZoneId=...).
+
+    Every attempt waits for a token; throttled attempts empty the bucket and
+    back off before the next one.
+    """
+    from botocore.exceptions import ClientError
+    method = getattr(get_client("route53"), operation)
+    for attempt in range(MAX_ATTEMPTS):
+        bucket.acquire()
+        try:
+            return method(**kwargs)
+        except ClientError as err:
+            if _error_code(err) not in RETRYABLE_ERRORS or attempt == MAX_ATTEMPTS - 1:
+                raise
+            logger.info("Route53 throttled, retrying: " + _error_code(err))
+            bucket.drain()
+            time.sleep(min(2 ** attempt * 0.2, 5))
+
+
+def _change_batch(zone_id, changes):
+    call("change_resource_record_sets", HostedZoneId=zone_id, ChangeBatch={"Changes": changes, "Comment": COMMENT})
+
+
+def failed_changes(zone_id, changes):
+    """Apply changes to one zone in a single ChangeBatch; returns the changes that failed.
+
+    Route53 rejects the whole batch when one change is invalid (e.g. deleting
+    a record that is already gone), so on InvalidChangeBatch the changes are
+    retried one by one and benign failures ignored.
+    """
+    if not changes:
+        return []
+    from botocore.exceptions import ClientError
+    try:
+        _change_batch(zone_id, changes)
+        logger.info("Applied " + str(len(changes)) + " record change(s) to " + zone_id)
+        return []
+    except ClientError as err:
+        if len(changes) == 1 and _is_benign(changes[0], err):
+            logger.info("Record change was a no-op: " + str(err))
+            return []
+        if _error_code(err) != "InvalidChangeBatch" or len(changes) == 1:
+            logger.error(err)
+            return list(changes)
+
+    failed = []
+    for change in changes:
+        failed.extend(failed_changes(zone_id, [change]))
+    return failed
+
+
+def apply_changes(zone_id, changes):
+    """Apply changes to one zone; True when every change was applied or was a no-op."""
+    return not failed_changes(zone_id, changes)
+
+
+def apply_intents(intents):
+    """Coalesce and apply intents. Returns the intents that failed.
+
+    Intents superseded by a later one for the same record are dropped, they
+    count as applied.
+    """
+    failed = []
+    for zone_id, zone_intents in coalesce(intents).items():
+        changes = [record_change(i["action"], i["name"], i["ip"]) for i in zone_intents]
+        failures = failed_changes(zone_id, changes)
+        failed.extend(intent for intent, change in zip(zone_intents, changes) if any(change is f for f in failures))
+    return failed
+
+
+def _queue_region(queue_url):
+    # https://sqs.<region>.amazonaws.com/<account>/<name>
+    return queue_url.split("/")[2].split(".")[1]
+
+
+def submit(action, name, ip, zone_id=None, updated_at=None):
+    """Queue a record change, or apply it directly when no queue is configured.
+
+    Producers run in every region at any concurrency, so with a queue they
+    never write to Route53 themselves: only the consumers, whose buckets
+    split the account's rate, do.
+    """
+    intent = make_intent(action, name, ip, zone_id, updated_at)
+    queue_url = os.environ.get("DNS_QUEUE_URL")
+    if not queue_url:
+        return not apply_intents([intent])
+    sqs = get_client("sqs", _queue_region(queue_url))
+    sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps(intent))
+    logger.info("Queued record change: " + action + " " + name + " " + ip)
+    return True
@@ -0,0 +1,66 @@
+"""Static endpoint of a region: a UDP Network Load Balancer with Elastic IPs.
+
+Slot n listens on its own port of the load balancer and forwards to its own
+target group, so the slot's hostname is a fixed A record of the Elastic IPs
+and a new server only has to be registered, not published in DNS.
+
+The stack passes the endpoint in STATIC_ENDPOINT as JSON,
+{"ips": [...], "target_groups": [slot 1 arn, slot 2 arn, ...]}; without it
+the region publishes every server's own IP (see rtcwcommon.dns).
+"""
+import json
+import logging
+import os
+
+from rtcwcommon.clients import get_client
+
+logger = logging.getLogger("rtcwcommon.endpoint")
+
+
+def config():
+    value = os.environ.get("STATIC_ENDPOINT")
+    return json.loads(value) if value else None
+
+
+def enabled():
+    return config() is not None
+
+
+def ip():
+    """The address readiness checks go through."""
+    return config()["ips"][0]
+
+
+def target_group(number):
+    return config()["target_groups"][number - 1]
+
+
+def private_ip(detail):
+    """Private IP of a task from its ECS Task State Change detail."""
+    for attachment in detail.get("attachments", []):
+        for keypair in attachment.get("details", []):
+            if keypair["name"] == "privateIPv4Address":
+                return keypair["value"]
+    return None
+
+
+def register(region, number, address, port):
+    """Point slot number's target group at address, removing whatever it pointed at before.
+
+    A target left behind by a task whose STOPPED event was lost would otherwise
+    get a share of the players. Returns the target group arn.
+    """
+    arn = target_group(number)
+    elbv2 = get_client('elbv2', region)
+    current = elbv2.describe_target_health(TargetGroupArn=arn)["TargetHealthDescriptions"]
+    stale = [description["Target"] for description in current if description["Target"]["Id"] != address]
+    if stale:
+        logger.info("Removing " + str(len(stale)) + " stale target(s) of slot " + str(number) + ".")
+        elbv2.deregister_targets(TargetGroupArn=arn, Targets=stale)
+    elbv2.register_targets(TargetGroupArn=arn, Targets=[{"Id": address, "Port": port}])
+    return arn
+
+
+def deregister(region, arn, address, port):
+    get_client('elbv2', region).deregister_targets(TargetGroupArn=arn, Targets=[{"Id": address, "Port": port}])
+    return True
@@ -0,0 +1,54 @@
+"""Idempotency keys for start requests.
+
+The first request with a key records "pending", then the response it
+returned. A retry with the same key inside the window gets that response
+back instead of launching another server.
+"""
+import time
+
+from rtcwcommon.state import ConditionFailed
+
+WINDOW = 120
+PENDING_TIMEOUT = 30
+
+
+class InProgress(Exception):
+    """Another request with the same key has not finished yet."""
+
+
+def begin(store, key, now=None):
+    """Claim a key. Returns the earlier response when the key was already used."""
+    now = now or time.time()
+    existing = store.get("idem", key, consistent=True)
+    if existing and existing["expires_at"] > now:
+        if "response" in existing:
+            return existing["response"]
+        if existing["started_at"] > now - PENDING_TIMEOUT:
+            raise InProgress(key)
+    expected = {"expires_at": existing["expires_at"]} if existing else {"pk": None}
+    try:
+        store.put_if("idem", key, {"started_at": now, "expires_at": int(now + WINDOW)}, expected)
+    except ConditionFailed:
+        raise InProgress(key)
+    return None
+
+
+def finish(store, key, response, now=None):
+    now = now or time.time()
+    store.put("idem", key, {"started_at": now, "response": response, "expires_at": int(now + WINDOW)})
+
+
+def abandon(store, key):
+    """Forget a key whose request failed, so a retry can run."""
+    store.delete("idem", key)
+
+
+def key_from_event(event, scope):
+    """The caller's Idempotency-Key header, or None.
+
+    Requests without one are never deduplicated: callers behind one address
+    (a chat bot, a NAT) would otherwise get each other's servers.
+    """
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    key = headers.get("idempotency-key")
+    return scope + "#" + key if key else None
@@ -0,0 +1,205 @@
+"""Per-call latency of AWS requests and handler phases, published as EMF.
+
+clients.get_client() hooks every boto3 client into botocore's event system,
+so each API call is timed along with its retries and throttles without
+touching the call sites. Handlers wrapped with @instrument.handler("name")
+flush what their invocation collected as a single EMF line:
+
+    {"Function": "ecslambda", "HandlerTime": 184.2,
+     "AwsCallTime": [12.1, 30.4, ...], "AwsRetries": 1, "AwsThrottles": 1, ...}
+
+plus one line per AWS operation and handler phase (see phase()), so
+CloudWatch has p50/p99 per operation.
+
+Only a sample of invocations is flushed (INSTRUMENT_SAMPLE_RATE, default
+0.1); invocations with an error, retry or throttle are always flushed. Tests
+and the load simulator swap the stdout exporter for a MemoryExporter.
+
+Lambda runs one invocation per container at a time, so collection is per
+process; calls made on worker threads land in the same invocation.
+"""
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from rtcwcommon import metrics
+
+THROTTLE_ERRORS = ("Throttling", "ThrottlingException", "ThrottledException", "RequestLimitExceeded",
+                   "TooManyRequestsException", "ProvisionedThroughputExceededException", "PriorRequestNotComplete")
+
+_lock = threading.Lock()
+_calls = {}   # "service:Operation" -> [latencies in ms]
+_phases = {}  # phase -> [latencies in ms]
+_counts = {"AwsRetries": 0, "AwsThrottles": 0, "AwsErrors": 0}
+
+
+def sample_rate():
+    return float(os.environ.get("INSTRUMENT_SAMPLE_RATE", "0.1"))
+
+
+class StdoutExporter:
+    """Writes the EMF lines to the function's log stream."""
+
+    def export(self, lines):
+        if lines:
+            sys.stdout.write("\n".join(lines) + "\n")
+            sys.stdout.flush()
+
+
+class MemoryExporter:
+    """Keeps the EMF lines, for tests and the load simulator."""
+
+    def __init__(self):
+        self.lines = []
+
+    def export(self, lines):
+        self.lines.extend(lines)
+
+    def values(self, name):
+        """Every value exported for metric name, flattened."""
+        found = []
+        for line in self.lines:
+            value = json.loads(line).get(name)
+            if isinstance(value, list):
+                found.extend(value)
+            elif value is not None:
+                found.append(value)
+        return found
+
+
+_exporter = StdoutExporter()
+
+
+def use_exporter(exporter):
+    """Send flushed lines to exporter; returns the previous one."""
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+
+def record_call(operation, milliseconds):
+    with _lock:
+        _calls.setdefault(operation, []).append(round(milliseconds, 2))
+
+
+def count(name, value=1):
+    with _lock:
+        _counts[name] += value
+
+
+class phase:
+    """Times a block of a handler: `with instrument.phase("reserve"): ...`."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = (time.perf_counter() - self.started) * 1000
+        with _lock:
+            _phases.setdefault(self.name, []).append(round(elapsed, 2))
+
+
+def _collected():
+    with _lock:
+        calls, phases, counts = dict(_calls), dict(_phases), dict(_counts)
+        _calls.clear()
+        _phases.clear()
+        for name in _counts:
+            _counts[name] = 0
+    return calls, phases, counts
+
+
+def flush(function, handler_ms=None, failed=False, force=False):
+    """Export what was collected since the last flush; returns the lines."""
+    calls, phases, counts = _collected()
+    # conditional write failures are part of normal operation, retries and throttles are not
+    eventful = failed or counts["AwsRetries"] or counts["AwsThrottles"]
+    if not (force or eventful or random.random() < sample_rate()):
+        return []
+    summary = dict(counts, AwsCallTime=[value for values in calls.values() for value in values])
+    if handler_ms is not None:
+        summary["HandlerTime"] = round(handler_ms, 2)
+    if failed:
+        summary["HandlerErrors"] = 1
+    summary = {name: value for name, value in summary.items() if value not in ([], None)}
+    units = {name: "Count" for name in counts}
+    units["HandlerErrors"] = "Count"
+    lines = [metrics.emf_line(summary, {"Function": function}, unit=units, properties={"sampleRate": sample_rate()})]
+    for operation, values in sorted(calls.items()):
+        lines.append(metrics.emf_line({"AwsCallTime": values}, {"Function": function, "Operation": operation}))
+    for name, values in sorted(phases.items()):
+        lines.append(metrics.emf_line({"PhaseTime": values}, {"Function": function, "Phase": name}))
+    _exporter.export(lines)
+    return lines
+
+
+def handler(function):
+    """Decorator timing a lambda handler and flushing its metrics when it returns."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            _collected()  # drop anything left from module import or an earlier crash
+            started = time.perf_counter()
+            failed = False
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                try:
+                    flush(function, (time.perf_counter() - started) * 1000, failed)
+                except Exception:
+                    pass  # metrics never fail an invocation
+        return wrapper
+    return decorate
+
+
+def attach(client, service):
+    """Time every call of a boto3 client through botocore's event hooks."""
+    events = client.meta.events
+
+    def before_call(model, context, **kwargs):
+        context["rtcw_operation"] = service + ":" + model.name
+        context["rtcw_started"] = time.perf_counter()
+
+    def finished(context, response_metadata):
+        started = context.get("rtcw_started")
+        if started is not None:
+            record_call(context["rtcw_operation"], (time.perf_counter() - started) * 1000)
+        retries = response_metadata.get("RetryAttempts", 0)
+        if retries:
+            count("AwsRetries", retries)
+
+    def after_call(context, parsed=None, **kwargs):
+        # also emitted for error responses, the client raises right after
+        parsed = parsed or {}
+        finished(context, parsed.get("ResponseMetadata", {}))
+        if "Error" in parsed:
+            count("AwsErrors")
+
+    def after_call_error(context, exception=None, **kwargs):
+        # the request itself failed, e.g. a connection error after the last retry
+        finished(context, {})
+        count("AwsErrors")
+
+    def needs_retry(response=None, **kwargs):
+        # runs before botocore's own retry handler; returning None leaves the decision to it
+        if response is not None and response[1].get("Error", {}).get("Code") in THROTTLE_ERRORS:
+            count("AwsThrottles")
+        return None
+
+    # event names are hierarchical, "before-call" matches every operation of the client
+    events.register("before-call", before_call)
+    events.register("after-call", after_call)
+    events.register("after-call-error", after_call_error)
+    events.register_first("needs-retry", needs_retry)
+    return client
@@ -0,0 +1,126 @@
+"""Time-to-playable breakdown of a server start.
+
+Phases, in order:
+    queue  - start request (or task creation) until the image pull starts
+    pull   - image pull
+    boot   - pull finished until the container is started
+    ready  - container started until the server answers getstatus
+    dns    - ready (or started, when it never answered) until its record is published
+    total  - start request (or task creation) until the record is published
+
+Start requests are stored by ecslambda as "start" items in the region's
+state store; r53lambda claims the oldest unclaimed one when a task comes up
+and stores the result as a "lifecycle" item keyed by task ARN.
+"""
+import time
+import uuid
+from datetime import datetime, timezone
+
+PHASES = ["queue", "pull", "boot", "ready", "dns", "total"]
+START_RETENTION = 24 * 3600
+LIFECYCLE_RETENTION = 90 * 24 * 3600
+MAX_START_AGE = 30 * 60  # a start request older than this is not matched to a task
+CLOCK_SKEW = 5
+
+
+def parse_time(value):
+    """Epoch seconds from an ECS timestamp such as 2021-07-07T19:37:27.169Z."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        # describe_tasks returns datetimes, events strings
+        return value.timestamp()
+    value = value.replace("Z", "")
+    if "." in value:
+        # fromisoformat on 3.8 only takes 3 or 6 fractional digits
+        whole, fraction = value.split(".", 1)
+        value = whole + "." + (fraction + "000000")[:6]
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+def format_time(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def record_start(store, requested_at=None, request_id=None, **extra):
+    """Remember a start request so the task it causes can be timed from it."""
+    requested_at = requested_at or time.time()
+    sk = format_time(requested_at) + "#" + (request_id or uuid.uuid4().hex)
+    item = dict(extra, requested_at=requested_at, expires_at=int(requested_at + START_RETENTION))
+    store.put("start", sk, item)
+    return sk
+
+
+def claim_start(store, task_arn, created_at):
+    """Match a task to the oldest unclaimed start request made before it was created."""
+    for item in store.query("start"):
+        requested_at = item["requested_at"]
+        if item.get("claimed_by") or requested_at > created_at + CLOCK_SKEW:
+            continue
+        if requested_at < created_at - MAX_START_AGE:
+            continue
+        item["claimed_by"] = task_arn
+        store.put("start", item["sk"], {k: v for k, v in item.items() if k not in ("pk", "sk")})
+        return item
+    return None
+
+
+def phases(detail, requested_at=None, published_at=None, ready_at=None):
+    """Phase durations in milliseconds from an ECS task detail."""
+    created = parse_time(detail.get("createdAt"))
+    pull_started = parse_time(detail.get("pullStartedAt"))
+    pull_stopped = parse_time(detail.get("pullStoppedAt"))
+    started = parse_time(detail.get("startedAt"))
+    origin = requested_at or created
+
+    def span(begin, end):
+        if begin is None or end is None:
+            return None
+        return max(0, int((end - begin) * 1000))
+
+    result = {"queue": span(origin, pull_started),
+              "pull": span(pull_started, pull_stopped),
+              "boot": span(pull_stopped, started),
+              "ready": span(started, ready_at),
+              "dns": span(ready_at or started, published_at),
+              "total": span(origin, published_at)}
+    return {name: value for name, value in result.items() if value is not None}
+
+
+def record_lifecycle(store, task_arn, region, detail, requested_at=None, published_at=None, ready_at=None):
+    item = {"region": region,
+            "requested_at": requested_at,
+            "created_at": parse_time(detail.get("createdAt")),
+            "ready_at": ready_at,
+            "published_at": published_at,
+            "phases": phases(detail, requested_at, published_at, ready_at),
+            "expires_at": int(time.time() + LIFECYCLE_RETENTION)}
+    store.put("lifecycle", task_arn, item)
+    return item
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile; values need not be sorted."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, int(-(-pct * len(ordered) // 100)))
+    return ordered[rank - 1]
+
+
+def summarize(records):
+    """{region: {phase: {"count", "p50", "p95"}}} from lifecycle items."""
+    samples = {}
+    for record in records:
+        region_samples = samples.setdefault(record["region"], {})
+        for phase, value in record.get("phases", {}).items():
+            region_samples.setdefault(phase, []).append(value)
+    summary = {}
+    for region, region_samples in samples.items():
+        summary[region] = {phase: {"count": len(values),
+                                   "p50": percentile(values, 50),
+                                   "p95": percentile(values, 95)}
+                           for phase, values in region_samples.items()}
+    return summary
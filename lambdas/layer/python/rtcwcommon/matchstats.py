@@ -0,0 +1,192 @@
+"""Round stats out of the game server's log stream, stored as columnar files.
+
+With STATS_SUBMIT=1 RTCWPro prints each round's stats as a JSON document,
+often over many log lines:
+
+    {"serverinfo": {...}, "gameinfo": {"match_id": "...", "round": "1", "map": "te_escape2", ...},
+     "stats": [{"<guid>": {"alias": "...", "team": "Axis", "categories": {"kills": 12, ...}}}, ...]}
+
+StreamParser picks those documents out of one log stream line by line; the
+lines of an unfinished document are handed back by pending() so the next
+batch can carry on. rows() flattens a round to one row per player with the
+columns of SCHEMA, and write() stores rows as Parquet (DEFAULT_FORMAT, needs
+pyarrow, which the stack ships as a layer) or as gzipped JSON lines, under
+matches/region=<region>/date=<YYYY-MM-DD>/, the partition layout Athena and
+Glue expect. S3Sink writes to a bucket, LocalSink to a directory.
+"""
+import gzip
+import io
+import json
+import os
+import time
+import uuid
+
+# the pending lines are kept in one state store item, and DynamoDB items hold 400KB
+MAX_DOCUMENT_BYTES = 300 * 1024
+PREFIX = "matches/"
+FORMATS = ("parquet", "json")
+DEFAULT_FORMAT = "parquet"
+
+# (column, type) of every row; categories missing from a round are null
+SCHEMA = [("match_id", "string"), ("round", "int"), ("map", "string"), ("winner", "string"),
+          ("round_start", "int"), ("round_end", "int"), ("region", "string"), ("server", "string"),
+          ("logged_at", "int"), ("guid", "string"), ("alias", "string"), ("team", "string"),
+          ("kills", "int"), ("deaths", "int"), ("gibs", "int"), ("suicides", "int"), ("teamkills", "int"),
+          ("headshots", "int"), ("damagegiven", "int"), ("damagereceived", "int"), ("damageteam", "int"),
+          ("hits", "int"), ("shots", "int"), ("revives", "int"), ("ammogiven", "int"), ("healthgiven", "int"),
+          ("score", "int"), ("accuracy", "float")]
+# the player's "categories", after the round and player columns
+CATEGORIES = SCHEMA[12:]
+
+
+class StreamParser:
+    """Finds the stats documents in the lines of one log stream."""
+
+    def __init__(self, pending=None):
+        self.lines = []
+        self.depth = 0
+        self.size = 0
+        for line in pending or []:
+            self.feed(line)
+
+    def feed(self, line):
+        """The stats documents line completes, usually none."""
+        if not self.lines and not line.lstrip().startswith("{"):
+            return []
+        self.lines.append(line)
+        self.size += len(line.encode()) + 1
+        in_string = escaped = False
+        for char in line:
+            if escaped:
+                escaped = False
+            elif char == "\\" and in_string:
+                escaped = True
+            elif char == '"':
+                in_string = not in_string
+            elif not in_string and char == "{":
+                self.depth += 1
+            elif not in_string and char == "}":
+                self.depth -= 1
+        if self.depth > 0:
+            if self.size > MAX_DOCUMENT_BYTES:
+                self.reset()
+            return []
+        text = "\n".join(self.lines)
+        self.reset()
+        try:
+            document = json.loads(text)
+        except ValueError:
+            return []
+        return [document] if is_round(document) else []
+
+    def reset(self):
+        self.lines = []
+        self.depth = 0
+        self.size = 0
+
+    def pending(self):
+        """Lines of the document still open at the end of the batch."""
+        return list(self.lines)
+
+
+def is_round(document):
+    return isinstance(document, dict) and "stats" in document and "gameinfo" in document
+
+
+def _number(value, kind):
+    try:
+        return float(value) if kind == "float" else int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def players(document):
+    """(guid, player stats) of a round; "stats" is a list of {guid: stats} or one such dict."""
+    stats = document.get("stats") or []
+    for entry in (stats if isinstance(stats, list) else [stats]):
+        for guid, player in (entry or {}).items():
+            if isinstance(player, dict):
+                yield guid, player
+
+
+def rows(document, region, server, logged_at):
+    """One row per player of a round document; logged_at is the log event's time in ms."""
+    game = document.get("gameinfo") or {}
+    base = {"match_id": str(game.get("match_id") or document.get("match_id") or ""),
+            "round": _number(game.get("round"), "int"),
+            "map": game.get("map"),
+            "winner": game.get("winner"),
+            "round_start": _number(game.get("round_start"), "int"),
+            "round_end": _number(game.get("round_end"), "int"),
+            "region": region,
+            "server": server,
+            "logged_at": int(logged_at)}
+    result = []
+    for guid, player in players(document):
+        categories = player.get("categories") or {}
+        row = dict(base, guid=guid, alias=player.get("alias"), team=player.get("team"))
+        for name, kind in CATEGORIES:
+            row[name] = _number(categories.get(name), kind)
+        result.append(row)
+    return result
+
+
+def encode(rows, format=DEFAULT_FORMAT):
+    """(bytes, file extension) of rows as Parquet or gzipped JSON lines; Parquet needs pyarrow."""
+    if format == "json":
+        lines = "".join(json.dumps({name: row.get(name) for name, kind in SCHEMA}, separators=(",", ":")) + "\n"
+                        for row in rows)
+        return gzip.compress(lines.encode()), "json.gz"
+    import pyarrow
+    import pyarrow.parquet
+    types = {"string": pyarrow.string(), "int": pyarrow.int64(), "float": pyarrow.float64()}
+    table = pyarrow.table({name: pyarrow.array([row.get(name) for row in rows], type=types[kind]) for name, kind in SCHEMA})
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(table, buffer, compression="zstd")
+    return buffer.getvalue(), "parquet"
+
+
+def partition(row):
+    return (row["region"], time.strftime("%Y-%m-%d", time.gmtime(row["logged_at"] / 1000.0)))
+
+
+def write(sink, rows, format=DEFAULT_FORMAT, name=None):
+    """Store rows with one file per region and date; returns the keys written.
+
+    With a name the keys are the same every time, so writing a batch again
+    replaces its files instead of adding copies.
+    """
+    name = name or uuid.uuid4().hex[:8]
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(partition(row), []).append(row)
+    keys = []
+    for (region, date), part in sorted(partitions.items()):
+        body, extension = encode(part, format)
+        key = PREFIX + "region=" + region + "/date=" + date + "/" + str(part[0]["logged_at"]) + "-" + name + "." + extension
+        sink.write(key, body)
+        keys.append(key)
+    return keys
+
+
+class S3Sink:
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+
+    def write(self, key, body):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body)
+
+
+class LocalSink:
+    """Writes under a directory, for tests and tools/match_stats.py."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def write(self, key, body):
+        path = os.path.join(self.directory, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fp:
+            fp.write(body)
@@ -0,0 +1,38 @@
+"""CloudWatch Embedded Metric Format (EMF) output.
+
+A metric is published by printing one JSON line to the function's log
+stream; CloudWatch extracts the values asynchronously, so emitting costs no
+API call.
+"""
+import json
+import sys
+import time
+
+NAMESPACE = "rtcwdemand"
+
+
+def emf_line(metrics, dimensions, unit="Milliseconds", namespace=NAMESPACE, properties=None):
+    """Build an EMF document for metrics ({name: value}) under one dimension set.
+
+    unit applies to every metric, or is a {name: unit} map defaulting to Milliseconds.
+    """
+    document = dict(properties or {})
+    document.update(dimensions)
+    document.update(metrics)
+    document["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [{
+            "Namespace": namespace,
+            "Dimensions": [sorted(dimensions)],
+            "Metrics": [{"Name": name, "Unit": unit.get(name, "Milliseconds") if isinstance(unit, dict) else unit}
+                        for name in sorted(metrics)]
+        }]
+    }
+    return json.dumps(document, separators=(",", ":"))
+
+
+def emit(metrics, dimensions, unit="Milliseconds", namespace=NAMESPACE, properties=None):
+    if not metrics:
+        return
+    sys.stdout.write(emf_line(metrics, dimensions, unit, namespace, properties) + "\n")
+    sys.stdout.flush()
@@ -0,0 +1,73 @@
+"""Nearest region for a client IP, from an IPv4 prefix -> region latency table.
+
+tools/build_latency_table.py builds the table offline from round trip
+measurements and writes it next to ecslambda's main.py:
+
+    {"built_at": "...", "ranges": [[first, last, ["eu-west-2", "us-east-1"]], ...]}
+
+first and last are integer IPv4 addresses; ranges are sorted and disjoint,
+each with its regions from lowest to highest latency. The table is loaded
+once per container and searched with bisect. Addresses it does not cover
+(and IPv6 clients) get no ranking.
+"""
+import bisect
+import ipaddress
+import json
+import os
+
+DEFAULT_PATH = "latency_table.json"
+
+_tables = {}
+
+
+def load(path=None):
+    """(range starts, ranges) of the table at path, or empty ones when there is none."""
+    path = path or os.environ.get("LATENCY_TABLE", DEFAULT_PATH)
+    if path not in _tables:
+        try:
+            with open(path) as fp:
+                ranges = json.load(fp)["ranges"]
+        except (OSError, ValueError, KeyError):
+            ranges = []
+        _tables[path] = ([first for first, last, regions in ranges], ranges)
+    return _tables[path]
+
+
+def ranking(ip, path=None):
+    """Regions by latency for ip, or None when the table does not cover it."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if address.version != 4:
+        return None
+    starts, ranges = load(path)
+    number = int(address)
+    index = bisect.bisect_right(starts, number) - 1
+    if index >= 0 and ranges[index][1] >= number:
+        return ranges[index][2]
+    return None
+
+
+def client_ip(event):
+    """Caller's address from an API Gateway event (or "source_ip" of an invoke event).
+
+    X-Forwarded-For is not read: its first entry is whatever the client sent.
+    """
+    source_ip = ((event.get("requestContext") or {}).get("identity") or {}).get("sourceIp")
+    if source_ip:
+        return source_ip
+    return event.get("source_ip") if "requestContext" not in event else None
+
+
+def candidates(ip, known, local_region, path=None):
+    """Regions to try for ip, best first, limited to known ones.
+
+    Without a table entry the region serving the request comes first, since
+    latency routing on the API already picked it as the caller's closest.
+    """
+    ranked = [region for region in (ranking(ip, path) or []) if region in known]
+    chosen_by = "latency" if ranked else "api_region"
+    if not ranked and local_region in known:
+        ranked = [local_region]
+    return ranked + [region for region in known if region not in ranked], chosen_by
@@ -0,0 +1,193 @@
+"""Predictive pre-warming from the history of start requests.
+
+Every user start request is counted per region, week and hour-of-week
+("history" items, kept for HISTORY_WEEKS). The prewarm lambda looks at the
+hour starting a few minutes ahead; when starts came in that hour in enough
+of the past weeks it launches servers into slots marked with a prewarm_id.
+A user start then claims such a slot instead of launching a new server. An
+unclaimed one is held until prewarm_until and then stopped by the idle
+reaper like any empty server.
+
+Each launch is a "prewarm" item, updated when the server is claimed and
+when it stops, from which summarize() derives the hit rate, the server
+minutes spent waiting and the start latency saved.
+"""
+import math
+import time
+from datetime import datetime, timezone
+
+from rtcwcommon import lifecycle, servicecount, slots
+from rtcwcommon.state import ConditionFailed
+
+HISTORY_WEEKS = 8
+MIN_WEEKS = 2
+WEEK = 7 * 24 * 3600
+FIRST_MONDAY = 4 * 24 * 3600  # 1970-01-05, the epoch was a Thursday
+PREWARM_RETENTION = 90 * 24 * 3600
+
+
+def week_start(epoch):
+    return epoch - (epoch - FIRST_MONDAY) % WEEK
+
+
+def hour_of_week(epoch):
+    """0 for Monday 00:00-01:00 UTC up to 167 for Sunday 23:00."""
+    return int((epoch - FIRST_MONDAY) % WEEK // 3600)
+
+
+def _week_id(epoch):
+    return datetime.fromtimestamp(week_start(epoch), timezone.utc).strftime("%Y-%m-%d")
+
+
+def hour_key(epoch):
+    """"<monday of the week>#<hour of week>", e.g. 2021-07-05#043."""
+    return _week_id(epoch) + "#%03d" % hour_of_week(epoch)
+
+
+def _week_epoch(week_id):
+    return datetime.strptime(week_id, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+def record_request(store, now=None):
+    """Count a user start request in its week and hour-of-week."""
+    now = now or time.time()
+    store.add("history", hour_key(now), "starts", 1, expires_at=int(now + (HISTORY_WEEKS + 1) * WEEK))
+
+
+def forecast(items, now=None, weeks=HISTORY_WEEKS):
+    """{hour of week: {"probability", "starts"}} over the complete weeks of history.
+
+    probability is the share of weeks with at least one start in that hour,
+    starts the average number of starts in the weeks that had any.
+    """
+    now = now or time.time()
+    current = week_start(now)
+    per_hour = {}
+    oldest = None
+    for item in items:
+        week_id, hour = item["sk"].split("#")
+        week = _week_epoch(week_id)
+        if week >= current or week < current - weeks * WEEK:
+            continue
+        oldest = week if oldest is None else min(oldest, week)
+        per_hour.setdefault(int(hour), []).append(item["starts"])
+    if oldest is None:
+        return {}
+    observed = int(round((current - oldest) / WEEK))
+    if observed < MIN_WEEKS:
+        return {}
+    return {hour: {"probability": len(counts) / float(observed), "starts": sum(counts) / float(len(counts))}
+            for hour, counts in per_hour.items()}
+
+
+def servers_for(prediction, threshold, max_servers):
+    """Servers to launch ahead of an hour, 0 when demand is not likely enough."""
+    if not prediction or prediction["probability"] < threshold:
+        return 0
+    return max(1, min(max_servers, int(math.ceil(prediction["starts"] - 0.5))))
+
+
+def launch(store, ecs, cluster, service, region, zone_name, capacity, hour_key, index, hold_seconds, now=None, profile=None):
+    """Pre-launch one server for hour_key ("<week>#<hour>"); None if it already was or there is no room."""
+    now = now or time.time()
+    prewarm_id = hour_key + "#" + str(index)
+    record = {"region": region, "hour": int(hour_key.split("#")[1]), "launched_at": now,
+              "expires_at": int(now + PREWARM_RETENTION)}
+    try:
+        store.put_if("prewarm", prewarm_id, record, {"pk": None})
+    except ConditionFailed:
+        return None
+
+    attributes = {"prewarm_id": prewarm_id, "prewarm_until": now + hold_seconds}
+    if profile:
+        attributes["profile"] = profile
+    slot = slots.reserve(store, region, zone_name, capacity, "prewarm-" + prewarm_id, now, **attributes)
+    if slot is None:
+        store.put("prewarm", prewarm_id, dict(record, skipped="full"))
+        return None
+    try:
+        desired_count = servicecount.increment(store, ecs, cluster, service, capacity)
+    except Exception:
+        slots.cancel(store, slot)
+        store.delete("prewarm", prewarm_id)
+        raise
+    if desired_count is None:
+        slots.cancel(store, slot)
+        store.put("prewarm", prewarm_id, dict(record, skipped="full"))
+        return None
+    store.put("prewarm", prewarm_id, dict(record, slot=slot["number"]))
+    # time the launch like a start request, so it does not take a user's
+    lifecycle.record_start(store, now, "prewarm-" + prewarm_id, prewarm_id=prewarm_id)
+    return slot
+
+
+def claim(store, request_id, now=None, profile=None):
+    """Hand an unclaimed pre-warmed slot (of the size profile) to a user start; None when there is none.
+
+    The server's idle time starts over, so the idle reaper gives the user a
+    full idle window to join a server that has been empty since launch.
+    """
+    now = now or time.time()
+    candidates = [slot for slot in store.query("slot") if slot.get("prewarm_id") and not slot.get("claimed_by")
+                  and (profile is None or slot.get("profile") in (None, profile))]
+    # a server that is already up first
+    candidates.sort(key=lambda slot: (not slot.get("ip"), slot["number"]))
+    for slot in candidates:
+        claimed = dict(slot, request_id=request_id, claimed_by=request_id, claimed_at=now)
+        del claimed["pk"], claimed["sk"]
+        try:
+            store.put_if("slot", slot["sk"], claimed,
+                         {"claimed_by": None, "state": slot["state"], "ip": slot.get("ip")})
+        except ConditionFailed:
+            continue
+        if slot.get("task_arn"):
+            store.delete("idle", slot["task_arn"])
+        record = store.get("prewarm", slot["prewarm_id"])
+        if record:
+            record.update(claimed_at=now, ready_when_claimed=bool(slot.get("ip")))
+            store.put("prewarm", slot["prewarm_id"], {k: v for k, v in record.items() if k not in ("pk", "sk")})
+        return claimed
+    return None
+
+
+def held(slot, now=None):
+    """True while a pre-warmed server nobody claimed yet should be kept running."""
+    now = now or time.time()
+    return bool(slot.get("prewarm_id")) and not slot.get("claimed_by") and slot.get("prewarm_until", 0) > now
+
+
+def record_stop(store, slot, now=None):
+    """Note when a pre-warmed server stopped, and when it had become playable."""
+    record = store.get("prewarm", slot["prewarm_id"])
+    if record:
+        record.update(stopped_at=now or time.time(), published_at=slot.get("published_at"))
+        store.put("prewarm", slot["prewarm_id"], {k: v for k, v in record.items() if k not in ("pk", "sk")})
+
+
+def summarize(records, typical_start, now=None):
+    """Hit rate, wasted server minutes and seconds of start latency saved.
+
+    typical_start is the usual request-to-playable time of a cold start in
+    seconds. A server is wasted from launch until it is claimed, or until it
+    stopped when nobody claimed it.
+    """
+    now = now or time.time()
+    launched = [r for r in records if "slot" in r]
+    hits = [r for r in launched if r.get("claimed_at")]
+    wasted = 0.0
+    saved = 0.0
+    for record in launched:
+        if record.get("claimed_at"):
+            wasted += record["claimed_at"] - record["launched_at"]
+            still_waiting = 0 if record.get("ready_when_claimed") else \
+                max(0, (record.get("published_at") or record["claimed_at"] + typical_start) - record["claimed_at"])
+            saved += max(0, typical_start - still_waiting)
+        else:
+            wasted += (record.get("stopped_at") or now) - record["launched_at"]
+    return {"launched": len(launched),
+            "skipped": len(records) - len(launched),
+            "hits": len(hits),
+            "hit_rate": len(hits) / float(len(launched)) if launched else None,
+            "wasted_minutes": wasted / 60.0,
+            "latency_saved_seconds": saved,
+            "saved_per_hit_seconds": saved / len(hits) if hits else None}
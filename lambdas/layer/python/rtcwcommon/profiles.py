@@ -0,0 +1,63 @@
+"""Server size profiles and the ECS services that run them.
+
+Each profile (e.g. "3v3", "6v6") has its own task size and therefore its own
+services: one on Fargate and, when Spot is enabled, one on Fargate Spot that
+start requests go to first. The default profile keeps the plain
+ECS_SERVICE_NAME, others append "-<profile>", Spot services append "-spot".
+
+Lambdas learn the profiles from SERVICE_PROFILES (JSON list), the default
+from DEFAULT_PROFILE and whether Spot is used from USE_SPOT.
+"""
+import json
+import os
+
+DEFAULT = "default"
+SPOT_SUFFIX = "-spot"
+
+
+def names():
+    return json.loads(os.environ.get("SERVICE_PROFILES", "[]")) or [default()]
+
+
+def default():
+    return os.environ.get("DEFAULT_PROFILE", DEFAULT)
+
+
+def spot_enabled():
+    return os.environ.get("USE_SPOT", "false") == "true"
+
+
+def service_name(base, profile, spot=False):
+    name = base if profile == default() else base + "-" + profile
+    return name + SPOT_SUFFIX if spot else name
+
+
+def start_service(base, profile):
+    """The service a start request for profile goes to."""
+    return service_name(base, profile, spot_enabled())
+
+
+def services(base):
+    """[(service name, profile, spot)] of every service of the region."""
+    result = []
+    for profile in names():
+        result.append((service_name(base, profile), profile, False))
+        if spot_enabled():
+            result.append((service_name(base, profile, True), profile, True))
+    return result
+
+
+def of_service(base, service):
+    """(profile, spot) of a service name, or None when it is not one of ours."""
+    for name, profile, spot in services(base):
+        if name == service:
+            return profile, spot
+    return None
+
+
+def of_task(base, task):
+    """(profile, spot) from a task's "group" ("service:<name>")."""
+    group = task.get("group", "")
+    if not group.startswith("service:"):
+        return None
+    return of_service(base, group[len("service:"):])
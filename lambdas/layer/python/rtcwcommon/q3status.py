@@ -0,0 +1,137 @@
+"""Quake3-protocol "getstatus" queries against RTCW servers.
+
+A status reply is an out-of-band packet:
+
+    \\xff\\xff\\xff\\xffstatusResponse\\n\\key\\value\\key\\value...\\n
+    <score> <ping> "<name>"\\n   (one line per player)
+
+query_many() asks several servers at once over one socket, so checking a
+whole region costs a single timeout at most. FakeStatusServer answers
+getstatus on localhost for local runs.
+"""
+import select
+import socket
+import threading
+import time
+
+OOB = b"\xff\xff\xff\xff"
+GETSTATUS = OOB + b"getstatus\n"
+STATUS_RESPONSE = OOB + b"statusResponse"
+DEFAULT_TIMEOUT = 1.5
+DEFAULT_ATTEMPTS = 2
+
+
+def parse_status(data):
+    """Turn a statusResponse packet into {"info": {...}, "players": [...]}."""
+    if not data.startswith(STATUS_RESPONSE):
+        raise ValueError("not a statusResponse packet")
+    lines = data[len(STATUS_RESPONSE):].decode("latin-1").strip("\n").split("\n")
+    fields = lines[0].split("\\")[1:] if lines else []
+    info = dict(zip(fields[0::2], fields[1::2]))
+    players = []
+    for line in lines[1:]:
+        parts = line.split(" ", 2)
+        if len(parts) < 3:
+            continue
+        players.append({"score": int(parts[0]), "ping": int(parts[1]), "name": parts[2].strip('"')})
+    return {"info": info, "players": players}
+
+
+def player_count(status):
+    """Human players on a server; bots report a ping of 0."""
+    return sum(1 for player in status["players"] if player["ping"] > 0)
+
+
+def query_many(addresses, timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS):
+    """Query (host, port) pairs; returns {address: status or None}."""
+    pending = set(addresses)
+    results = dict.fromkeys(addresses)
+    if not pending:
+        return results
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        for _ in range(attempts):
+            for address in pending:
+                sock.sendto(GETSTATUS, address)
+            deadline = time.monotonic() + timeout
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                readable, _, _ = select.select([sock], [], [], remaining)
+                if not readable:
+                    break
+                try:
+                    data, address = sock.recvfrom(65535)
+                except OSError:
+                    # e.g. an ICMP port unreachable from a server that is down
+                    continue
+                if address in pending:
+                    try:
+                        results[address] = parse_status(data)
+                    except ValueError:
+                        continue
+                    pending.discard(address)
+            if not pending:
+                break
+    finally:
+        sock.close()
+    return results
+
+
+def get_status(host, port, timeout=DEFAULT_TIMEOUT, attempts=DEFAULT_ATTEMPTS):
+    """Status of one server, or None when it does not answer."""
+    address = (socket.gethostbyname(host), port)
+    return query_many([address], timeout, attempts)[address]
+
+
+class FakeStatusServer:
+    """Answers getstatus on 127.0.0.1 with a configurable player list.
+
+    with FakeStatusServer(players=[(5, 40, "player")]) as server:
+        get_status("127.0.0.1", server.port)
+    """
+
+    def __init__(self, players=(), info=None, port=0):
+        self.players = list(players)
+        self.info = dict(info or {"sv_hostname": "fake", "mapname": "mp_ice"})
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", port))
+        self.port = self.sock.getsockname()[1]
+        self.queries = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def response(self):
+        info = "".join("\\" + k + "\\" + str(v) for k, v in self.info.items())
+        players = "".join('%d %d "%s"\n' % player for player in self.players)
+        return (STATUS_RESPONSE + b"\n" + info.encode("latin-1") + b"\n" + players.encode("latin-1"))
+
+    def _serve(self):
+        self.sock.settimeout(0.1)
+        while not self._stop.is_set():
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if data.startswith(GETSTATUS):
+                self.queries += 1
+                self.sock.sendto(self.response(), address)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,60 @@
+"""Region registry of the lambdas, parsed once per container.
+
+The stacks ship it in RTCW_REGIONS as compact JSON (see stacks/regions.py):
+
+    {"eu-west-2":{"capacity":2,"prefix":"eu","static_port":27960},"us-east-1":{"capacity":3,"prefix":"na"}}
+
+Without RTCW_REGIONS, e.g. in local runs, DEFAULTS is used.
+"""
+import json
+import os
+
+DEFAULTS = {"us-east-1": {"prefix": "na", "capacity": 1},
+            "sa-east-1": {"prefix": "sa", "capacity": 1},
+            "eu-west-2": {"prefix": "eu", "capacity": 1}}
+
+_registry = None
+
+
+def registry():
+    global _registry
+    if _registry is None:
+        value = os.environ.get("RTCW_REGIONS")
+        _registry = json.loads(value) if value else DEFAULTS
+    return _registry
+
+
+def reset():
+    """Parse RTCW_REGIONS again on next use. Only meant for local runs."""
+    global _registry
+    _registry = None
+
+
+def get(region):
+    config = registry().get(region)
+    if config is None:
+        raise ValueError("Unknown region: " + region)
+    return config
+
+
+def known(region):
+    return region in registry()
+
+
+def names():
+    return sorted(registry())
+
+
+def prefix(region):
+    return get(region)["prefix"]
+
+
+def capacity(region):
+    """Maximum number of concurrent servers in the region."""
+    return get(region).get("capacity", 1)
+
+
+def static_port(region, number):
+    """Load balancer port of slot number, or None when the region has no static endpoint."""
+    base = get(region).get("static_port")
+    return base + number - 1 if base else None
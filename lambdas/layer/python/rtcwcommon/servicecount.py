@@ -0,0 +1,107 @@
+"""Desired count of a game service, kept as an atomic counter.
+
+describe_services followed by update_service lets two concurrent requests
+read the same count and launch one server between them. Instead every
+change goes through a "counter" item in the region's state store with a
+conditional ADD, and the resulting value is written to the service.
+
+update_service calls can still land out of order, so after applying a value
+the counter is read again and the newest value re-applied until they agree.
+"""
+import logging
+
+from rtcwcommon.state import ConditionFailed
+
+logger = logging.getLogger("rtcwcommon.servicecount")
+
+ATTRIBUTE = "desired"
+MAX_APPLY_ROUNDS = 3
+PROTECTION_MINUTES = 5
+PROTECTION_BATCH = 10  # the most tasks update_task_protection takes per call
+
+
+def _current(store, service):
+    item = store.get("counter", service, consistent=True) or {}
+    return item.get(ATTRIBUTE, 0)
+
+
+def _apply(store, ecs, cluster, service, value):
+    for _ in range(MAX_APPLY_ROUNDS):
+        ecs.update_service(cluster=cluster, service=service, desiredCount=value)
+        latest = _current(store, service)
+        if latest == value:
+            break
+        logger.info("Counter moved from " + str(value) + " to " + str(latest) + ", applying again.")
+        value = latest
+    return value
+
+
+def protect(ecs, cluster, task_arns, minutes=PROTECTION_MINUTES):
+    """Protect tasks from scale-in for a few minutes, in calls of PROTECTION_BATCH tasks."""
+    for start in range(0, len(task_arns), PROTECTION_BATCH):
+        ecs.update_task_protection(cluster=cluster, tasks=task_arns[start:start + PROTECTION_BATCH],
+                                   protectionEnabled=True, expiresInMinutes=minutes)
+
+
+def resync(store, ecs, cluster, service):
+    """Reset the counter to the service's desired count, e.g. after a manual change."""
+    response = ecs.describe_services(cluster=cluster, services=[service])
+    desired = response["services"][0]["desiredCount"]
+    store.put("counter", service, {ATTRIBUTE: desired})
+    return desired
+
+
+def increment(store, ecs, cluster, service, maximum, count=1):
+    """Add count servers; returns the new desired count, or None when that would exceed maximum."""
+    if store.get("counter", service, consistent=True) is None:
+        resync(store, ecs, cluster, service)
+    for attempt in range(2):
+        try:
+            value = store.add("counter", service, ATTRIBUTE, count, maximum=maximum)
+        except ConditionFailed:
+            if attempt:
+                return None
+            # the counter may have drifted from the service, check once
+            if resync(store, ecs, cluster, service) + count > maximum:
+                return None
+            continue
+        return _apply(store, ecs, cluster, service, value)
+    return None
+
+
+def decrement(store, ecs, cluster, service, count=1):
+    """Remove up to count servers; returns the new desired count."""
+    if store.get("counter", service, consistent=True) is None:
+        resync(store, ecs, cluster, service)
+    for _ in range(MAX_APPLY_ROUNDS):
+        current = _current(store, service)
+        step = min(count, current)
+        if step <= 0:
+            return current
+        try:
+            value = store.add("counter", service, ATTRIBUTE, -step, minimum=0)
+        except ConditionFailed:
+            # a concurrent decrement got there first, look again
+            continue
+        return _apply(store, ecs, cluster, service, value)
+    return _current(store, service)
+
+
+def move(store, ecs, cluster, source, target, maximum, protect_running=False):
+    """Shift one server from the source service to the target, e.g. from Spot to on-demand.
+
+    With protect_running, the running tasks of source are protected first so that
+    its scale-in can only drop a pending or stopping task.
+    Returns False when source has no server to give or target is at maximum.
+    """
+    if store.get("counter", source, consistent=True) is None:
+        resync(store, ecs, cluster, source)
+    if _current(store, source) <= 0:
+        return False
+    if protect_running:
+        running = ecs.list_tasks(cluster=cluster, serviceName=source, desiredStatus="RUNNING")["taskArns"]
+        protect(ecs, cluster, running, PROTECTION_MINUTES)
+    if increment(store, ecs, cluster, target, maximum) is None:
+        return False
+    decrement(store, ecs, cluster, source, 1)
+    return True
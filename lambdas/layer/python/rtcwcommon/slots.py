@@ -0,0 +1,166 @@
+"""Per-region server slots, each with its own hostname (na1, na2, ...).
+
+A start request reserves the lowest free slot, so the caller learns its
+hostname up front. When a task reaches RUNNING, r53lambda binds it to the
+oldest reserved slot (or the lowest free one when the task was not asked
+for, e.g. a replacement the service launched) and the slot is released when
+the task stops. Reservations that never get a task expire. Slots launched
+by the pre-warm scheduler carry a prewarm_id until a start request claims
+them (see rtcwcommon.prewarm), and those of a tournament batch its batch_id
+(see rtcwcommon.batch). In a region with a static endpoint each slot
+also has its own port on the load balancer (see rtcwcommon.endpoint).
+
+Slots are "slot" items in the region's state store, keyed by slot number.
+All writes are conditional, so concurrent requests never share a slot.
+"""
+import time
+
+from rtcwcommon import regions
+from rtcwcommon.state import ConditionFailed
+
+RESERVATION_TIMEOUT = 15 * 60
+
+def hostname(region, number, zone_name):
+    return regions.prefix(region) + str(number) + "." + zone_name
+
+
+def address(slot):
+    """What players connect to: the hostname, with the port behind a static endpoint."""
+    return slot["hostname"] + (":" + str(slot["port"]) if slot.get("port") else "")
+
+
+def _expired(slot, now):
+    return slot.get("state") == "reserved" and slot["reserved_at"] < now - RESERVATION_TIMEOUT
+
+
+def _claim(store, region, zone_name, capacity, item, now):
+    """Write item into the lowest slot that is free or holds an expired reservation."""
+    slots = {int(slot["sk"]): slot for slot in store.query("slot")}
+    for number in range(1, capacity + 1):
+        current = slots.get(number)
+        if current is None:
+            expected = {"pk": None}
+        elif _expired(current, now):
+            expected = {"state": "reserved", "reserved_at": current["reserved_at"]}
+        else:
+            continue
+        slot = dict(item, number=number, hostname=hostname(region, number, zone_name))
+        port = regions.static_port(region, number)
+        if port:
+            slot["port"] = port
+        try:
+            store.put_if("slot", str(number), slot, expected)
+        except ConditionFailed:
+            continue
+        return slot
+    return None
+
+
+def reserve(store, region, zone_name, capacity, request_id=None, now=None, **attributes):
+    """Reserve a slot for a start request; None when the region is full."""
+    now = now or time.time()
+    return _claim(store, region, zone_name, capacity,
+                  dict(attributes, state="reserved", reserved_at=now, request_id=request_id), now)
+
+
+def in_use(store, now=None):
+    """Slots taken by a server or a live reservation; unclaimed pre-warmed ones count as free."""
+    now = now or time.time()
+    return len([slot for slot in store.query("slot") if not _expired(slot, now)
+                and not (slot.get("prewarm_id") and not slot.get("claimed_by"))])
+
+
+def cancel(store, slot):
+    """Give back a reservation that will not get a task."""
+    try:
+        store.delete_if("slot", str(slot["number"]), {"state": "reserved", "reserved_at": slot["reserved_at"]})
+    except ConditionFailed:
+        pass
+
+
+def find(store, task_arn):
+    for slot in store.query("slot"):
+        if slot.get("task_arn") == task_arn:
+            return slot
+    return None
+
+
+def bind(store, region, zone_name, capacity, task_arn, now=None, profile=None):
+    """Give a running task its slot; None when every slot is taken.
+
+    With a profile, only reservations made for that size profile are considered.
+    """
+    now = now or time.time()
+    existing = find(store, task_arn)
+    if existing:
+        return existing
+
+    reserved = sorted((slot for slot in store.query("slot")
+                       if slot.get("state") == "reserved" and not _expired(slot, now)
+                       and (profile is None or slot.get("profile") in (None, profile))),
+                      key=lambda slot: slot["reserved_at"])
+    for slot in reserved:
+        reserved_at = slot["reserved_at"]
+        # a pre-warmed reservation can be claimed meanwhile, then bind the claimed version
+        while slot and slot.get("state") == "reserved" and slot["reserved_at"] == reserved_at:
+            bound = dict(slot, state="running", task_arn=task_arn, bound_at=now)
+            del bound["pk"], bound["sk"]
+            try:
+                store.put_if("slot", slot["sk"], bound,
+                             {"state": "reserved", "reserved_at": reserved_at, "claimed_by": slot.get("claimed_by")})
+            except ConditionFailed:
+                slot = store.get("slot", slot["sk"], consistent=True)
+                continue
+            return bound
+
+    item = {"state": "running", "task_arn": task_arn, "bound_at": now}
+    if profile:
+        item["profile"] = profile
+    return _claim(store, region, zone_name, capacity, item, now)
+
+
+def annotate(store, slot, **attributes):
+    """Add details (ip, started_at, ...) to a bound slot, if it still holds the same task."""
+    task_arn = slot["task_arn"]
+    while slot and slot.get("task_arn") == task_arn:
+        updated = dict(slot, **attributes)
+        updated.pop("pk", None)
+        updated.pop("sk", None)
+        try:
+            store.put_if("slot", str(slot["number"]), updated, {"task_arn": task_arn, "claimed_by": slot.get("claimed_by")})
+        except ConditionFailed:
+            # claimed by a start request meanwhile, keep the claim
+            slot = store.get("slot", str(slot["number"]), consistent=True)
+            continue
+        return updated
+    return None
+
+
+def requeue(store, task_arn, now=None):
+    """Turn the slot of a task that is going away back into a reservation.
+
+    Its replacement then binds to it and comes back under the same hostname.
+    """
+    now = now or time.time()
+    slot = find(store, task_arn)
+    if slot is None:
+        return None
+    item = {"state": "reserved", "reserved_at": now, "request_id": slot.get("request_id"), "profile": slot.get("profile"),
+            "number": slot["number"], "hostname": slot["hostname"], "port": slot.get("port"), "replaces": task_arn,
+            "batch_id": slot.get("batch_id"), "batch_until": slot.get("batch_until")}
+    try:
+        store.put_if("slot", slot["sk"], {k: v for k, v in item.items() if v is not None}, {"task_arn": task_arn})
+    except ConditionFailed:
+        return None
+    return item
+
+
+def release(store, task_arn):
+    """Free the slot of a stopped task. Returns the released slot, if any."""
+    slot = find(store, task_arn)
+    if slot:
+        try:
+            store.delete_if("slot", slot["sk"], {"task_arn": task_arn})
+        except ConditionFailed:
+            return None
+    return slot
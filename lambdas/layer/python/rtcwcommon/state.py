@@ -0,0 +1,248 @@
+"""Small item store for server state, backed by a DynamoDB table per region.
+
+Items are addressed by a partition key naming the kind of item (e.g. "task")
+and a sort key identifying it (e.g. the task ARN). Items may carry an
+"expires_at" epoch which the table uses as its TTL attribute. DynamoDB
+deletes expired items up to days late, so both stores treat an item as gone
+from its expires_at on.
+
+Conditional writes take "expected" attribute values, with None meaning the
+attribute must be absent ({"pk": None} means the item must not exist), and
+raise ConditionFailed when the item does not match.
+
+When STATE_TABLE_NAME is not set, get_store() hands out an in-memory
+LocalStore with the same interface, which is what local runs use.
+"""
+import os
+import threading
+import time
+from decimal import Decimal
+
+from rtcwcommon.clients import get_client
+
+
+class ConditionFailed(Exception):
+    """A conditional write found the item in an unexpected state."""
+
+
+def _live(item):
+    return item is not None and item.get("expires_at", float("inf")) > time.time()
+
+
+def _from_dynamo(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, dict):
+        return {k: _from_dynamo(v) for k, v in value.items()}
+    if isinstance(value, (list, set)):
+        return [_from_dynamo(v) for v in value]
+    return value
+
+
+def _to_dynamo(value):
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _to_dynamo(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_dynamo(v) for v in value]
+    return value
+
+
+class DynamoStore:
+    """Store backed by a DynamoDB table with string keys "pk" and "sk"."""
+
+    def __init__(self, table_name, region=None):
+        self.table_name = table_name
+        self.region = region
+        self._serializer = None
+        self._deserializer = None
+
+    @property
+    def client(self):
+        return get_client("dynamodb", self.region)
+
+    def _key(self, pk, sk):
+        return {"pk": {"S": pk}, "sk": {"S": sk}}
+
+    def _serialize(self, item):
+        if self._serializer is None:
+            from boto3.dynamodb.types import TypeSerializer
+            self._serializer = TypeSerializer()
+        return {k: self._serializer.serialize(_to_dynamo(v)) for k, v in item.items()}
+
+    def _deserialize(self, item):
+        if self._deserializer is None:
+            from boto3.dynamodb.types import TypeDeserializer
+            self._deserializer = TypeDeserializer()
+        return {k: _from_dynamo(self._deserializer.deserialize(v)) for k, v in item.items()}
+
+    def get(self, pk, sk, consistent=False):
+        response = self.client.get_item(TableName=self.table_name, Key=self._key(pk, sk), ConsistentRead=consistent)
+        if "Item" not in response:
+            return None
+        item = self._deserialize(response["Item"])
+        return item if _live(item) else None
+
+    def put(self, pk, sk, item):
+        full_item = dict(item, pk=pk, sk=sk)
+        self.client.put_item(TableName=self.table_name, Item=self._serialize(full_item))
+
+    def delete(self, pk, sk):
+        self.client.delete_item(TableName=self.table_name, Key=self._key(pk, sk))
+
+    def _condition(self, expected):
+        clauses = []
+        names = {}
+        values = {}
+        for index, (attribute, value) in enumerate(sorted(expected.items())):
+            names["#c%d" % index] = attribute
+            if attribute == "pk" and value is None:
+                # an expired item the TTL has not deleted yet counts as absent
+                names["#expires"] = "expires_at"
+                values[":now"] = int(time.time())
+                clauses.append("(attribute_not_exists(#c%d) OR #expires <= :now)" % index)
+            elif value is None:
+                clauses.append("attribute_not_exists(#c%d)" % index)
+            else:
+                clauses.append("#c%d = :c%d" % (index, index))
+                values[":c%d" % index] = value
+        kwargs = {"ConditionExpression": " AND ".join(clauses), "ExpressionAttributeNames": names}
+        if values:
+            kwargs["ExpressionAttributeValues"] = self._serialize(values)
+        return kwargs
+
+    def put_if(self, pk, sk, item, expected):
+        full_item = dict(item, pk=pk, sk=sk)
+        try:
+            self.client.put_item(TableName=self.table_name, Item=self._serialize(full_item), **self._condition(expected))
+        except self.client.exceptions.ConditionalCheckFailedException:
+            raise ConditionFailed(pk + "/" + sk)
+
+    def delete_if(self, pk, sk, expected):
+        try:
+            self.client.delete_item(TableName=self.table_name, Key=self._key(pk, sk), **self._condition(expected))
+        except self.client.exceptions.ConditionalCheckFailedException:
+            raise ConditionFailed(pk + "/" + sk)
+
+    def add(self, pk, sk, attribute, delta, maximum=None, minimum=None, expires_at=None):
+        """Atomically add delta to a numeric attribute and return the new value.
+
+        Raises ConditionFailed instead of going above maximum or below minimum.
+        expires_at is only set when the item does not have one yet.
+        """
+        clauses = []
+        values = {":delta": delta}
+        update = "ADD #a :delta"
+        names = {"#a": attribute}
+        if expires_at is not None:
+            update = "SET #e = if_not_exists(#e, :expires) " + update
+            names["#e"] = "expires_at"
+            values[":expires"] = expires_at
+        if maximum is not None:
+            clauses.append("#a <= :upper")
+            values[":upper"] = maximum - delta
+        if minimum is not None:
+            clauses.append("#a >= :lower")
+            values[":lower"] = minimum - delta
+        kwargs = {"TableName": self.table_name,
+                  "Key": self._key(pk, sk),
+                  "UpdateExpression": update,
+                  "ExpressionAttributeNames": names,
+                  "ExpressionAttributeValues": self._serialize(values),
+                  "ReturnValues": "UPDATED_NEW"}
+        if clauses:
+            # a missing counter counts as 0
+            start_ok = (maximum is None or delta <= maximum) and (minimum is None or delta >= minimum)
+            condition = " AND ".join(clauses)
+            kwargs["ConditionExpression"] = ("attribute_not_exists(#a) OR (" + condition + ")") if start_ok else condition
+        try:
+            response = self.client.update_item(**kwargs)
+        except self.client.exceptions.ConditionalCheckFailedException:
+            raise ConditionFailed(pk + "/" + sk)
+        return self._deserialize(response["Attributes"])[attribute]
+
+    def query(self, pk):
+        items = []
+        kwargs = {"TableName": self.table_name,
+                  "KeyConditionExpression": "pk = :pk",
+                  "ExpressionAttributeValues": {":pk": {"S": pk}}}
+        while True:
+            response = self.client.query(**kwargs)
+            items.extend(item for item in map(self._deserialize, response.get("Items", [])) if _live(item))
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class LocalStore:
+    """In-memory stand-in for DynamoStore, for local runs."""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.RLock()
+
+    def get(self, pk, sk, consistent=False):
+        item = self.items.get((pk, sk))
+        return dict(item) if _live(item) else None
+
+    def put(self, pk, sk, item):
+        self.items[(pk, sk)] = dict(item, pk=pk, sk=sk)
+
+    def delete(self, pk, sk):
+        self.items.pop((pk, sk), None)
+
+    def _check(self, pk, sk, expected):
+        item = self.get(pk, sk) or {}
+        for attribute, value in expected.items():
+            if item.get(attribute) != value:
+                raise ConditionFailed(pk + "/" + sk)
+
+    def put_if(self, pk, sk, item, expected):
+        with self.lock:
+            self._check(pk, sk, expected)
+            self.put(pk, sk, item)
+
+    def delete_if(self, pk, sk, expected):
+        with self.lock:
+            self._check(pk, sk, expected)
+            self.delete(pk, sk)
+
+    def add(self, pk, sk, attribute, delta, maximum=None, minimum=None, expires_at=None):
+        with self.lock:
+            item = self.get(pk, sk) or {}
+            value = item.get(attribute, 0) + delta
+            if (maximum is not None and value > maximum) or (minimum is not None and value < minimum):
+                raise ConditionFailed(pk + "/" + sk)
+            item[attribute] = value
+            if expires_at is not None:
+                item.setdefault("expires_at", expires_at)
+            self.put(pk, sk, {k: v for k, v in item.items() if k not in ("pk", "sk")})
+            return value
+
+    def query(self, pk):
+        return [dict(item) for (item_pk, _), item in sorted(self.items.items())
+                if item_pk == pk and _live(item)]
+
+
+_stores = {}
+_override = None
+
+
+def get_store(region=None):
+    """Return the state store for a region, one instance per container."""
+    if _override is not None:
+        return _override
+    table_name = os.environ.get("STATE_TABLE_NAME")
+    key = region if table_name else None
+    if key not in _stores:
+        _stores[key] = DynamoStore(table_name, region) if table_name else LocalStore()
+    return _stores[key]
+
+
+def use_store(store):
+    """Serve every region and table from store, e.g. an instrumented LocalStore in
+    the load simulator. None goes back to the per-region stores."""
+    global _override
+    _stores.clear()
+    _override = store
@@ -0,0 +1,86 @@
+import base64
+import gzip
+import hashlib
+import logging
+import json
+import os
+import time
+from rtcwcommon.clients import get_client, default_region
+from rtcwcommon.state import get_store, ConditionFailed
+from rtcwcommon import instrument, matchstats, metrics
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger('matchstats')
+logger.setLevel(log_level)
+
+# an unfinished document waits this long for the rest of its lines
+PENDING_SECONDS = 3600
+
+@instrument.handler("matchstats")
+def handler(event, context):
+    """Parse round stats out of a batch of game server log lines and store them in the stats bucket.
+
+    The lines of an unfinished document are kept in a "statsbuf" item per
+    log stream, saved only once the batch's files are written. The file
+    names come from the batch, so a retried batch replaces its files.
+    """
+
+    data = json.loads(gzip.decompress(base64.b64decode(event["awslogs"]["data"])))
+    if data.get("messageType") == "CONTROL_MESSAGE":
+        return {"rows": 0}
+
+    region = default_region()
+    stream = data["logStream"]
+    store = get_store()
+    pending = store.get("statsbuf", stream, consistent=True) or {}
+    last_event = data["logEvents"][-1]["id"]
+    if pending.get("last_event") == last_event:
+        logger.info(stream + ": batch ending with " + last_event + " was already processed.")
+        return {"rows": 0}
+    parser = matchstats.StreamParser(pending.get("lines"))
+
+    rows = []
+    rounds = 0
+    for log_event in data["logEvents"]:
+        for document in parser.feed(log_event["message"]):
+            rounds += 1
+            rows.extend(matchstats.rows(document, region, stream.split("/")[-1], log_event["timestamp"]))
+
+    name = hashlib.sha1((stream + "/" + data["logEvents"][0]["id"]).encode()).hexdigest()[:12]
+    keys = matchstats.write(sink(), rows, os.environ.get("STATS_FORMAT", matchstats.DEFAULT_FORMAT), name) if rows else []
+
+    # a batch of the same stream handled meanwhile changed the buffer, the retry reads it again
+    expected = {"last_event": pending.get("last_event")} if pending else {"pk": None}
+    try:
+        if parser.pending():
+            store.put_if("statsbuf", stream, {"lines": parser.pending(), "last_event": last_event,
+                                              "expires_at": int(time.time() + PENDING_SECONDS)}, expected)
+        elif pending:
+            store.delete_if("statsbuf", stream, expected)
+    except ConditionFailed:
+        logger.warning(stream + ": the pending lines changed while this batch was read, retrying.")
+        raise
+    if rounds:
+        logger.info(stream + ": " + str(rounds) + " round(s), " + str(len(rows)) + " row(s) in " + ", ".join(keys))
+        metrics.emit({"StatsRounds": rounds, "StatsRows": len(rows)}, {"Region": region}, unit="Count")
+    return {"rows": len(rows), "keys": keys}
+
+
+def sink():
+    """S3 bucket of the deployment, or a local directory when STATS_DIRECTORY is set."""
+    if os.environ.get("STATS_DIRECTORY"):
+        return matchstats.LocalSink(os.environ["STATS_DIRECTORY"])
+    return matchstats.S3Sink(get_client('s3', os.environ.get("STATS_BUCKET_REGION")), os.environ["STATS_BUCKET"])
+
+
+if __name__ == "__main__":
+
+    # Local testing only #
+    os.environ.setdefault("STATS_DIRECTORY", "stats")
+    os.environ.setdefault("STATS_FORMAT", "json")  # no pyarrow needed
+    lines = ['{"gameinfo": {"match_id": "1", "round": "1", "map": "te_escape2"},',
+             ' "stats": [{"A1B2": {"alias": "player", "team": "Axis", "categories": {"kills": 3, "deaths": 1}}}]}']
+    payload = {"messageType": "DATA_MESSAGE", "logStream": "rtcw_container/RTCWProTask/abc",
+               "logEvents": [{"id": str(n), "timestamp": int(time.time() * 1000), "message": line} for n, line in enumerate(lines)]}
+    print(handler({"awslogs": {"data": base64.b64encode(gzip.compress(json.dumps(payload).encode())).decode()}}, None))
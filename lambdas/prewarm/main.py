@@ -0,0 +1,79 @@
+import logging
+import json
+import os
+import time
+from rtcwcommon.clients import get_client, default_region
+from rtcwcommon.state import get_store
+from rtcwcommon import instrument, prewarm, profiles, regions
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger('prewarm')
+logger.setLevel(log_level)
+
+lead_minutes = int(os.environ.get("PREWARM_LEAD_MINUTES", "10"))
+threshold = float(os.environ.get("PREWARM_THRESHOLD", "0.5"))
+max_servers = int(os.environ.get("PREWARM_MAX_SERVERS", "1"))
+hold_minutes = int(os.environ.get("PREWARM_HOLD_MINUTES", "45"))
+
+@instrument.handler("prewarm")
+def handler(event, context):
+    """Launch servers ahead of the hour when start history says players are likely to come.
+
+    Runs every few minutes from a schedule. Each hour is launched for at most
+    once; servers launched for the previous hour that nobody claimed yet count
+    towards the next one.
+    """
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Processing event " + json.dumps(event))
+    region = default_region()
+    try:
+        message = prewarm_region(region, time.time())
+    except Exception as ex:
+        template = "An exception of type {0} occurred. Arguments:\n{1!r}"
+        error_msg = template.format(type(ex).__name__, ex.args)
+        message = "Failed to pre-warm a server\n" + error_msg
+
+    logger.info(message)
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'text/plain'
+        },
+        'body': message
+    }
+
+
+def prewarm_region(region, now):
+    store = get_store()
+    target = now + lead_minutes * 60
+    hour = prewarm.hour_of_week(target)
+    prediction = prewarm.forecast(store.query("history"), now).get(hour)
+    servers = prewarm.servers_for(prediction, threshold, max_servers)
+    if not servers:
+        return "No demand expected in hour " + str(hour) + " of the week."
+
+    waiting = sum(1 for slot in store.query("slot") if prewarm.held(slot, now))
+    ecs = get_client('ecs', region)
+    profile = profiles.default()
+    service = profiles.start_service(os.environ['ECS_SERVICE_NAME'], profile)
+    launched = []
+    for index in range(waiting, servers):
+        slot = prewarm.launch(store, ecs, os.environ['ECS_CLUSTER_NAME'], service, region,
+                              os.environ["DNS_HOSTED_ZONE_NAME"], regions.capacity(region), prewarm.hour_key(target), index,
+                              hold_minutes * 60, now, profile)
+        if slot:
+            launched.append(slot["hostname"])
+    return ("Hour " + str(hour) + ": " + str(round(prediction["probability"] * 100)) + "% of weeks had starts, " +
+            str(servers) + " server(s) wanted, " + str(waiting) + " waiting, launched " + (", ".join(launched) or "none") + ".")
+
+
+if __name__ == "__main__":
+
+    # Local testing only #
+    local_store = get_store()
+    for weeks_ago in range(1, 4):
+        prewarm.record_request(local_store, time.time() + 600 - weeks_ago * prewarm.WEEK)
+    print(handler({"detail-type": "Scheduled Event"}, None))
+    print(handler({"detail-type": "Scheduled Event"}, None))  # same hour, nothing more to launch
@@ -1,96 +1,253 @@
 import logging
-import boto3
 import json
 import time as _time
 import os
+from rtcwcommon.clients import get_client
+from rtcwcommon.state import get_store, ConditionFailed
+from rtcwcommon import dns, endpoint, instrument, lifecycle, metrics, prewarm, profiles, regions, servicecount, slots, q3status
 
 log_level = logging.INFO
 logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
 logger = logging.getLogger("queue_handler")
 logger.setLevel(log_level)
 
-r53 = boto3.client('route53')
+TASK_RETENTION = 24 * 3600  # keep stopped task items around to absorb duplicate events
+STILL_RUNNING = {"dns_deleted": None, "stopped": None}
+rtcw_port = int(os.environ.get("RTCW_PORT", "27960"))
+ready_timeout = int(os.environ.get("READY_TIMEOUT", "150"))
+READY_INTERVAL = 3
+METRIC_NAMES = {"queue": "QueueTime", "pull": "PullTime", "boot": "BootTime", "ready": "ReadyTime",
+                "dns": "DnsTime", "total": "TimeToPlayable"}
 
+@instrument.handler("r53lambda")
 def handler(event, context):
+    if event.get("detail-type") == "ECS Service Action":
+        return spot_fallback(event)
+    
     lastStatus = event["detail"]["lastStatus"]
     desiredStatus = event["detail"]["desiredStatus"]
     region = event["region"]
+    task_arn = event["detail"]["taskArn"]
+    updated_at = event["detail"].get("updatedAt")
+    zone_name = os.environ["DNS_HOSTED_ZONE_NAME"]
     
-    if region == "us-east-1":
-        url_prefix = "na"
-    elif region == "sa-east-1":
-        url_prefix = "sa"
-    elif region == "eu-west-2":
-        url_prefix = "eu"
-    else:
-        logger.error("Unknown region.")
-        raise
-    url = url_prefix + "." + os.environ["DNS_HOSTED_ZONE_NAME"]
+    store = get_store()
+    task = store.get("task", task_arn)
     
     if lastStatus == "RUNNING" and desiredStatus == "RUNNING":
-        logger.info("Making a record.")
+        if task and (task.get("dns_deleted") or task.get("stopped")):
+            logger.info("Task " + task_arn + " has already stopped, skipping.")
+            return
+        if task and task.get("published"):
+            logger.info("Record for " + task_arn + " is already published, skipping.")
+            return
+        if task and task.get("waiting_since", 0) > _time.time() - ready_timeout - 30:
+            logger.info("Another invocation is waiting for " + task_arn + " to be ready, skipping.")
+            return
         
-        attachment_details = event["detail"]["attachments"][0]["details"]
-        for keypair in attachment_details:
-            if keypair["name"] == "networkInterfaceId":
-                eni = keypair["value"]
-
-        ec2 = boto3.client('ec2')
+        placement = profiles.of_task(os.environ.get("ECS_SERVICE_NAME", ""), event["detail"])
+        capacity = regions.capacity(region)
+        slot = slots.bind(store, region, zone_name, capacity, task_arn, profile=placement[0] if placement else None)
+        if slot is None:
+            logger.error("No free slot for " + task_arn + ", all " + str(capacity) + " are taken.")
+            return
+        url = slot["hostname"]
+        
+        if endpoint.enabled():
+            task = register_static(region, slot, event["detail"])
+        else:
+            logger.info("Making a record for slot " + str(slot["number"]) + ".")
+            task = {"eni": task_eni(event["detail"])}
+            task["ip"] = eni_public_ip(region, task["eni"])
+        ip = task["ip"]
+        task.update({"record_name": url, "slot": slot["number"], "region": region, "waiting_since": _time.time()})
         try:
-            response = ec2.describe_network_interfaces(NetworkInterfaceIds=[eni])
-        except:
-            logger.error("Could not describe eni " + eni)
-            raise
-            
-        ip = response['NetworkInterfaces'][0]['Association']['PublicIp']
-        change_my_r53("UPSERT", url, ip)
+            # never over a STOPPED event's tombstone
+            store.put_if("task", task_arn, task, STILL_RUNNING)
+        except ConditionFailed:
+            logger.info("Task " + task_arn + " stopped meanwhile, freeing its slot.")
+            slots.release(store, task_arn)
+            return
+        
+        # the server clones its config and updates itself before it accepts players
+        with instrument.phase("ready"):
+            ready_at = wait_until_ready(ip, context, task.get("port", rtcw_port))
+        current = store.get("task", task_arn, consistent=True)
+        if current and current.get("dns_deleted"):
+            logger.info("Task " + task_arn + " stopped before it was ready.")
+            return
+        
+        # behind a static endpoint the record never changes, the task is playable once registered
+        if task.get("static") or change_my_r53("UPSERT", url, ip, updated_at):
+            published_at = _time.time()
+            started_at = lifecycle.parse_time(event["detail"].get("startedAt")) or published_at
+            task["published"] = True
+            try:
+                store.put_if("task", task_arn, task, STILL_RUNNING)
+            except ConditionFailed:
+                logger.info("Task " + task_arn + " stopped while its record was published.")
+                return
+            slots.annotate(store, slot, ip=ip, started_at=started_at, ready_at=ready_at, published_at=published_at)
+            record_timing(store, task_arn, region, event["detail"], ready_at, published_at)
 
     if desiredStatus == "STOPPED":
-        logger.info("Deleting a record")
-        change_my_r53("UPSERT", url, "192.168.1.1")  #hack to change the record without looking up ip
-        change_my_r53("DELETE", url, "192.168.1.1")  
+        if task and task.get("dns_deleted"):
+            logger.info("Record for " + task_arn + " was already deleted, skipping.")
+            return
+        
+        # the two minute Spot notice; the queue's batching window is seconds of it
+        interrupted = event["detail"].get("stopCode") == "SpotInterruption"
+        if task and task.get("static"):
+            logger.info("Deregistering slot " + str(task["slot"]) + (" of an interrupted Spot task" if interrupted else ""))
+            deleted = endpoint.deregister(region, task["target_group"], task["private_ip"], rtcw_port)
+        elif endpoint.enabled():
+            # nothing was registered yet; a stale target is replaced when the slot is bound again
+            deleted = True
+        else:
+            logger.info("Deleting a record" + (" of an interrupted Spot task" if interrupted else ""))
+            if task and task.get("ip"):
+                deleted = change_my_r53("DELETE", task["record_name"], task["ip"], updated_at)
+            else:
+                # no state for this task, delete whatever its slot's record points at
+                slot = slots.find(store, task_arn)
+                ip = lookup_record_ip(slot["hostname"]) if slot else None
+                deleted = change_my_r53("DELETE", slot["hostname"], ip, updated_at) if ip else True
+        
+        if deleted:
+            if interrupted:
+                replace_interrupted(store, region, task_arn, event["detail"])
+            else:
+                released = slots.release(store, task_arn)
+                if released and released.get("prewarm_id"):
+                    prewarm.record_stop(store, released)
+            task = task or {"region": region}
+            task.update({"dns_deleted": True, "expires_at": int(_time.time()) + TASK_RETENTION})
+            store.put("task", task_arn, task)
+        else:
+            # the record is left to the retry and the reconciler, but a late RUNNING event must not publish it again
+            task = task or {"region": region}
+            task.update({"stopped": True, "expires_at": int(_time.time()) + TASK_RETENTION})
+            store.put("task", task_arn, task)
     
 
-def change_my_r53(action, url, ip):
+def task_eni(detail):
+    for keypair in detail["attachments"][0]["details"]:
+        if keypair["name"] == "networkInterfaceId":
+            return keypair["value"]
+
+
+def eni_public_ip(region, eni):
+    ec2 = get_client('ec2', region)
     try:
-        response = r53.change_resource_record_sets(
-            ChangeBatch={
-                'Changes': [
-                    {
-                        'Action': action,
-                        'ResourceRecordSet': {
-                            'Name': url,
-                            'ResourceRecords': [
-                                {
-                                    'Value': ip,
-                                },
-                            ],
-                            'TTL': 60,
-                            'Type': 'A',
-                        },
-                    },
-                ],
-                'Comment': 'RTCW server',
-            },
-            HostedZoneId=os.environ["DNS_HOSTED_ZONE"]
-        )
-    except r53.exceptions.InvalidChangeBatch as err:
-        if action == "DELETE" and "but it was not found" in str(err):
-            logger.info("Record was already deleted.")
-        elif action == "CREATE" and "but it already exists" in str(err):
-            logger.info("Record already exists.")
-        else:
-            logger.error(err)
+        response = ec2.describe_network_interfaces(NetworkInterfaceIds=[eni])
+    except:
+        logger.error("Could not describe eni " + eni)
+        raise
+    return response['NetworkInterfaces'][0]['Association']['PublicIp']
+
+
+def register_static(region, slot, detail):
+    """Put the task behind its slot's listener of the static endpoint; returns the task item."""
+    private_ip = endpoint.private_ip(detail)
+    logger.info("Registering " + private_ip + " for slot " + str(slot["number"]) + " on port " + str(slot["port"]) + ".")
+    target_group = endpoint.register(region, slot["number"], private_ip, rtcw_port)
+    return {"static": True, "private_ip": private_ip, "target_group": target_group, "ip": endpoint.ip(), "port": slot["port"]}
+
+
+def wait_until_ready(ip, context=None, port=rtcw_port):
+    """Poll the server with getstatus until it answers; returns when, or None on timeout."""
+    timeout = ready_timeout
+    if context:
+        timeout = min(timeout, context.get_remaining_time_in_millis() / 1000.0 - 15)
+    deadline = _time.time() + timeout
+    while True:
+        if q3status.get_status(ip, port, attempts=1):
+            logger.info("Server " + ip + " is ready.")
+            return _time.time()
+        if _time.time() + READY_INTERVAL > deadline:
+            logger.warning("Server " + ip + " did not answer getstatus in time, publishing anyway.")
+            return None
+        _time.sleep(READY_INTERVAL)
+
+
+def record_timing(store, task_arn, region, detail, ready_at, published_at):
+    """Store and emit the time-to-playable breakdown of a task that just got its record."""
+    try:
+        start = lifecycle.claim_start(store, task_arn, lifecycle.parse_time(detail["createdAt"]))
+        requested_at = start["requested_at"] if start else None
+        item = lifecycle.record_lifecycle(store, task_arn, region, detail, requested_at, published_at, ready_at)
+        phases = item["phases"]
+        metrics.emit({METRIC_NAMES[phase]: value for phase, value in phases.items()},
+                     {"Region": region},
+                     properties={"taskArn": task_arn, "fromStartRequest": start is not None})
+    except Exception as ex:
+        logger.warning("Could not record lifecycle timing for " + task_arn + ": " + repr(ex))
+
+
+def lookup_record_ip(url):
+    """Return the IP the A record currently points at, or None."""
+    response = dns.call("list_resource_record_sets", HostedZoneId=os.environ["DNS_HOSTED_ZONE"],
+                        StartRecordName=url,
+                        StartRecordType="A",
+                        MaxItems="1")
+    for record in response["ResourceRecordSets"]:
+        if record["Name"].rstrip(".") == url.rstrip(".") and record["Type"] == "A":
+            return record["ResourceRecords"][0]["Value"]
+    return None
+
+
+def replace_interrupted(store, region, task_arn, detail):
+    """Keep an interrupted server's hostname for its replacement, launched on-demand if configured."""
+    slot = slots.requeue(store, task_arn)
+    if slot:
+        logger.info("Slot " + str(slot["number"]) + " is kept for the replacement of " + task_arn + ".")
+    placement = profiles.of_task(os.environ["ECS_SERVICE_NAME"], detail)
+    if os.environ.get("SPOT_FALLBACK_ON_INTERRUPTION") != "true" or not placement or not placement[1]:
+        return
+    # the Spot service would relaunch on Spot, move the server to on-demand instead
+    base = os.environ["ECS_SERVICE_NAME"]
+    ecs = get_client('ecs', region)
+    if servicecount.move(store, ecs, os.environ["ECS_CLUSTER_NAME"], profiles.service_name(base, placement[0], True),
+                         profiles.service_name(base, placement[0]), regions.capacity(region), protect_running=True):
+        logger.info("Replacement of " + task_arn + " launched on-demand.")
     else:
-        if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            logger.error("Route53 update bad http code:")
-            logger.error(response)
-        else:
-            logger.info("Successfully changed a record: " + action + " " + url + " " + ip)
+        logger.warning("Could not move the replacement of " + task_arn + " to on-demand, the Spot service replaces it.")
+
+
+def spot_fallback(event):
+    """Move the servers Fargate Spot cannot place to the on-demand service of the same profile."""
+    base = os.environ["ECS_SERVICE_NAME"]
+    cluster = os.environ["ECS_CLUSTER_NAME"]
+    service = event["resources"][0].split("/")[-1]
+    placement = profiles.of_service(base, service)
+    if not placement or not placement[1]:
+        logger.info("Placement failure in " + service + ", which is not a Spot service.")
+        return
+    region = event["region"]
+    ecs = get_client('ecs', region)
+    current = ecs.describe_services(cluster=cluster, services=[service])["services"][0]
+    shortfall = current["desiredCount"] - current["runningCount"] - current["pendingCount"]
+    store = get_store()
+    moved = 0
+    for _ in range(max(0, shortfall)):
+        if not servicecount.move(store, ecs, cluster, service, profiles.service_name(base, placement[0]), regions.capacity(region)):
+            break
+        moved += 1
+    logger.info("No Spot capacity for " + service + ", moved " + str(moved) + " of " + str(shortfall) + " server(s) to on-demand.")
+
+
+def change_my_r53(action, url, ip, updated_at=None):
+    """Hand a record change to the DNS queue (or Route53 directly when no queue is set)."""
+    try:
+        return dns.submit(action, url, ip, updated_at=updated_at)
+    except Exception as ex:
+        logger.error("Could not submit record change " + action + " " + url + ": " + repr(ex))
+        return False
         
         
 if __name__ == "__main__":
     event_str_stopped = '{"version":"0","id":"a","detail-type":"ECS Task State Change","source":"aws.ecs","account":"123","time":"2021-07-07T19:44:16Z","region":"us-east-1","resources":["arn:aws:ecs:us-east-1:123:task/RTCWCluster/abc"],"detail":{"attachments":[{"id":"7b5d0e17-3563-4263-b42f-4b26afd8f477","type":"eni","status":"DELETED","details":[{"name":"subnetId","value":"subnet-123"},{"name":"networkInterfaceId","value":"eni-0e0750b47eb5d7062"},{"name":"macAddress","value":"12:1a:ce:9f:13:2f"},{"name":"privateDnsName","value":"ip-172-31-82-109.ec2.internal"},{"name":"privateIPv4Address","value":"172.31.82.109"}]}],"availabilityZone":"us-east-1b","clusterArn":"arn:aws:ecs:us-east-1:123:cluster/RTCWCluster","connectivity":"CONNECTED","connectivityAt":"2021-07-07T19:37:35.733Z","containers":[{"containerArn":"arn:aws:ecs:us-east-1:123:container/RTCWCluster/abc/2ee86259-6758-4dd9-9f4b-5efee171489a","exitCode":0,"lastStatus":"STOPPED","name":"msh100pro","image":"msh100/rtcw","runtimeId":"8d102278d0c04bbea006ba330c490e1b-2600574453","taskArn":"arn:aws:ecs:us-east-1:123:task/RTCWCluster/abc","networkInterfaces":[{"attachmentId":"7b5d0e17-3563-4263-b42f-4b26afd8f477","privateIpv4Address":"172.31.82.109"}],"cpu":"0","memory":"512"}],"cpu":"256","createdAt":"2021-07-07T19:37:27.169Z","desiredStatus":"STOPPED","enableExecuteCommand":false,"ephemeralStorage":{"sizeInGiB":20},"executionStoppedAt":"2021-07-07T19:43:43.263Z","group":"service:pro","launchType":"FARGATE","lastStatus":"STOPPED","memory":"512","overrides":{"containerOverrides":[{"name":"msh100pro"}]},"platformVersion":"1.4.0","pullStartedAt":"2021-07-07T19:37:55.488Z","pullStoppedAt":"2021-07-07T19:38:20.229Z","startedAt":"2021-07-07T19:38:27.321Z","startedBy":"ecs-svc/5229653580561241327","stoppingAt":"2021-07-07T19:43:31.156Z","stoppedAt":"2021-07-07T19:44:16.522Z","stoppedReason":"Scaling activity initiated by (deployment ecs-svc/5229653580561241327)","stopCode":"ServiceSchedulerInitiated","taskArn":"arn:aws:ecs:us-east-1:123:task/RTCWCluster/abc","taskDefinitionArn":"arn:aws:ecs:us-east-1:123:task-definition/msh100pro:3","updatedAt":"2021-07-07T19:44:16.522Z","version":7}}'
     event_str_started = '{"version":"0","id":"a","detail-type":"ECS Task State Change","source":"aws.ecs","account":"123","time":"2021-07-07T19:38:27Z","region":"us-east-1","resources":["arn:aws:ecs:us-east-1:123:task/RTCWCluster/abc"],"detail":{"attachments":[{"id":"7b5d0e17-3563-4263-b42f-4b26afd8f477","type":"eni","status":"ATTACHED","details":[{"name":"subnetId","value":"subnet-123"},{"name":"networkInterfaceId","value":"eni-0e0750b47eb5d7062"},{"name":"macAddress","value":"12:1a:ce:9f:13:2f"},{"name":"privateDnsName","value":"ip-172-31-82-109.ec2.internal"},{"name":"privateIPv4Address","value":"172.31.82.109"}]}],"availabilityZone":"us-east-1b","clusterArn":"arn:aws:ecs:us-east-1:123:cluster/RTCWCluster","connectivity":"CONNECTED","connectivityAt":"2021-07-07T19:37:35.733Z","containers":[{"containerArn":"arn:aws:ecs:us-east-1:123:container/RTCWCluster/abc/2ee86259-6758-4dd9-9f4b-5efee171489a","lastStatus":"RUNNING","name":"msh100pro","image":"msh100/rtcw","runtimeId":"8d102278d0c04bbea006ba330c490e1b-2600574453","taskArn":"arn:aws:ecs:us-east-1:123:task/RTCWCluster/abc","networkInterfaces":[{"attachmentId":"7b5d0e17-3563-4263-b42f-4b26afd8f477","privateIpv4Address":"172.31.82.109"}],"cpu":"0","memory":"512"}],"cpu":"256","createdAt":"2021-07-07T19:37:27.169Z","desiredStatus":"RUNNING","enableExecuteCommand":false,"ephemeralStorage":{"sizeInGiB":20},"group":"service:pro","launchType":"FARGATE","lastStatus":"RUNNING","memory":"512","overrides":{"containerOverrides":[{"name":"msh100pro"}]},"platformVersion":"1.4.0","pullStartedAt":"2021-07-07T19:37:55.488Z","pullStoppedAt":"2021-07-07T19:38:20.229Z","startedAt":"2021-07-07T19:38:27.321Z","startedBy":"ecs-svc/5229653580561241327","taskArn":"arn:aws:ecs:us-east-1:123:task/RTCWCluster/abc","taskDefinitionArn":"arn:aws:ecs:us-east-1:123:task-definition/msh100pro:3","updatedAt":"2021-07-07T19:38:27.321Z","version":4}}'
-    event = json.loads(event_str_started)
-    handler(event, None)
+    handler(json.loads(event_str_started), None)
+    handler(json.loads(event_str_started), None)  # duplicate, skips the ENI lookup
+    handler(json.loads(event_str_stopped), None)  # single exact DELETE
@@ -0,0 +1,70 @@
+import logging
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rtcwcommon.state import get_store
+from rtcwcommon import instrument, regions
+
+log_level = logging.INFO
+logging.basicConfig(format='%(name)s:%(levelname)s:%(message)s')
+logger = logging.getLogger('status')
+logger.setLevel(log_level)
+
+@instrument.handler("statuslambda")
+def handler(event, context):
+    """Report servers per region from the state table, without any ECS or EC2 calls."""
+
+    region = (event.get("pathParameters") or {}).get("region")
+    try:
+        if region:
+            if not regions.known(region):
+                return respond(404, {"message": "Unknown region: " + region})
+            body = region_status(region)
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, len(regions.names()))) as pool:
+                body = {"regions": list(pool.map(region_status, regions.names()))}
+    except Exception as ex:
+        logger.error("Failed to read status: " + repr(ex))
+        return respond(500, {"message": "Failed to read server status."})
+    return respond(200, body)
+
+
+def region_status(region):
+    """Desired/running counts and the servers of one region."""
+    store = get_store(region)
+    # one counter per service, i.e. per size profile and capacity type
+    desired = sum(counter.get("desired", 0) for counter in store.query("counter"))
+    now = time.time()
+    servers = []
+    for slot in store.query("slot"):
+        server = {"slot": slot["number"], "hostname": slot["hostname"], "state": "starting"}
+        if slot.get("port"):
+            server["port"] = slot["port"]
+        if slot.get("profile"):
+            server["profile"] = slot["profile"]
+        if slot.get("ip"):
+            server.update(state="running", ip=slot["ip"], uptime=int(now - slot["started_at"]))
+        servers.append(server)
+    return {"region": region,
+            "desired": desired,
+            "running": sum(1 for server in servers if server["state"] == "running"),
+            "servers": servers}
+
+
+def respond(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json'
+        },
+        'body': json.dumps(body)
+    }
+
+
+if __name__ == "__main__":
+
+    # Local testing only #
+    event_region = {"resource": "/status/{region}", "pathParameters": {"region": "us-east-1"}}
+    event_all = {"resource": "/status", "pathParameters": None}
+    print(handler(event_region, None))
+    print(handler(event_all, None))
@@ -17,9 +17,15 @@ settings = {
             "STATS_SUBMIT": "1"
             },
      "account": "123",
-     "regions": { "UE1" : "us-east-1",
-                  "EW2" : "eu-west-2",
-                  "SE1" : "sa-east-1"
+     # stack suffix: region, hostname prefix, UTC hour of the daily stop, maximum servers, optional vpc_id,
+     # optional "static_ip": True to put the region's servers behind a UDP load balancer with fixed addresses,
+     # in "static_ips" availability zones with one Elastic IP each (default 2, the quota is 5 per region),
+     # optional cert_arn: the region's certificate for dns_api_url, to serve the API from the region as well
+     "regions": { "UE1" : {"name": "us-east-1", "prefix": "na", "morning_hour": 8, "capacity": 3},
+                  "EW2" : {"name": "eu-west-2", "prefix": "eu", "morning_hour": 3, "capacity": 2,
+                           "cert_arn": "arn:aws:acm:eu-west-2:123:certificate/def"},
+                  "SE1" : {"name": "sa-east-1", "prefix": "sa", "morning_hour": 9, "capacity": 1,
+                           "cert_arn": "arn:aws:acm:sa-east-1:123:certificate/ghi"}
                  },
      "main_region": "us-east-1",
      "dns_hosted_zone": "Z1ABCD",
@@ -28,7 +34,47 @@ settings = {
      "dns_record_name": "ondemand",
      "ECS_CLUSTER_NAME": "RTCWCluster2",
      "ECS_SERVICE_NAME": "RTCWProService",
-     "RTCW_PORT": 27960
+     "RTCW_PORT": 27960,
+     "idle_minutes": 15,
+     # a server that does not answer getstatus for this long is stopped as hung
+     "silent_minutes": 30,
+     "idle_check_minutes": 5,
+     # how often the main region reconciles the server records with the running tasks
+     "dns_reconcile_minutes": 10,
+     "api_throttle": {"rate_limit": 20, "burst_limit": 50},
+     "status_cache_ttl": 10,
+     # optional: API key for tournament batches (POST /batch), see tools/tournament.py
+     "batch_api_key": "change-me-at-least-20-characters",
+     "ready_timeout": 150,
+     # share of lambda invocations whose AWS call timings are published; failed or throttled ones always are
+     "instrument_sample_rate": 0.1,
+     # optional: run a derived image with the config and maps baked in, see tools/build_image.py
+     "game_image": {"settings_ref": "master",
+                    "map_server": "https://maps.example.com/rtcw",
+                    "keep_images": 5},
+     # optional: shared EFS cache of maps and config files, synced incrementally on boot
+     "map_cache": {"refresh_minutes": 30,
+                   "entrypoint": ["/home/game/start"]},
+     # optional: launch servers ahead of the hours players usually come, see tools/prewarm_report.py
+     "prewarm": {"lead_minutes": 10,
+                 "threshold": 0.5,
+                 "max_servers": 1,
+                 "hold_minutes": 45,
+                 "check_minutes": 5},
+     # optional: size profiles picked with /start/{region}?profile=3v3, each with its own services
+     "profiles": {"3v3": {"cpu": 256, "memory": 512},
+                  "6v6": {"cpu": 512, "memory": 1024}},
+     "default_profile": "6v6",
+     # optional: round stats from the game logs to S3, see stacks/match_stats.py
+     "match_stats": {"bucket": "my-rtcw-match-stats",
+                     "retention_days": 30,
+                     # "parquet" (the default, pyarrow comes in a layer built at synth) or "json", see stacks/match_stats.py
+                     "format": "parquet"},
+     # optional: CPU/memory/player samples from a sidecar in every game task, see tools/rightsize.py
+     "telemetry": {"interval_seconds": 30},
+     # optional: start on Fargate Spot, falling back to on-demand when Spot has no capacity
+     "spot": {"enabled": True,
+              "fallback_on_interruption": True}
      }
     
 
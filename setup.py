@@ -19,8 +19,9 @@ setuptools.setup(
     packages=setuptools.find_packages(where="rtcw_on_demand"),
 
     install_requires=[
-        "aws-cdk-lib==2.0.0-rc.10",
+        "aws-cdk-lib>=2.63.0",
         "constructs>=10.0.0,<11.0.0",
+        "boto3",
     ],
 
     python_requires=">=3.6",
@@ -0,0 +1,59 @@
+"""Derived game image with the server config and maps baked in.
+
+The image is built from docker/Dockerfile by tools/build_image.py, pushed to
+the GAME_REPOSITORY_NAME ECR repository in the main region and replicated to
+every other region, so tasks pull it from their own region. Its tag is a hash
+of the Dockerfile and the build args, which lets the stacks reference the
+image the script pushed without a lookup; check_pushed stops the synth when
+that tag was never pushed, instead of leaving tasks that fail to pull it.
+"""
+import hashlib
+import os
+
+GAME_REPOSITORY_NAME = "rtcwdemand-game"
+DOCKERFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker", "Dockerfile")
+BAKED_ENV_VARS = ["SETTINGSURL", "CONF_CHECKVERSION", "MAPS"]
+
+
+def build_args(settings):
+    """Docker build args for the image described by settings["game_image"]."""
+    game_image = settings["game_image"]
+    args = {name: settings["env_vars"][name] for name in BAKED_ENV_VARS if name in settings["env_vars"]}
+    args["SETTINGS_REF"] = game_image.get("settings_ref", "master")
+    if game_image.get("base_image"):
+        args["BASE_IMAGE"] = game_image["base_image"]
+    if game_image.get("map_server"):
+        args["MAPSERVER"] = game_image["map_server"]
+    return args
+
+
+def image_tag(settings):
+    digest = hashlib.sha256()
+    with open(DOCKERFILE, "rb") as fp:
+        digest.update(fp.read())
+    for name, value in sorted(build_args(settings).items()):
+        digest.update((name + "=" + value + "\n").encode())
+    return "conf" + settings["env_vars"].get("CONF_CHECKVERSION", "0") + "-" + digest.hexdigest()[:12]
+
+
+def check_pushed(settings, ecr=None):
+    """Raise ValueError if the image tag the stacks reference is not in ECR.
+
+    Before the first deploy the repository does not exist yet, so there is
+    nothing to check: that deploy creates it and tools/build_image.py fills it.
+    """
+    tag = image_tag(settings)
+    if ecr is None:
+        import boto3
+        ecr = boto3.client("ecr", region_name=settings["main_region"])
+    try:
+        ecr.describe_images(repositoryName=GAME_REPOSITORY_NAME, imageIds=[{"imageTag": tag}])
+    except ecr.exceptions.RepositoryNotFoundException:
+        print("No " + GAME_REPOSITORY_NAME + " repository yet, run tools/build_image.py after this deploy.")
+    except ecr.exceptions.ImageNotFoundException:
+        raise ValueError(GAME_REPOSITORY_NAME + ":" + tag + " is not pushed, run tools/build_image.py before deploying.")
+
+
+def container_environment(env_vars):
+    """Task environment for the baked image: nothing to fetch or update on boot."""
+    return dict(env_vars, AUTO_UPDATE="false")
@@ -1,95 +1,236 @@
 import aws_cdk.aws_lambda as _lambda
 import aws_cdk.aws_iam as iam
-from aws_cdk import Stack, Duration
+from aws_cdk import Duration
 from constructs import Construct
-import aws_cdk.aws_certificatemanager as acm
-import aws_cdk.aws_apigateway as apigw
+import aws_cdk.aws_sqs as sqs
+import aws_cdk.aws_cloudwatch as cloudwatch
+import aws_cdk.aws_ecr as ecr
+import aws_cdk.aws_s3 as s3
 import aws_cdk.aws_route53 as route53
-import aws_cdk.aws_route53_targets as r53targets
+import jsii
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as targets
+from aws_cdk.aws_lambda_event_sources import SqsEventSource
+from stacks.game_image import GAME_REPOSITORY_NAME
+from stacks import regions, service_profiles
+
+DNS_QUEUE_NAME = "rtcwdemand-dns-changes"
+DNS_QUEUE_CONSUMERS = 2  # the least an SQS event source allows
+DNS_RATE_PER_SECOND = 4  # Route53 allows 5 requests per second per account
+DNS_RECONCILE_RATE_PER_SECOND = 1  # the reconciler's share, the queue consumers split the rest
+STATE_TABLE_NAME = "rtcwdemand-state"
+LIFECYCLE_METRICS = ["QueueTime", "PullTime", "BootTime", "ReadyTime", "DnsTime", "TimeToPlayable"]
+
+
+@jsii.implements(route53.IAliasRecordTarget)
+class ZoneRecordTarget:
+    """Alias target for another record of the same hosted zone."""
+
+    def __init__(self, zone_id, record_name):
+        self.zone_id = zone_id
+        self.record_name = record_name
+
+    def bind(self, record, zone=None):
+        return route53.AliasRecordTargetConfig(dns_name=self.record_name, hosted_zone_id=self.zone_id)
 
 
 class MainRegionSetup(Construct):
 
-    def __init__(self, scope: Construct, id: str, settings: dict, account: str,  **kwargs):
+    def __init__(self, scope: Construct, id: str, settings: dict, account: str, common_layer: _lambda.ILayerVersion,
+                 api_record: route53.CfnRecordSet = None, **kwargs):
         super().__init__(scope, id, **kwargs)
 
-        ecs_lambda_role = iam.Role(self, "LambdaECS",
-                                   role_name='rtcwdemand-ecs-lambda-role',
-                                   assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
-                                   )
-        ecs_lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole'))
+        self.add_dns_queue(settings, common_layer)
+        self.add_dns_reconciler(settings, account, common_layer)
+        self.add_lifecycle_dashboard(settings)
+        if settings.get("game_image"):
+            self.add_game_repository(settings, account)
+        if settings.get("match_stats"):
+            self.add_stats_bucket(settings)
+        if api_record is not None:
+            self.add_api_record(settings, api_record)
+
+    def add_api_record(self, settings, latency_record):
+        """dns_record_name as an alias of the regional APIs' latency records.
+
+        Same construct id as the simple record of the single main-region API,
+        so upgrading updates that record in place instead of creating a second one.
+        """
+        zone = route53.HostedZone.from_hosted_zone_attributes(self, "rtcwdemand_apiname",
+                                                              hosted_zone_id=settings["dns_hosted_zone"],
+                                                              zone_name=settings["dns_zone_name"]
+                                                              )
+        record = route53.ARecord(self, 'AliasRecord2',
+                                 record_name=settings["dns_record_name"],
+                                 target=route53.RecordTarget.from_alias(ZoneRecordTarget(settings["dns_hosted_zone"],
+                                                                                         latency_record.name)),
+                                 zone=zone)
+        # an alias needs its target to exist
+        record.node.add_dependency(latency_record)
 
-        ecs_lambda = _lambda.Function(
-            self, 'ecs_lambda',
-            function_name='rtcwdemand-ecs-lambda',
+    def add_dns_queue(self, settings, common_layer):
+        """Queue for DNS intents from every region, drained by a single batching consumer."""
+        dead_letters = sqs.Queue(self, "DnsChangesDLQ",
+                                 queue_name=DNS_QUEUE_NAME + "-dlq",
+                                 retention_period=Duration.days(14)
+                                 )
+        dns_queue = sqs.Queue(self, "DnsChanges",
+                              queue_name=DNS_QUEUE_NAME,
+                              visibility_timeout=Duration.seconds(180),
+                              dead_letter_queue=sqs.DeadLetterQueue(max_receive_count=5, queue=dead_letters)
+                              )
+        
+        dns_queue_lambda_role = iam.Role(self, "LambdaDnsQueue",
+                                         role_name='rtcwdemand-dns-queue-lambda-role',
+                                         assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
+                                         )
+        dns_queue_lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole'))
+        dns_queue_lambda_role.attach_inline_policy(iam.Policy(
+            self,
+            "dnsqueuelambdaPolicy",
+            policy_name="rtcwdemand_dns_queue_lambda_Policy",
+            statements=[
+                iam.PolicyStatement(resources=[regions.arn(self, "route53", "hostedzone", settings["dns_hosted_zone"], region="", account="")],
+                                    sid="AllowChangeRecords",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["route53:ChangeResourceRecordSets"]
+                )
+            ]
+        ))
+        
+        # the event source caps the consumers instead of reserved concurrency, which would make the
+        # SQS poller throttle and push messages to the DLQ; the consumers split the Route53 rate
+        dns_queue_lambda = _lambda.Function(
+            self, 'dns_queue_lambda',
+            function_name='rtcwdemand-dns-queue-lambda',
             runtime=_lambda.Runtime.PYTHON_3_8,
-            code=_lambda.Code.from_asset("lambdas/ecslambda"), 
+            code=_lambda.Code.from_asset("lambdas/dnsqueue"),
             handler='main.handler',
-            role=ecs_lambda_role,
-            timeout=Duration.seconds(10),
+            layers=[common_layer],
+            role=dns_queue_lambda_role,
+            timeout=Duration.seconds(30),
             memory_size=128
         )
-        
-        ecs_lambda.add_environment("ECS_SERVICE_NAME", settings["ECS_SERVICE_NAME"])
-        ecs_lambda.add_environment("ECS_CLUSTER_NAME", settings["ECS_CLUSTER_NAME"])
-        
-        all_ecs_clusters = self.list_clusters(settings, account)
-        
-        policy = iam.Policy(
+        dns_queue_lambda.add_environment("INSTRUMENT_SAMPLE_RATE", str(settings.get("instrument_sample_rate", 0.1)))
+        dns_queue_lambda.add_environment("DNS_RATE_PER_SECOND", str((DNS_RATE_PER_SECOND - DNS_RECONCILE_RATE_PER_SECOND) / DNS_QUEUE_CONSUMERS))
+        dns_queue_lambda.add_event_source(SqsEventSource(dns_queue,
+                                                         batch_size=100,
+                                                         max_batching_window=Duration.seconds(2),
+                                                         max_concurrency=DNS_QUEUE_CONSUMERS,
+                                                         report_batch_item_failures=True
+                                                         ))
+        return dns_queue
+
+    def add_dns_reconciler(self, settings, account, common_layer):
+        """Scheduled lambda fixing the server records r53lambda missed, across every region."""
+        reconcile_lambda_role = iam.Role(self, "LambdaDnsReconcile",
+                                         role_name='rtcwdemand-dns-reconcile-lambda-role',
+                                         assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
+                                         )
+        reconcile_lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole'))
+        reconcile_lambda_role.attach_inline_policy(iam.Policy(
             self,
-            "ecslambdaPolicy",
-            policy_name="rtcwdemand_ecs_lambda_Policy",
+            "dnsreconcilelambdaPolicy",
+            policy_name="rtcwdemand_dns_reconcile_lambda_Policy",
             statements=[
-                iam.PolicyStatement(resources=all_ecs_clusters,
-                                    sid="AllowChangeRecords",
+                iam.PolicyStatement(resources=[regions.arn(self, "route53", "hostedzone", settings["dns_hosted_zone"], region="", account="")],
+                                    sid="AllowRecords",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["route53:ListResourceRecordSets", "route53:ChangeResourceRecordSets"]
+                ),
+                iam.PolicyStatement(resources=["*"],
+                                    sid="AllowListTasks",
                                     effect=iam.Effect.ALLOW,
-                                    actions=["ecs:UpdateService", "ecs:DescribeServices"]
+                                    actions=["ecs:ListTasks"],
+                                    conditions={"ArnEquals": {"ecs:cluster": [regions.arn(self, "ecs", "cluster", settings["ECS_CLUSTER_NAME"], region=region, account=account)
+                                                                              for region in regions.names(settings)]}}
+                ),
+                iam.PolicyStatement(resources=[regions.arn(self, "ecs", "task", settings["ECS_CLUSTER_NAME"] + "/*", region=region, account=account)
+                                               for region in regions.names(settings)],
+                                    sid="AllowDescribeTasks",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["ecs:DescribeTasks"]
+                ),
+                iam.PolicyStatement(resources=["*"],
+                                    sid="AllowDescribeENI",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["ec2:DescribeNetworkInterfaces"]
+                ),
+                iam.PolicyStatement(resources=[regions.arn(self, "dynamodb", "table", STATE_TABLE_NAME, region=region, account=account)
+                                               for region in regions.names(settings)],
+                                    sid="AllowState",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["dynamodb:PutItem", "dynamodb:GetItem", "dynamodb:DeleteItem", "dynamodb:UpdateItem", "dynamodb:Query"]
                 )
             ]
+        ))
+
+        # runs are minutes apart and time out long before the next one, so they never overlap
+        reconcile_lambda = _lambda.Function(
+            self, 'dns_reconcile_lambda',
+            function_name='rtcwdemand-dns-reconcile-lambda',
+            runtime=_lambda.Runtime.PYTHON_3_8,
+            code=_lambda.Code.from_asset("lambdas/dnsreconcile"),
+            handler='main.handler',
+            layers=[common_layer],
+            role=reconcile_lambda_role,
+            timeout=Duration.seconds(120),
+            memory_size=128
         )
+        reconcile_lambda.add_environment("DNS_HOSTED_ZONE", settings["dns_hosted_zone"])
+        reconcile_lambda.add_environment("DNS_RATE_PER_SECOND", str(DNS_RECONCILE_RATE_PER_SECOND))
+        reconcile_lambda.add_environment("DNS_HOSTED_ZONE_NAME", settings["dns_zone_name"])
+        reconcile_lambda.add_environment("READY_TIMEOUT", str(settings.get("ready_timeout", 150)))
+        reconcile_lambda.add_environment("STATE_TABLE_NAME", STATE_TABLE_NAME)
+        reconcile_lambda.add_environment("ECS_SERVICE_NAME", settings["ECS_SERVICE_NAME"])
+        reconcile_lambda.add_environment("ECS_CLUSTER_NAME", settings["ECS_CLUSTER_NAME"])
+        reconcile_lambda.add_environment(regions.REGIONS_ENV, regions.lambda_config(settings))
+        reconcile_lambda.add_environment("INSTRUMENT_SAMPLE_RATE", str(settings.get("instrument_sample_rate", 0.1)))
+        for name, value in service_profiles.environment(settings).items():
+            reconcile_lambda.add_environment(name, value)
 
-        ecs_lambda_role.attach_inline_policy(policy=policy)
-        
-        # the following role will be able to execute this lambda from another AWS resource
-        if settings.get("other_role", None):
-            other_role = iam.Role.from_role_arn(self, id="other_role", role_arn=settings["other_role"])
-            ecs_lambda.grant_invoke(other_role)
-            
-        cert = acm.Certificate.from_certificate_arn(self, "Certificate", settings["cert_arn"])
-
-        api = apigw.RestApi(self, "rtcwdemand",
-                            domain_name={
-                                "domain_name": settings["dns_api_url"],
-                                "certificate": cert
-                                },
-                            default_cors_preflight_options={
-                                "allow_origins": apigw.Cors.ALL_ORIGINS,
-                                "allow_methods": apigw.Cors.ALL_METHODS
-                                }
-                            )
-        
-        zone = route53.HostedZone.from_hosted_zone_attributes(self, "rtcwdemand_apiname", 
-                                                              hosted_zone_id=settings["dns_hosted_zone"], 
-                                                              zone_name=settings["dns_zone_name"]
-                                                              )
+        events.Rule(self, "DnsReconcileRule",
+                    schedule=events.Schedule.rate(Duration.minutes(settings.get("dns_reconcile_minutes", 10))),
+                    targets=[targets.LambdaFunction(handler=reconcile_lambda)])
 
-        route53.ARecord(self, 'AliasRecord2',
-                        record_name=settings["dns_record_name"],
-                        target=route53.RecordTarget.from_alias(r53targets.ApiGateway(api)),
-                        zone=zone)
+    def add_lifecycle_dashboard(self, settings):
+        """p50/p95 of every start phase per region, from the EMF metrics r53lambda emits."""
+        dashboard = cloudwatch.Dashboard(self, "LifecycleDashboard", dashboard_name="rtcwdemand-time-to-playable")
+        for metric_name in LIFECYCLE_METRICS:
+            graph_metrics = []
+            for region in regions.names(settings):
+                for statistic in ["p50", "p95"]:
+                    graph_metrics.append(cloudwatch.Metric(namespace="rtcwdemand",
+                                                           metric_name=metric_name,
+                                                           dimensions_map={"Region": region},
+                                                           statistic=statistic,
+                                                           label=region + " " + statistic,
+                                                           period=Duration.days(1)))
+            dashboard.add_widgets(cloudwatch.GraphWidget(title=metric_name + " (ms)", left=graph_metrics, width=12))
 
-        start_resource = api.root.add_resource("start")
-        start_region_id = start_resource.add_resource("{region}")
-        ecs_lambda_integration = apigw.LambdaIntegration(ecs_lambda)
-        start_region_id.add_method("GET", ecs_lambda_integration)
+    def add_stats_bucket(self, settings):
+        """Bucket every region's matchstats lambda writes round stats to, see stacks/match_stats.py."""
+        s3.Bucket(self, "MatchStatsBucket",
+                  bucket_name=settings["match_stats"]["bucket"],
+                  block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+                  encryption=s3.BucketEncryption.S3_MANAGED,
+                  enforce_ssl=True)
 
-        plan = api.add_usage_plan("UsagePlan",name="Easy",throttle={"rate_limit": 1, "burst_limit": 1 })
-        plan.add_api_stage(stage=api.deployment_stage)
-        
-    def list_clusters(self, settings, account):
-        clusters = []
-        for region_code, region in settings["regions"].items():
-            clusters.append("arn:aws:ecs:" + region + ":" + account + ":service/" + settings["ECS_CLUSTER_NAME"] + "/" + settings["ECS_SERVICE_NAME"])
-        return clusters
-    
+    def add_game_repository(self, settings, account):
+        """ECR repository for the baked game image, replicated to every other region."""
+        ecr.Repository(self, "GameRepository",
+                       repository_name=GAME_REPOSITORY_NAME,
+                       lifecycle_rules=[ecr.LifecycleRule(max_image_count=settings["game_image"].get("keep_images", 5))])
 
+        destinations = [ecr.CfnReplicationConfiguration.ReplicationDestinationProperty(region=region, registry_id=account)
+                        for region in regions.names(settings) if region != settings["main_region"]]
+        if destinations:
+            # replication is registry wide, the filter keeps it to the game image
+            ecr.CfnReplicationConfiguration(self, "GameReplication",
+                                            replication_configuration=ecr.CfnReplicationConfiguration.ReplicationConfigurationProperty(
+                                                rules=[ecr.CfnReplicationConfiguration.ReplicationRuleProperty(
+                                                    destinations=destinations,
+                                                    repository_filters=[ecr.CfnReplicationConfiguration.RepositoryFilterProperty(
+                                                        filter=GAME_REPOSITORY_NAME, filter_type="PREFIX_MATCH")]
+                                                    )]
+                                                ))
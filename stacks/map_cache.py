@@ -0,0 +1,116 @@
+"""Shared map/config cache for the game tasks of one region.
+
+An EFS file system holds every map and config file once, under
+objects/<sha256>, with a manifest of "sha256 size path" lines. Game tasks
+mount it read-only and docker/cache-sync.sh copies only the files whose hash
+differs from what the image already has before the server starts. A
+scheduled Fargate task runs docker/cache-refresh.sh, which rebuilds the
+manifest when the config ref, CONF_CHECKVERSION or MAPS change.
+"""
+import os
+from aws_cdk import Duration, RemovalPolicy
+from constructs import Construct
+import aws_cdk.aws_ec2 as ec2
+import aws_cdk.aws_ecs as ecs
+import aws_cdk.aws_efs as efs
+import aws_cdk.aws_iam as iam
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as targets
+
+CACHE_VOLUME = "rtcw-cache"
+CACHE_PATH = "/cache"
+DOCKER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker")
+
+
+def read_script(name):
+    with open(os.path.join(DOCKER_DIR, name)) as fp:
+        return fp.read()
+
+
+class MapCache(Construct):
+
+    def __init__(self, scope: Construct, id: str, settings: dict, vpc: ec2.IVpc, cluster: ecs.ICluster,
+                 image: ecs.ContainerImage, **kwargs):
+        super().__init__(scope, id, **kwargs)
+        self.settings = settings
+        cache_settings = settings["map_cache"]
+
+        self.file_system = efs.FileSystem(self, "FileSystem",
+                                          vpc=vpc,
+                                          encrypted=True,
+                                          lifecycle_policy=efs.LifecyclePolicy.AFTER_30_DAYS,
+                                          removal_policy=RemovalPolicy.DESTROY  # only holds copies
+                                          )
+        self.access_point = self.file_system.add_access_point("AccessPoint",
+                                                              path="/rtcw-cache",
+                                                              create_acl=efs.Acl(owner_uid="1000", owner_gid="1000", permissions="755"),
+                                                              posix_user=efs.PosixUser(uid="1000", gid="1000")
+                                                              )
+
+        refresh_task = ecs.FargateTaskDefinition(self, "RefreshTask", cpu=256, memory_limit_mib=512)
+        self.add_volume(refresh_task)
+        refresh_container = refresh_task.add_container("CacheRefresh",
+                                                       logging=ecs.AwsLogDriver(stream_prefix="rtcw_cache"),
+                                                       image=image,
+                                                       entry_point=["/bin/sh", "-c", read_script("cache-refresh.sh")],
+                                                       environment=self.refresh_environment())
+        refresh_container.add_mount_points(ecs.MountPoint(container_path=CACHE_PATH, source_volume=CACHE_VOLUME, read_only=False))
+        self.grant(refresh_task.task_role, "elasticfilesystem:ClientMount", "elasticfilesystem:ClientWrite")
+
+        refresh_security_group = ec2.SecurityGroup(self, "RefreshSecurityGroup", vpc=vpc,
+                                                   description="rtcw map cache refresher",
+                                                   allow_all_outbound=True)
+        self.file_system.connections.allow_default_port_from(refresh_security_group)
+
+        # it exits straight away when nothing changed, so it can run often
+        events.Rule(self, "RefreshRule",
+                    schedule=events.Schedule.rate(Duration.minutes(cache_settings.get("refresh_minutes", 30))),
+                    targets=[targets.EcsTask(cluster=cluster,
+                                             task_definition=refresh_task,
+                                             assign_public_ip=True,
+                                             subnet_selection=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PUBLIC),
+                                             security_groups=[refresh_security_group])])
+
+    def refresh_environment(self):
+        env_vars = self.settings["env_vars"]
+        game_image = self.settings.get("game_image") or {}
+        return {"CACHE_DIR": CACHE_PATH,
+                "SETTINGSURL": env_vars["SETTINGSURL"],
+                "SETTINGS_REF": self.settings["map_cache"].get("settings_ref", game_image.get("settings_ref", "master")),
+                "CONF_CHECKVERSION": env_vars.get("CONF_CHECKVERSION", ""),
+                "MAPS": env_vars.get("MAPS", ""),
+                "MAPSERVER": self.settings["map_cache"].get("map_server", game_image.get("map_server", ""))}
+
+    def add_volume(self, task_definition):
+        task_definition.add_volume(name=CACHE_VOLUME,
+                                   efs_volume_configuration=ecs.EfsVolumeConfiguration(
+                                       file_system_id=self.file_system.file_system_id,
+                                       transit_encryption="ENABLED",
+                                       authorization_config=ecs.AuthorizationConfig(access_point_id=self.access_point.access_point_id,
+                                                                                    iam="ENABLED")))
+
+    def grant(self, role, *actions):
+        role.add_to_principal_policy(iam.PolicyStatement(resources=[self.file_system.file_system_arn],
+                                                         actions=list(actions),
+                                                         conditions={"StringEquals": {"elasticfilesystem:AccessPointArn": self.access_point.access_point_arn}}))
+
+    def entry_point(self):
+        """Container entry point that syncs from the cache, then runs the image's own entrypoint."""
+        return ["/bin/sh", "-c", read_script("cache-sync.sh"), "cache-sync"]
+
+    def command(self):
+        return self.settings["map_cache"].get("entrypoint", ["/home/game/start"])
+
+    def container_environment(self, env_vars):
+        # the cache already carries the config at the pinned ref
+        return dict(env_vars, AUTO_UPDATE="false", CACHE_DIR=CACHE_PATH)
+
+    def mount(self, task_definition, container):
+        """Mount the cache read-only into a game container."""
+        self.add_volume(task_definition)
+        container.add_mount_points(ecs.MountPoint(container_path=CACHE_PATH, source_volume=CACHE_VOLUME, read_only=True))
+        self.grant(task_definition.task_role, "elasticfilesystem:ClientMount")
+
+    def allow(self, security_group):
+        """Let the game tasks' security group reach the file system."""
+        self.file_system.connections.allow_default_port_from(security_group)
@@ -0,0 +1,106 @@
+"""Match stats pipeline of a region.
+
+The game containers log to one log group whose subscription feeds the
+matchstats lambda, which writes every round's player stats to the stats
+bucket (created by the main region) under matches/region=.../date=.../.
+
+    "match_stats": {"bucket": "my-rtcw-match-stats",
+                    "retention_days": 30,
+                    # optional, "parquet" (the default) or "json" (gzipped JSON lines)
+                    "format": "parquet",
+                    # optional, a layer with pyarrow to use instead of building one; {region} is filled in
+                    "pyarrow_layer": "arn:aws:lambda:{region}:123456789012:layer:pyarrow:1"}
+
+Parquet needs pyarrow, which the lambda gets from a layer built from
+lambdas/pyarrow_layer/requirements.txt at synth time (in Docker, with the
+Lambda Python image), unless pyarrow_layer names an existing one.
+"""
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_lambda as _lambda
+import aws_cdk.aws_logs as logs
+import aws_cdk.aws_logs_destinations as destinations
+from aws_cdk import BundlingOptions, Duration, RemovalPolicy
+from constructs import Construct
+
+from stacks.regions import RegionConfig
+
+GAME_LOG_GROUP_NAME = "rtcwdemand-game"
+PYARROW_LAYER_PATH = "lambdas/pyarrow_layer"
+# pyarrow and numpy without their tests, headers and Cython sources, to stay well inside the 250MB unzipped limit
+PYARROW_BUILD = ("pip install -r requirements.txt -t /asset-output/python --no-cache-dir"
+                 " && cd /asset-output/python"
+                 " && rm -rf pyarrow/tests pyarrow/include pyarrow/src numpy/*/tests numpy/tests"
+                 " && find . -name '*.pyx' -delete -o -name '*.pxd' -delete -o -name __pycache__ -prune -exec rm -rf {} +")
+RETENTION = {1: logs.RetentionDays.ONE_DAY, 7: logs.RetentionDays.ONE_WEEK, 14: logs.RetentionDays.TWO_WEEKS,
+             30: logs.RetentionDays.ONE_MONTH, 90: logs.RetentionDays.THREE_MONTHS, 365: logs.RetentionDays.ONE_YEAR}
+
+
+def bucket_arn(settings):
+    return "arn:aws:s3:::" + settings["match_stats"]["bucket"]
+
+
+class MatchStats(Construct):
+
+    def __init__(self, scope: Construct, id: str, settings: dict, region: RegionConfig,
+                 common_layer: _lambda.ILayerVersion, state_table, **kwargs):
+        super().__init__(scope, id, **kwargs)
+        stats_settings = settings["match_stats"]
+        stats_format = stats_settings.get("format", "parquet")
+        if stats_format not in ("json", "parquet"):
+            raise ValueError("match_stats format must be parquet or json.")
+
+        self.log_group = logs.LogGroup(self, "GameLogs",
+                                       log_group_name=GAME_LOG_GROUP_NAME,
+                                       retention=RETENTION.get(stats_settings.get("retention_days", 30), logs.RetentionDays.ONE_MONTH),
+                                       removal_policy=RemovalPolicy.DESTROY)
+
+        stats_lambda_role = iam.Role(self, "LambdaMatchStats",
+                                     role_name='rtcwdemand-matchstats-lambda-role-' + region.prefix,
+                                     assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
+                                     )
+        stats_lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole'))
+        stats_lambda_role.add_to_policy(iam.PolicyStatement(resources=[bucket_arn(settings) + "/matches/*"],
+                                                            effect=iam.Effect.ALLOW,
+                                                            actions=["s3:PutObject"]))
+        state_table.grant_read_write_data(stats_lambda_role)
+
+        layers = [common_layer]
+        if stats_format == "parquet":
+            layers.append(self.pyarrow_layer(stats_settings, region))
+
+        # no reserved concurrency, throttled log deliveries would only pile up; batches of one
+        # stream that overlap are caught by the conditional write of the pending lines and retried
+        stats_lambda = _lambda.Function(
+            self, 'matchstats_lambda',
+            function_name='rtcwdemand-matchstats-lambda',
+            runtime=_lambda.Runtime.PYTHON_3_8,
+            code=_lambda.Code.from_asset("lambdas/matchstats"),
+            handler='main.handler',
+            layers=layers,
+            role=stats_lambda_role,
+            timeout=Duration.seconds(60),
+            memory_size=512 if stats_format == "parquet" else 128
+        )
+        stats_lambda.add_environment("STATE_TABLE_NAME", state_table.table_name)
+        stats_lambda.add_environment("STATS_BUCKET", stats_settings["bucket"])
+        stats_lambda.add_environment("STATS_BUCKET_REGION", settings["main_region"])
+        stats_lambda.add_environment("STATS_FORMAT", stats_format)
+        stats_lambda.add_environment("INSTRUMENT_SAMPLE_RATE", str(settings.get("instrument_sample_rate", 0.1)))
+
+        logs.SubscriptionFilter(self, "StatsSubscription",
+                                log_group=self.log_group,
+                                destination=destinations.LambdaDestination(stats_lambda),
+                                filter_pattern=logs.FilterPattern.all_events())
+
+    def pyarrow_layer(self, stats_settings, region):
+        """The settings' pyarrow layer, or one built from lambdas/pyarrow_layer."""
+        if stats_settings.get("pyarrow_layer"):
+            return _lambda.LayerVersion.from_layer_version_arn(self, "PyarrowLayer",
+                                                               stats_settings["pyarrow_layer"].format(region=region.name))
+        return _lambda.LayerVersion(self, "PyarrowLayer",
+                                    layer_version_name="rtcwdemand-pyarrow",
+                                    code=_lambda.Code.from_asset(PYARROW_LAYER_PATH,
+                                                                 bundling=BundlingOptions(image=_lambda.Runtime.PYTHON_3_8.bundling_image,
+                                                                                          command=["bash", "-c", PYARROW_BUILD])),
+                                    compatible_runtimes=[_lambda.Runtime.PYTHON_3_8],
+                                    description="pyarrow for the matchstats Parquet files")
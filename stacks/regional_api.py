@@ -0,0 +1,294 @@
+"""Start and status API of one region.
+
+Every region stack runs its own start handler (ecslambda) and status
+handler, so a start request is served next to the ECS service it scales. A
+region with a certificate (its registry cert_arn, or settings["cert_arn"] in
+the main region) also gets a regional API Gateway on dns_api_url, published
+as a Route53 latency record with a health check: clients resolve to the
+closest healthy region, and no region is a single point of failure. The
+latency records have a name of their own (see latency_record_name), which
+the main region's dns_record_name record aliases, because Route53 does not
+allow a simple and a latency record of the same name and type. The
+handlers still accept every region, so a request that lands elsewhere is
+served with cross-region calls. With settings["batch_api_key"] the API also
+takes tournament batches (lambdas/batchlambda).
+"""
+import aws_cdk.aws_apigateway as apigw
+import aws_cdk.aws_certificatemanager as acm
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_lambda as _lambda
+import aws_cdk.aws_route53 as route53
+from aws_cdk import Duration
+from constructs import Construct
+
+from stacks import regions, service_profiles
+from stacks.main_region_construct import STATE_TABLE_NAME
+from stacks.regions import RegionConfig
+
+
+LATENCY_RECORD_SUFFIX = "-latency"
+
+
+def latency_record_name(settings):
+    return settings["dns_record_name"] + LATENCY_RECORD_SUFFIX + "." + settings["dns_zone_name"]
+
+
+def certificate_arn(settings, region: RegionConfig):
+    if region.cert_arn:
+        return region.cert_arn
+    return settings["cert_arn"] if region.name == settings["main_region"] else None
+
+
+class RegionalApi(Construct):
+
+    def __init__(self, scope: Construct, id: str, settings: dict, region: RegionConfig, account: str,
+                 common_layer: _lambda.ILayerVersion, **kwargs):
+        super().__init__(scope, id, **kwargs)
+        self.latency_record = None
+
+        ecs_lambda_role = iam.Role(self, "LambdaECS",
+                                   role_name='rtcwdemand-ecs-lambda-role-' + region.prefix,
+                                   assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
+                                   )
+        ecs_lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole'))
+
+        ecs_lambda = _lambda.Function(
+            self, 'ecs_lambda',
+            function_name='rtcwdemand-ecs-lambda',
+            runtime=_lambda.Runtime.PYTHON_3_8,
+            code=_lambda.Code.from_asset("lambdas/ecslambda"),
+            handler='main.handler',
+            layers=[common_layer],
+            role=ecs_lambda_role,
+            timeout=Duration.seconds(30),
+            memory_size=128
+        )
+
+        ecs_lambda.add_environment("ECS_SERVICE_NAME", settings["ECS_SERVICE_NAME"])
+        ecs_lambda.add_environment("ECS_CLUSTER_NAME", settings["ECS_CLUSTER_NAME"])
+        ecs_lambda.add_environment("STATE_TABLE_NAME", STATE_TABLE_NAME)
+        ecs_lambda.add_environment("INSTRUMENT_SAMPLE_RATE", str(settings.get("instrument_sample_rate", 0.1)))
+        ecs_lambda.add_environment("DNS_HOSTED_ZONE_NAME", settings["dns_zone_name"])
+        ecs_lambda.add_environment("WAIT_SECONDS", "25")
+        ecs_lambda.add_environment(regions.REGIONS_ENV, regions.lambda_config(settings))
+        ecs_lambda.add_environment("PREWARM", "true" if settings.get("prewarm") else "false")
+        for name, value in service_profiles.environment(settings).items():
+            ecs_lambda.add_environment(name, value)
+
+        # every region, for the requests latency routing sends to the "wrong" one
+        policy = iam.Policy(
+            self,
+            "ecslambdaPolicy",
+            policy_name="rtcwdemand_ecs_lambda_Policy",
+            statements=[
+                iam.PolicyStatement(resources=self.list_clusters(settings, account),
+                                    sid="AllowChangeRecords",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["ecs:UpdateService", "ecs:DescribeServices"]
+                ),
+                iam.PolicyStatement(resources=self.list_state_tables(settings, account),
+                                    sid="AllowRecordStarts",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["dynamodb:PutItem", "dynamodb:GetItem", "dynamodb:DeleteItem", "dynamodb:UpdateItem", "dynamodb:Query"]
+                )
+            ]
+        )
+
+        ecs_lambda_role.attach_inline_policy(policy=policy)
+        self.ecs_lambda = ecs_lambda
+
+        # the following role will be able to execute this lambda from another AWS resource
+        if settings.get("other_role", None):
+            other_role = iam.Role.from_role_arn(self, id="other_role", role_arn=settings["other_role"])
+            ecs_lambda.grant_invoke(other_role)
+
+        cert_arn = certificate_arn(settings, region)
+        if not cert_arn:
+            # no certificate for dns_api_url here, the other regions' APIs serve this one
+            return
+        cert = acm.Certificate.from_certificate_arn(self, "Certificate", cert_arn)
+
+        status_cache_ttl = settings.get("status_cache_ttl", 10)
+        status_method_options = apigw.MethodDeploymentOptions(caching_enabled=True, cache_ttl=Duration.seconds(status_cache_ttl))
+        api = apigw.RestApi(self, "rtcwdemand",
+                            endpoint_types=[apigw.EndpointType.REGIONAL],
+                            domain_name={
+                                "domain_name": settings["dns_api_url"],
+                                "certificate": cert,
+                                "endpoint_type": apigw.EndpointType.REGIONAL
+                                },
+                            default_cors_preflight_options={
+                                "allow_origins": apigw.Cors.ALL_ORIGINS,
+                                "allow_methods": apigw.Cors.ALL_METHODS
+                                },
+                            deploy_options=apigw.StageOptions(
+                                cache_cluster_enabled=status_cache_ttl > 0,
+                                cache_cluster_size="0.5",
+                                method_options={
+                                    "/status/GET": status_method_options,
+                                    "/status/{region}/GET": status_method_options
+                                    } if status_cache_ttl > 0 else None
+                                )
+                            )
+
+        start_resource = api.root.add_resource("start")
+        start_region_id = start_resource.add_resource("{region}")
+        ecs_lambda_integration = apigw.LambdaIntegration(ecs_lambda)
+        start_region_id.add_method("GET", ecs_lambda_integration)
+
+        # /start/{region}?wait=true and /wait/{token} hold the request until the server is playable
+        wait_token_id = api.root.add_resource("wait").add_resource("{token}")
+        wait_token_id.add_method("GET", ecs_lambda_integration)
+
+        self.add_status_api(api, settings, region, account, common_layer)
+        self.add_latency_record(api, settings, region)
+
+        # start requests are atomic and idempotent, so the plan only guards against abuse
+        plan = api.add_usage_plan("UsagePlan",name="Easy",throttle=settings.get("api_throttle", {"rate_limit": 20, "burst_limit": 50}))
+        plan.add_api_stage(stage=api.deployment_stage)
+
+        if settings.get("batch_api_key"):
+            self.add_batch_api(api, plan, settings, region, account, common_layer)
+
+    def add_status_api(self, api, settings, region, account, common_layer):
+        """GET /status and /status/{region}, served from the state tables and cached by API Gateway."""
+        status_lambda_role = iam.Role(self, "LambdaStatus",
+                                      role_name='rtcwdemand-status-lambda-role-' + region.prefix,
+                                      assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
+                                      )
+        status_lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole'))
+        status_lambda_role.attach_inline_policy(iam.Policy(
+            self,
+            "statuslambdaPolicy",
+            policy_name="rtcwdemand_status_lambda_Policy",
+            statements=[
+                iam.PolicyStatement(resources=self.list_state_tables(settings, account),
+                                    sid="AllowReadState",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["dynamodb:GetItem", "dynamodb:Query"]
+                )
+            ]
+        ))
+
+        status_lambda = _lambda.Function(
+            self, 'status_lambda',
+            function_name='rtcwdemand-status-lambda',
+            runtime=_lambda.Runtime.PYTHON_3_8,
+            code=_lambda.Code.from_asset("lambdas/statuslambda"),
+            handler='main.handler',
+            layers=[common_layer],
+            role=status_lambda_role,
+            timeout=Duration.seconds(10),
+            memory_size=128
+        )
+        status_lambda.add_environment("STATE_TABLE_NAME", STATE_TABLE_NAME)
+        status_lambda.add_environment("INSTRUMENT_SAMPLE_RATE", str(settings.get("instrument_sample_rate", 0.1)))
+        status_lambda.add_environment(regions.REGIONS_ENV, regions.lambda_config(settings))
+
+        status_resource = api.root.add_resource("status")
+        status_resource.add_method("GET", apigw.LambdaIntegration(status_lambda))
+        status_region_id = status_resource.add_resource("{region}")
+        status_region_id.add_method("GET",
+                                    apigw.LambdaIntegration(status_lambda, cache_key_parameters=["method.request.path.region"]),
+                                    request_parameters={"method.request.path.region": True})
+
+    def add_batch_api(self, api, plan, settings, region, account, common_layer):
+        """POST /batch, GET and DELETE /batch/{id} for tournaments, behind the batch API key.
+
+        The key has the same value in every region, so it works wherever latency routing sends the organiser.
+        """
+        batch_lambda_role = iam.Role(self, "LambdaBatch",
+                                     role_name='rtcwdemand-batch-lambda-role-' + region.prefix,
+                                     assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
+                                     )
+        batch_lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole'))
+        batch_lambda_role.attach_inline_policy(iam.Policy(
+            self,
+            "batchlambdaPolicy",
+            policy_name="rtcwdemand_batch_lambda_Policy",
+            statements=[
+                iam.PolicyStatement(resources=self.list_clusters(settings, account),
+                                    sid="AllowChangeServices",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["ecs:UpdateService", "ecs:DescribeServices"]
+                ),
+                iam.PolicyStatement(resources=["*"],
+                                    sid="AllowListTasks",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["ecs:ListTasks"],
+                                    conditions={"ArnEquals": {"ecs:cluster": [regions.arn(self, "ecs", "cluster", settings["ECS_CLUSTER_NAME"], region=name, account=account)
+                                                                              for name in regions.names(settings)]}}
+                ),
+                iam.PolicyStatement(resources=[regions.arn(self, "ecs", "task", settings["ECS_CLUSTER_NAME"] + "/*", region=name, account=account)
+                                               for name in regions.names(settings)],
+                                    sid="AllowProtectTasks",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["ecs:DescribeTasks", "ecs:UpdateTaskProtection"]
+                ),
+                iam.PolicyStatement(resources=self.list_state_tables(settings, account),
+                                    sid="AllowBatchState",
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["dynamodb:PutItem", "dynamodb:GetItem", "dynamodb:DeleteItem", "dynamodb:UpdateItem", "dynamodb:Query"]
+                )
+            ]
+        ))
+
+        batch_lambda = _lambda.Function(
+            self, 'batch_lambda',
+            function_name='rtcwdemand-batch-lambda',
+            runtime=_lambda.Runtime.PYTHON_3_8,
+            code=_lambda.Code.from_asset("lambdas/batchlambda"),
+            handler='main.handler',
+            layers=[common_layer],
+            role=batch_lambda_role,
+            timeout=Duration.seconds(29),
+            memory_size=256
+        )
+        batch_lambda.add_environment("ECS_SERVICE_NAME", settings["ECS_SERVICE_NAME"])
+        batch_lambda.add_environment("ECS_CLUSTER_NAME", settings["ECS_CLUSTER_NAME"])
+        batch_lambda.add_environment("STATE_TABLE_NAME", STATE_TABLE_NAME)
+        batch_lambda.add_environment("INSTRUMENT_SAMPLE_RATE", str(settings.get("instrument_sample_rate", 0.1)))
+        batch_lambda.add_environment("DNS_HOSTED_ZONE_NAME", settings["dns_zone_name"])
+        batch_lambda.add_environment(regions.REGIONS_ENV, regions.lambda_config(settings))
+        for name, value in service_profiles.environment(settings).items():
+            batch_lambda.add_environment(name, value)
+
+        batch_integration = apigw.LambdaIntegration(batch_lambda)
+        batch_resource = api.root.add_resource("batch")
+        batch_resource.add_method("POST", batch_integration, api_key_required=True)
+        batch_id = batch_resource.add_resource("{id}")
+        batch_id.add_method("GET", batch_integration, api_key_required=True)
+        batch_id.add_method("DELETE", batch_integration, api_key_required=True)
+
+        plan.add_api_key(api.add_api_key("BatchKey", api_key_name="rtcwdemand-batch", value=settings["batch_api_key"]))
+
+    def add_latency_record(self, api, settings, region):
+        """dns_api_url resolves to the closest region whose API answers its own /status."""
+        health_check = route53.CfnHealthCheck(self, "ApiHealthCheck",
+                                              health_check_config=route53.CfnHealthCheck.HealthCheckConfigProperty(
+                                                  type="HTTPS",
+                                                  fully_qualified_domain_name=api.rest_api_id + ".execute-api." + region.name + ".amazonaws.com",
+                                                  resource_path="/" + api.deployment_stage.stage_name + "/status/" + region.name,
+                                                  request_interval=30,
+                                                  failure_threshold=3))
+        self.latency_record = route53.CfnRecordSet(self, "ApiLatencyRecord",
+                                                   hosted_zone_id=settings["dns_hosted_zone"],
+                                                   name=latency_record_name(settings),
+                                                   type="A",
+                                                   set_identifier=region.name,
+                                                   region=region.name,
+                                                   health_check_id=health_check.attr_health_check_id,
+                                                   alias_target=route53.CfnRecordSet.AliasTargetProperty(
+                                                       dns_name=api.domain_name.domain_name_alias_domain_name,
+                                                       hosted_zone_id=api.domain_name.domain_name_alias_hosted_zone_id,
+                                                       evaluate_target_health=False))
+
+    def list_state_tables(self, settings, account):
+        return [regions.arn(self, "dynamodb", "table", STATE_TABLE_NAME, region=region, account=account)
+                for region in regions.names(settings)]
+
+    def list_clusters(self, settings, account):
+        clusters = []
+        for region in regions.names(settings):
+            clusters.extend(service_profiles.service_arns(self, settings, region, account))
+        return clusters
@@ -0,0 +1,124 @@
+"""Region registry: everything that differs between regions lives in settings["regions"].
+
+    "regions": {"UE1": {"name": "us-east-1", "prefix": "na", "morning_hour": 8, "capacity": 3},
+                "EW2": {"name": "eu-west-2", "prefix": "eu", "morning_hour": 3, "capacity": 2,
+                        "vpc_id": "vpc-0123", "static_ip": True}}
+
+prefix names the servers (na1, na2, ...), morning_hour is the UTC hour of the
+daily safety-net stop and vpc_id pins the VPC lookup (the default VPC
+otherwise). static_ip puts the region's servers behind a UDP load balancer
+with fixed addresses in static_ips availability zones (default 2, one
+Elastic IP each), see stacks/static_endpoint.py. cert_arn is the region's
+certificate for dns_api_url, see stacks/regional_api.py. The older form, {"UE1": "us-east-1"} plus a separate "capacity"
+map, is still read for the original three regions.
+
+The lambdas get the registry as compact JSON in RTCW_REGIONS, see
+rtcwcommon.regions.
+"""
+import json
+from typing import List, NamedTuple, Optional
+
+import aws_cdk.aws_ec2 as ec2
+from aws_cdk import ArnFormat, Stack
+
+REGIONS_ENV = "RTCW_REGIONS"
+
+# prefix and morning hour of the regions the older settings format knows about
+LEGACY_DEFAULTS = {"us-east-1": {"prefix": "na", "morning_hour": 8},  # about 2-3am EST
+                   "sa-east-1": {"prefix": "sa", "morning_hour": 9},
+                   "eu-west-2": {"prefix": "eu", "morning_hour": 3}}
+
+
+class RegionConfig(NamedTuple):
+    code: str
+    name: str
+    prefix: str
+    morning_hour: int
+    capacity: int
+    vpc_id: Optional[str] = None
+    static_ip: bool = False
+    cert_arn: Optional[str] = None
+    static_ips: int = 2
+
+
+_loaded = {}
+
+
+def load(settings) -> List[RegionConfig]:
+    """The validated registry, parsed once per settings object."""
+    key = id(settings)
+    if key not in _loaded:
+        # the settings are kept alongside, so their id is not reused while cached
+        _loaded[key] = (settings, _parse(settings))
+    return _loaded[key][1]
+
+
+def _parse(settings):
+    configs = []
+    for code, entry in settings["regions"].items():
+        if isinstance(entry, str):
+            if entry not in LEGACY_DEFAULTS:
+                raise ValueError("Region " + code + " (" + entry + ") needs a name, prefix and morning_hour entry.")
+            entry = dict(LEGACY_DEFAULTS[entry], name=entry, capacity=settings.get("capacity", {}).get(code, 1))
+        config = RegionConfig(code=code,
+                              name=entry["name"],
+                              prefix=entry["prefix"],
+                              morning_hour=int(entry.get("morning_hour", 8)),
+                              capacity=int(entry.get("capacity", 1)),
+                              vpc_id=entry.get("vpc_id"),
+                              static_ip=bool(entry.get("static_ip")),
+                              cert_arn=entry.get("cert_arn"),
+                              static_ips=int(entry.get("static_ips", 2)))
+        if not 0 <= config.morning_hour <= 23:
+            raise ValueError("Region " + code + ": morning_hour must be 0-23.")
+        if config.capacity < 1:
+            raise ValueError("Region " + code + ": capacity must be at least 1.")
+        if config.static_ips < 1:
+            raise ValueError("Region " + code + ": static_ips must be at least 1.")
+        configs.append(config)
+    for attribute in ("name", "prefix"):
+        values = [getattr(config, attribute) for config in configs]
+        duplicates = sorted(set(value for value in values if values.count(value) > 1))
+        if duplicates:
+            raise ValueError("Regions share a " + attribute + ": " + ", ".join(duplicates))
+    return configs
+
+
+def by_name(settings, region) -> RegionConfig:
+    for config in load(settings):
+        if config.name == region:
+            return config
+    raise ValueError("Region " + region + " is not in settings[\"regions\"].")
+
+
+def names(settings):
+    return [config.name for config in load(settings)]
+
+
+def lambda_config(settings):
+    """Compact JSON of what the lambdas need per region."""
+    config = {}
+    for region in load(settings):
+        config[region.name] = {"prefix": region.prefix, "capacity": region.capacity}
+        if region.static_ip:
+            # slot n listens on static_port + n - 1 of the load balancer
+            config[region.name]["static_port"] = settings["RTCW_PORT"]
+    return json.dumps(config, separators=(",", ":"), sort_keys=True)
+
+
+def lookup_vpc(scope, config: RegionConfig):
+    """The region's VPC. The lookup result is cached in cdk.context.json, so only the
+    first synth of a region calls AWS; keep that file in version control."""
+    if config.vpc_id:
+        return ec2.Vpc.from_lookup(scope, "VPC", vpc_id=config.vpc_id)
+    return ec2.Vpc.from_lookup(scope, "VPC", is_default=True)
+
+
+def arn(scope, service, resource, resource_name, region=None, account=None):
+    """ARN of a resource in any region, e.g. arn(self, "ecs", "service", "cluster/service", "eu-west-2")."""
+    return Stack.of(scope).format_arn(service=service,
+                                      resource=resource,
+                                      resource_name=resource_name,
+                                      region=region,
+                                      account=account,
+                                      arn_format=ArnFormat.SLASH_RESOURCE_NAME)
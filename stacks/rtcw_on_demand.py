@@ -1,4 +1,4 @@
-from aws_cdk import Stack, Duration
+from aws_cdk import Stack, Duration, RemovalPolicy
 from constructs import Construct
 import aws_cdk.aws_lambda as _lambda
 import aws_cdk.aws_iam as iam
@@ -6,31 +6,38 @@ import aws_cdk.aws_ecs as ecs
 from aws_cdk import aws_events as events
 from aws_cdk import aws_events_targets as targets
 import aws_cdk.aws_ec2 as ec2
-from stacks.main_region_construct import MainRegionSetup
-
-from aws_cdk.aws_lambda_event_sources import SqsEventSource
+import aws_cdk.aws_dynamodb as dynamodb
+import aws_cdk.aws_ecr as ecr
+from stacks import game_image, regions, service_profiles
+from stacks.map_cache import MapCache
+from stacks.match_stats import MatchStats
+from stacks.regional_api import RegionalApi
+from stacks.static_endpoint import StaticEndpoint
+from stacks.telemetry import Telemetry
+from stacks.main_region_construct import MainRegionSetup, DNS_QUEUE_NAME, STATE_TABLE_NAME
 
 class RtcwOnDemandStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, settings: dict, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
         
+        common_layer = _lambda.LayerVersion(self, "CommonLayer",
+                                            layer_version_name="rtcwdemand-common",
+                                            code=_lambda.Code.from_asset("lambdas/layer"),
+                                            compatible_runtimes=[_lambda.Runtime.PYTHON_3_8],
+                                            description="Shared boto3 client pool for rtcwdemand lambdas"
+                                            )
+        
+        env_vars = dict(settings["env_vars"])  # every region stack adds its own HOSTNAME suffix
+        region = regions.by_name(settings, self.region)
+        hostname_suffix = region.prefix
+        
+        # start requests are served in the region of the servers they start
+        regional_api = RegionalApi(self, "RegionalApi", settings=settings, region=region, account=self.account, common_layer=common_layer)
+        
         if settings["main_region"] == self.region:
-            MainRegionSetup(self, "MainRegionConstruct", settings=settings, account=self.account)
-        
-        env_vars = settings["env_vars"]
-        if self.region == "us-east-1":
-            hostname_suffix = "na"
-            morning_hour = 8 # UTC, about 2-3am EST
-        elif self.region == "sa-east-1":
-            hostname_suffix = "sa"
-            morning_hour = 9 # UTC
-        elif self.region == "eu-west-2":
-            hostname_suffix = "eu"
-            morning_hour = 3 # UTC
-        else:
-            print("Unknown region: " + self.region)
-            raise Exception("Unknown region.")
+            MainRegionSetup(self, "MainRegionConstruct", settings=settings, account=self.account, common_layer=common_layer,
+                            api_record=regional_api.latency_record)
         
         r53_lambda_role = iam.Role(self, "LambdaR53",
                                    role_name='rtcwdemand-r53-lambda-role-' + hostname_suffix,
@@ -44,23 +51,54 @@ class RtcwOnDemandStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_8,
             code=_lambda.Code.from_asset("lambdas/r53lambda"), 
             handler='main.handler',
+            layers=[common_layer],
             role=r53_lambda_role,
-            timeout=Duration.seconds(10),
+            timeout=Duration.seconds(settings.get("ready_timeout", 150) + 30),
             memory_size=128
         )
         
         r53_lambda.add_environment("DNS_HOSTED_ZONE", settings["dns_hosted_zone"])
         r53_lambda.add_environment("DNS_HOSTED_ZONE_NAME", settings["dns_zone_name"])
+        r53_lambda.add_environment("RTCW_PORT", str(settings["RTCW_PORT"]))
+        r53_lambda.add_environment("READY_TIMEOUT", str(settings.get("ready_timeout", 150)))
+        r53_lambda.add_environment(regions.REGIONS_ENV, regions.lambda_config(settings))
+        r53_lambda.add_environment("ECS_SERVICE_NAME", settings["ECS_SERVICE_NAME"])
+        r53_lambda.add_environment("ECS_CLUSTER_NAME", settings["ECS_CLUSTER_NAME"])
+        r53_lambda.add_environment("SPOT_FALLBACK_ON_INTERRUPTION", "true" if settings.get("spot", {}).get("fallback_on_interruption") else "false")
+        for name, value in service_profiles.environment(settings).items():
+            r53_lambda.add_environment(name, value)
+        
+        # task arn -> eni -> public ip -> record name, so DNS can be removed exactly
+        state_table = dynamodb.Table(self, "StateTable",
+                                     table_name=STATE_TABLE_NAME,
+                                     partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+                                     sort_key=dynamodb.Attribute(name="sk", type=dynamodb.AttributeType.STRING),
+                                     billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                                     time_to_live_attribute="expires_at",
+                                     removal_policy=RemovalPolicy.DESTROY
+                                     )
+        state_table.grant_read_write_data(r53_lambda_role)
+        r53_lambda.add_environment("STATE_TABLE_NAME", state_table.table_name)
+        r53_lambda.add_environment("INSTRUMENT_SAMPLE_RATE", str(settings.get("instrument_sample_rate", 0.1)))
+        
+        # the queue lives in the main region; its url and arn are derived from the fixed name
+        r53_lambda.add_environment("DNS_QUEUE_URL", "https://sqs." + settings["main_region"] + ".amazonaws.com/" + self.account + "/" + DNS_QUEUE_NAME)
                
         policy = iam.Policy(
             self,
             "r53lambdaPolicy",
             policy_name="rtcwdemand_r53_lambda_Policy_" + hostname_suffix,
             statements=[
-                iam.PolicyStatement(resources=["arn:aws:route53:::hostedzone/" + settings["dns_hosted_zone"]],
-                                    sid="AllowChangeRecords",
+                iam.PolicyStatement(resources=[regions.arn(self, "route53", "hostedzone", settings["dns_hosted_zone"], region="", account="")],
+                                    sid="AllowListRecords",
+                                    effect=iam.Effect.ALLOW,
+                                    # record changes go through the DNS queue, whose consumers pace them
+                                    actions=["route53:ListResourceRecordSets"]
+                ),
+                iam.PolicyStatement(resources=[self.format_arn(service="sqs", resource=DNS_QUEUE_NAME, region=settings["main_region"])],
+                                    sid="AllowQueueRecordChanges",
                                     effect=iam.Effect.ALLOW,
-                                    actions=["route53:ChangeResourceRecordSets"]
+                                    actions=["sqs:SendMessage"]
                 ),
                 iam.PolicyStatement(resources=["*"],
                                     sid="AllowDescribeENI",
@@ -71,6 +109,18 @@ class RtcwOnDemandStack(Stack):
         )
 
         r53_lambda_role.attach_inline_policy(policy=policy)
+        if service_profiles.spot_enabled(settings):
+            # Spot fallback moves servers from a Spot service to its on-demand twin
+            r53_lambda_role.add_to_policy(iam.PolicyStatement(resources=service_profiles.service_arns(self, settings),
+                                                              effect=iam.Effect.ALLOW,
+                                                              actions=["ecs:UpdateService", "ecs:DescribeServices"]))
+            r53_lambda_role.add_to_policy(iam.PolicyStatement(resources=["*"],
+                                                              effect=iam.Effect.ALLOW,
+                                                              actions=["ecs:ListTasks"],
+                                                              conditions={"ArnEquals": {"ecs:cluster": regions.arn(self, "ecs", "cluster", settings["ECS_CLUSTER_NAME"])}}))
+            r53_lambda_role.add_to_policy(iam.PolicyStatement(resources=[regions.arn(self, "ecs", "task", settings["ECS_CLUSTER_NAME"] + "/*")],
+                                                              effect=iam.Effect.ALLOW,
+                                                              actions=["ecs:UpdateTaskProtection"]))
         
         ecsdecrement_lambda_role = iam.Role(self, "LambdaECSDecrement",
                                    role_name='rtcwdemand-ecsdecrement-lambda-role-' + hostname_suffix,
@@ -83,15 +133,32 @@ class RtcwOnDemandStack(Stack):
             "ecsdecrementPolicy" + hostname_suffix,
             policy_name="rtcwdemand_ecsdecrement_lambda_policy" + hostname_suffix,
             statements=[
-                iam.PolicyStatement(resources=["arn:aws:ecs:" + self.region + ":" + self.account + ":service/" + settings["ECS_CLUSTER_NAME"] + "/" + settings["ECS_SERVICE_NAME"]],
+                iam.PolicyStatement(resources=service_profiles.service_arns(self, settings),
                                     sid="AllowChangeCluster" + hostname_suffix,
                                     effect=iam.Effect.ALLOW,
                                     actions=["ecs:UpdateService", "ecs:DescribeServices"]
+                ),
+                iam.PolicyStatement(resources=["*"],
+                                    sid="AllowListTasks" + hostname_suffix,
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["ecs:ListTasks"],
+                                    conditions={"ArnEquals": {"ecs:cluster": regions.arn(self, "ecs", "cluster", settings["ECS_CLUSTER_NAME"])}}
+                ),
+                iam.PolicyStatement(resources=[regions.arn(self, "ecs", "task", settings["ECS_CLUSTER_NAME"] + "/*")],
+                                    sid="AllowProtectTasks" + hostname_suffix,
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["ecs:DescribeTasks", "ecs:UpdateTaskProtection"]
+                ),
+                iam.PolicyStatement(resources=["*"],
+                                    sid="AllowDescribeENI" + hostname_suffix,
+                                    effect=iam.Effect.ALLOW,
+                                    actions=["ec2:DescribeNetworkInterfaces"]
                 )
             ]
         )
 
         ecsdecrement_lambda_role.attach_inline_policy(policy=policy)
+        state_table.grant_read_write_data(ecsdecrement_lambda_role)
         
         ecsdecrement_lambda = _lambda.Function(
             self, 'ecsdecrement_lambda',
@@ -99,35 +166,43 @@ class RtcwOnDemandStack(Stack):
             runtime=_lambda.Runtime.PYTHON_3_8,
             code=_lambda.Code.from_asset("lambdas/ecsdecrement"), 
             handler='main.handler',
+            layers=[common_layer],
             role=ecsdecrement_lambda_role,
-            timeout=Duration.seconds(9),
+            timeout=Duration.seconds(30),
             memory_size=128
         )
         
         ecsdecrement_lambda.add_environment("ECS_SERVICE_NAME", settings["ECS_SERVICE_NAME"])
         ecsdecrement_lambda.add_environment("ECS_CLUSTER_NAME", settings["ECS_CLUSTER_NAME"])
+        ecsdecrement_lambda.add_environment("STATE_TABLE_NAME", state_table.table_name)
+        ecsdecrement_lambda.add_environment("INSTRUMENT_SAMPLE_RATE", str(settings.get("instrument_sample_rate", 0.1)))
+        ecsdecrement_lambda.add_environment("RTCW_PORT", str(settings["RTCW_PORT"]))
+        ecsdecrement_lambda.add_environment("IDLE_MINUTES", str(settings.get("idle_minutes", 15)))
+        ecsdecrement_lambda.add_environment("SILENT_MINUTES", str(settings.get("silent_minutes", 30)))
+        for name, value in service_profiles.environment(settings).items():
+            ecsdecrement_lambda.add_environment(name, value)
         
-        vpc = ec2.Vpc.from_lookup(self, "VPC", is_default=True)
-        # vpc = ec2.Vpc.from_lookup(self, "VPC", vpc_id = VPC_ID)
-        
-        cluster = ecs.Cluster(self, 'cluster', cluster_name=settings["ECS_CLUSTER_NAME"], vpc=vpc)
+        vpc = regions.lookup_vpc(self, region)
         
-        task_definition = ecs.FargateTaskDefinition(self, 'RTCWPro',
-                                                    cpu=256,
-                                                    memory_limit_mib  = 512
-                                                    )
+        spot_enabled = service_profiles.spot_enabled(settings)
+        cluster = ecs.Cluster(self, 'cluster', cluster_name=settings["ECS_CLUSTER_NAME"], vpc=vpc,
+                              enable_fargate_capacity_providers=spot_enabled)
             
         env_vars["HOSTNAME"] = env_vars["HOSTNAME"] + " " + hostname_suffix.upper()
         
         
-        container = task_definition.add_container('RTCWProTask',
-                                                  logging=ecs.AwsLogDriver(stream_prefix="rtcw_container"),
-                                                  image=ecs.ContainerImage.from_registry("msh100/rtcw"),
-                                                  environment=env_vars)
-        
-        port_mapping = ecs.PortMapping(container_port=settings["RTCW_PORT"], host_port=settings["RTCW_PORT"], protocol=ecs.Protocol.UDP) 
-        container.add_port_mappings(port_mapping)
+        if settings.get("game_image"):
+            # baked image, replicated into this region by the main region's ECR replication
+            game_repository = ecr.Repository.from_repository_name(self, "GameRepository", game_image.GAME_REPOSITORY_NAME)
+            image = ecs.ContainerImage.from_ecr_repository(game_repository, tag=game_image.image_tag(settings))
+            env_vars = game_image.container_environment(env_vars)
+        else:
+            image = ecs.ContainerImage.from_registry("msh100/rtcw")
         
+        map_cache = None
+        if settings.get("map_cache"):
+            map_cache = MapCache(self, "MapCache", settings=settings, vpc=vpc, cluster=cluster, image=image)
+            env_vars = map_cache.container_environment(env_vars)
 
         rtcw_security_group = ec2.SecurityGroup(self, "SecurityGroup",
                                               vpc=cluster.vpc,
@@ -136,14 +211,57 @@ class RtcwOnDemandStack(Stack):
                                               )
         rtcw_security_group.add_ingress_rule(ec2.Peer.any_ipv4(), ec2.Port.udp(27960), "allow rtcw access from the world")
         
-        service = ecs.FargateService(self, "RTCWProService",
-                                     service_name=settings["ECS_SERVICE_NAME"],
-                                     cluster=cluster,
-                                     task_definition=task_definition,
-                                     desired_count=0,
-                                     assign_public_ip=True,
-                                     security_groups = [rtcw_security_group]
-                                     )
+        static_endpoint = None
+        if region.static_ip:
+            # fixed addresses: r53lambda registers servers with the load balancer instead of publishing their IPs
+            static_endpoint = StaticEndpoint(self, "StaticEndpoint", settings=settings, region=region, vpc=vpc)
+            r53_lambda.add_environment("STATIC_ENDPOINT", static_endpoint.environment())
+            static_endpoint.grant(r53_lambda_role)
+        if map_cache:
+            map_cache.allow(rtcw_security_group)
+        
+        # with match_stats, the game logs go to one log group whose round stats end up in S3
+        log_group = None
+        if settings.get("match_stats"):
+            log_group = MatchStats(self, "MatchStats", settings=settings, region=region,
+                                   common_layer=common_layer, state_table=state_table).log_group
+        
+        telemetry = Telemetry(self, "Telemetry", settings=settings) if settings.get("telemetry") else None
+        
+        # one task definition per size profile, each with an on-demand and optionally a Spot service
+        for profile, size in service_profiles.profiles(settings).items():
+            suffix = "" if profile == service_profiles.default_profile(settings) else profile
+            task_definition = ecs.FargateTaskDefinition(self, 'RTCWPro' + suffix,
+                                                        cpu=size["cpu"],
+                                                        memory_limit_mib=size["memory"]
+                                                        )
+            
+            container = task_definition.add_container('RTCWProTask',
+                                                      logging=ecs.AwsLogDriver(stream_prefix="rtcw_container", log_group=log_group),
+                                                      image=image,
+                                                      entry_point=map_cache.entry_point() if map_cache else None,
+                                                      command=map_cache.command() if map_cache else None,
+                                                      environment=dict(env_vars, HOSTNAME=env_vars["HOSTNAME"] + " " + profile) if suffix else env_vars)
+            
+            port_mapping = ecs.PortMapping(container_port=settings["RTCW_PORT"], host_port=settings["RTCW_PORT"], protocol=ecs.Protocol.UDP) 
+            container.add_port_mappings(port_mapping)
+            if map_cache:
+                map_cache.mount(task_definition, container)
+            if telemetry:
+                telemetry.add_sidecar(task_definition, container, profile)
+            
+            for spot in ([False, True] if spot_enabled else [False]):
+                ecs.FargateService(self, "RTCWProService" + suffix + ("Spot" if spot else ""),
+                                   service_name=service_profiles.service_name(settings, profile, spot),
+                                   cluster=cluster,
+                                   task_definition=task_definition,
+                                   desired_count=0,
+                                   assign_public_ip=True,
+                                   vpc_subnets=ec2.SubnetSelection(subnets=static_endpoint.subnets) if static_endpoint else None,
+                                   security_groups = [rtcw_security_group],
+                                   capacity_provider_strategies=[ecs.CapacityProviderStrategy(capacity_provider="FARGATE_SPOT" if spot else "FARGATE",
+                                                                                              weight=1)] if spot_enabled else None
+                                   )
         
         eventPattern = events.EventPattern(source=["aws.ecs"], 
                                            detail_type=["ECS Task State Change"], 
@@ -160,6 +278,71 @@ class RtcwOnDemandStack(Stack):
                     event_pattern=eventPattern,
                     )
         
-        #every 8AM run lambda to decrement the task
+        if spot_enabled:
+            # Spot had no capacity for a start, r53lambda moves it to the on-demand service
+            events.Rule(self,
+                        id="PlacementMonitor",
+                        rule_name="rtcwdemand-placement-failure",
+                        targets=[lambda_target_r53],
+                        description="Fall back to on-demand when Fargate Spot cannot place a task",
+                        event_pattern=events.EventPattern(source=["aws.ecs"],
+                                                          detail_type=["ECS Service Action"],
+                                                          detail={"clusterArn": [cluster.cluster_arn],
+                                                                  "eventName": ["SERVICE_TASK_PLACEMENT_FAILURE"]}),
+                        )
+        
+        #every few minutes stop servers that have been empty for idle_minutes
+        lambda_target_idle_check = targets.LambdaFunction(handler=ecsdecrement_lambda,
+                                                          event=events.RuleTargetInput.from_object({"event": "idle-check"}))
+        events.Rule(self, "IdleCheckRule",
+                    schedule=events.Schedule.rate(Duration.minutes(settings.get("idle_check_minutes", 5))),
+                    targets=[lambda_target_idle_check])
+        
+        #every 8AM run lambda to decrement the task, as a safety net it stops every empty server
         lambda_target_ecsdecrement_lambda = targets.LambdaFunction(handler=ecsdecrement_lambda)
-        events.Rule(self, "ScheduleRule", schedule=events.Schedule.cron(hour=str(morning_hour)), targets=[lambda_target_ecsdecrement_lambda])
+        events.Rule(self, "ScheduleRule", schedule=events.Schedule.cron(hour=str(region.morning_hour)), targets=[lambda_target_ecsdecrement_lambda])
+        
+        if settings.get("prewarm"):
+            self.add_prewarm(settings, common_layer, state_table, hostname_suffix)
+    
+    def add_prewarm(self, settings, common_layer, state_table, hostname_suffix):
+        """Scheduled lambda launching servers ahead of the hours players usually come."""
+        prewarm_settings = settings["prewarm"]
+        prewarm_lambda_role = iam.Role(self, "LambdaPrewarm",
+                                       role_name='rtcwdemand-prewarm-lambda-role-' + hostname_suffix,
+                                       assumed_by=iam.ServicePrincipal("lambda.amazonaws.com")
+                                       )
+        prewarm_lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole'))
+        prewarm_lambda_role.add_to_policy(iam.PolicyStatement(resources=service_profiles.service_arns(self, settings),
+                                                              effect=iam.Effect.ALLOW,
+                                                              actions=["ecs:UpdateService", "ecs:DescribeServices"]))
+        state_table.grant_read_write_data(prewarm_lambda_role)
+        
+        prewarm_lambda = _lambda.Function(
+            self, 'prewarm_lambda',
+            function_name='rtcwdemand-prewarm-lambda',
+            runtime=_lambda.Runtime.PYTHON_3_8,
+            code=_lambda.Code.from_asset("lambdas/prewarm"),
+            handler='main.handler',
+            layers=[common_layer],
+            role=prewarm_lambda_role,
+            timeout=Duration.seconds(30),
+            memory_size=128
+        )
+        
+        prewarm_lambda.add_environment("ECS_SERVICE_NAME", settings["ECS_SERVICE_NAME"])
+        prewarm_lambda.add_environment("ECS_CLUSTER_NAME", settings["ECS_CLUSTER_NAME"])
+        prewarm_lambda.add_environment("STATE_TABLE_NAME", state_table.table_name)
+        prewarm_lambda.add_environment("INSTRUMENT_SAMPLE_RATE", str(settings.get("instrument_sample_rate", 0.1)))
+        prewarm_lambda.add_environment("DNS_HOSTED_ZONE_NAME", settings["dns_zone_name"])
+        prewarm_lambda.add_environment(regions.REGIONS_ENV, regions.lambda_config(settings))
+        prewarm_lambda.add_environment("PREWARM_LEAD_MINUTES", str(prewarm_settings.get("lead_minutes", 10)))
+        prewarm_lambda.add_environment("PREWARM_THRESHOLD", str(prewarm_settings.get("threshold", 0.5)))
+        prewarm_lambda.add_environment("PREWARM_MAX_SERVERS", str(prewarm_settings.get("max_servers", 1)))
+        prewarm_lambda.add_environment("PREWARM_HOLD_MINUTES", str(prewarm_settings.get("hold_minutes", 45)))
+        for name, value in service_profiles.environment(settings).items():
+            prewarm_lambda.add_environment(name, value)
+        
+        events.Rule(self, "PrewarmRule",
+                    schedule=events.Schedule.rate(Duration.minutes(prewarm_settings.get("check_minutes", 5))),
+                    targets=[targets.LambdaFunction(handler=prewarm_lambda)])
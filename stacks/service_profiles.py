@@ -0,0 +1,47 @@
+"""Server size profiles from the settings, mirrored by rtcwcommon.profiles.
+
+    "profiles": {"3v3": {"cpu": 256, "memory": 512}, "6v6": {"cpu": 512, "memory": 1024}},
+    "default_profile": "6v6",
+    "spot": {"enabled": True, "fallback_on_interruption": True}
+
+Without "profiles" there is a single "default" profile of 256 CPU / 512 MiB.
+"""
+import json
+
+from stacks import regions
+
+DEFAULT = "default"
+DEFAULT_SIZE = {"cpu": 256, "memory": 512}
+
+
+def profiles(settings):
+    return settings.get("profiles") or {DEFAULT: DEFAULT_SIZE}
+
+
+def default_profile(settings):
+    return settings.get("default_profile", DEFAULT if DEFAULT in profiles(settings) else sorted(profiles(settings))[0])
+
+
+def spot_enabled(settings):
+    return bool(settings.get("spot", {}).get("enabled"))
+
+
+def service_name(settings, profile, spot=False):
+    name = settings["ECS_SERVICE_NAME"]
+    if profile != default_profile(settings):
+        name += "-" + profile
+    return name + "-spot" if spot else name
+
+
+def environment(settings):
+    """Environment the lambdas read the profiles from."""
+    return {"SERVICE_PROFILES": json.dumps(sorted(profiles(settings)), separators=(",", ":")),
+            "DEFAULT_PROFILE": default_profile(settings),
+            "USE_SPOT": "true" if spot_enabled(settings) else "false"}
+
+
+def service_arns(scope, settings, region=None, account=None):
+    """Every game service of a region; all of their names start with ECS_SERVICE_NAME."""
+    prefix = settings["ECS_CLUSTER_NAME"] + "/" + settings["ECS_SERVICE_NAME"]
+    return [regions.arn(scope, "ecs", "service", prefix, region=region, account=account),
+            regions.arn(scope, "ecs", "service", prefix + "-*", region=region, account=account)]
@@ -0,0 +1,80 @@
+"""Static endpoint of a region: a UDP Network Load Balancer with Elastic IPs.
+
+Each slot gets a listener on RTCW_PORT + n - 1 with its own IP target
+group, and its hostname (na1, na2, ...) becomes a fixed A record of the
+Elastic IPs. r53lambda registers a task in its slot's target group instead
+of publishing the task's own IP, so starts no longer wait for DNS.
+
+The load balancer spans region.static_ips availability zones, one public
+subnet and Elastic IP each, which keeps it under the default quota of 5
+Elastic IPs in VPCs with more subnets (us-east-1 has 6). The game services
+run in the same subnets, the load balancer only reaches targets in its zones.
+"""
+import aws_cdk.aws_ec2 as ec2
+import aws_cdk.aws_elasticloadbalancingv2 as elbv2
+import aws_cdk.aws_iam as iam
+import aws_cdk.aws_route53 as route53
+from aws_cdk import Duration, Stack
+from constructs import Construct
+
+from stacks.regions import RegionConfig
+
+RECORD_TTL = Duration.hours(1)
+
+
+class StaticEndpoint(Construct):
+
+    def __init__(self, scope: Construct, id: str, settings: dict, region: RegionConfig, vpc: ec2.IVpc, **kwargs):
+        super().__init__(scope, id, **kwargs)
+        subnets = vpc.select_subnets(subnet_type=ec2.SubnetType.PUBLIC, one_per_az=True).subnets[:region.static_ips]
+        self.subnets = subnets
+        self.ips = [ec2.CfnEIP(self, "Ip" + str(index), domain="vpc") for index in range(len(subnets))]
+
+        self.load_balancer = elbv2.NetworkLoadBalancer(self, "LoadBalancer",
+                                                       vpc=vpc,
+                                                       internet_facing=True,
+                                                       cross_zone_enabled=True,
+                                                       vpc_subnets=ec2.SubnetSelection(subnets=subnets))
+        # the L2 construct has no Elastic IP support, map them on the CloudFormation resource
+        load_balancer = self.load_balancer.node.default_child
+        load_balancer.add_property_deletion_override("Subnets")
+        load_balancer.subnet_mappings = [elbv2.CfnLoadBalancer.SubnetMappingProperty(subnet_id=subnet.subnet_id,
+                                                                                     allocation_id=ip.attr_allocation_id)
+                                         for subnet, ip in zip(subnets, self.ips)]
+
+        zone = route53.HostedZone.from_hosted_zone_attributes(self, "Zone",
+                                                              hosted_zone_id=settings["dns_hosted_zone"],
+                                                              zone_name=settings["dns_zone_name"])
+        self.target_groups = []
+        for number in range(1, region.capacity + 1):
+            # the game only speaks UDP, so the TCP health check fails and the NLB fails open
+            # to the slot's single target, which is what we want
+            target_group = elbv2.NetworkTargetGroup(self, "Slot" + str(number),
+                                                    vpc=vpc,
+                                                    port=settings["RTCW_PORT"],
+                                                    protocol=elbv2.Protocol.UDP,
+                                                    target_type=elbv2.TargetType.IP,
+                                                    deregistration_delay=Duration.seconds(0),
+                                                    health_check=elbv2.HealthCheck(protocol=elbv2.Protocol.TCP))
+            self.load_balancer.add_listener("Listener" + str(number),
+                                            port=settings["RTCW_PORT"] + number - 1,
+                                            protocol=elbv2.Protocol.UDP,
+                                            default_target_groups=[target_group])
+            route53.ARecord(self, "Record" + str(number),
+                            zone=zone,
+                            record_name=region.prefix + str(number),
+                            target=route53.RecordTarget.from_ip_addresses(*[ip.ref for ip in self.ips]),
+                            ttl=RECORD_TTL)
+            self.target_groups.append(target_group)
+
+    def environment(self):
+        """STATIC_ENDPOINT for r53lambda, see rtcwcommon.endpoint."""
+        return Stack.of(self).to_json_string({"ips": [ip.ref for ip in self.ips],
+                                              "target_groups": [group.target_group_arn for group in self.target_groups]})
+
+    def grant(self, role):
+        role.add_to_principal_policy(iam.PolicyStatement(resources=[group.target_group_arn for group in self.target_groups],
+                                                         actions=["elasticloadbalancing:RegisterTargets",
+                                                                  "elasticloadbalancing:DeregisterTargets"]))
+        role.add_to_principal_policy(iam.PolicyStatement(resources=["*"],
+                                                         actions=["elasticloadbalancing:DescribeTargetHealth"]))
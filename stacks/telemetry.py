@@ -0,0 +1,46 @@
+"""Telemetry sidecar for the game tasks of a region.
+
+Every game task gets a small non-essential container running
+docker/telemetry.py, which logs the game container's CPU, throttling,
+memory, network and player count to the region's telemetry log group.
+tools/rightsize.py turns those samples into size recommendations.
+
+    "telemetry": {"interval_seconds": 30,
+                  # optional, any image with python3
+                  "image": "public.ecr.aws/docker/library/python:3.11-alpine"}
+"""
+import os
+import aws_cdk.aws_ecs as ecs
+import aws_cdk.aws_logs as logs
+from aws_cdk import RemovalPolicy
+from constructs import Construct
+
+TELEMETRY_LOG_GROUP_NAME = "rtcwdemand-telemetry"
+DEFAULT_IMAGE = "public.ecr.aws/docker/library/python:3.11-alpine"
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "docker", "telemetry.py")
+
+
+class Telemetry(Construct):
+
+    def __init__(self, scope: Construct, id: str, settings: dict, **kwargs):
+        super().__init__(scope, id, **kwargs)
+        self.settings = settings
+        self.log_group = logs.LogGroup(self, "TelemetryLogs",
+                                       log_group_name=TELEMETRY_LOG_GROUP_NAME,
+                                       retention=logs.RetentionDays.ONE_MONTH,
+                                       removal_policy=RemovalPolicy.DESTROY)
+        with open(SCRIPT) as fp:
+            self.script = fp.read()
+
+    def add_sidecar(self, task_definition: ecs.TaskDefinition, game_container: ecs.ContainerDefinition, profile: str):
+        telemetry_settings = self.settings["telemetry"]
+        task_definition.add_container("Telemetry",
+                                      image=ecs.ContainerImage.from_registry(telemetry_settings.get("image", DEFAULT_IMAGE)),
+                                      essential=False,  # a crash here never takes the server down
+                                      memory_reservation_mib=32,
+                                      entry_point=["python3", "-c", self.script],
+                                      logging=ecs.AwsLogDriver(stream_prefix="rtcw_telemetry", log_group=self.log_group),
+                                      environment={"GAME_CONTAINER": game_container.container_name,
+                                                   "RTCW_PORT": str(self.settings["RTCW_PORT"]),
+                                                   "TELEMETRY_SECONDS": str(telemetry_settings.get("interval_seconds", 30)),
+                                                   "PROFILE": profile})
@@ -0,0 +1,85 @@
+"""Shared setup: the common layer on the path, and a clean slate per test.
+
+The lambdas keep their clients, stores and region registry in module
+globals for the life of a container; each test starts without them.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(ROOT, "lambdas", "layer", "python"))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, ROOT)
+
+from rtcwcommon import clients, instrument, regions, state
+
+
+def load_lambda(name):
+    """A fresh copy of lambdas/<name>/main.py."""
+    spec = importlib.util.spec_from_file_location("test_" + name, os.path.join(ROOT, "lambdas", name, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeAws:
+    """Stands in for every boto3 client: records the calls, answers from responses.
+
+    responses maps "service:operation" to a value or a function of the call's
+    keyword arguments; operations without one return {}.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.responses = {}
+
+    def factory(self, service, region):
+        return FakeClient(self, service, region)
+
+    def on(self, operation, response):
+        self.responses[operation] = response
+
+    def called(self, operation):
+        """Keyword arguments of every call of "service:operation"."""
+        return [kwargs for name, region, kwargs in self.calls if name == operation]
+
+
+class FakeClient:
+
+    def __init__(self, aws, service, region):
+        self.aws = aws
+        self.service = service
+        self.region = region
+
+    def __getattr__(self, operation):
+        name = self.service + ":" + operation
+
+        def call(**kwargs):
+            self.aws.calls.append((name, self.region, kwargs))
+            response = self.aws.responses.get(name, {})
+            return response(**kwargs) if callable(response) else response
+        return call
+
+
+@pytest.fixture
+def aws():
+    fake = FakeAws()
+    clients.use_factory(fake.factory)
+    return fake
+
+
+@pytest.fixture(autouse=True)
+def clean_globals():
+    environ = dict(os.environ)
+    os.environ.pop("STATE_TABLE_NAME", None)
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    yield
+    os.environ.clear()
+    os.environ.update(environ)
+    clients.use_factory(None)
+    state.use_store(None)
+    regions.reset()
+    instrument.use_exporter(instrument.StdoutExporter())
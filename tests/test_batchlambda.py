@@ -0,0 +1,93 @@
+"""Tournament batches through batchlambda, with one in-memory store per region."""
+import json
+
+import pytest
+
+from conftest import load_lambda
+from rtcwcommon import servicecount, slots
+from rtcwcommon.state import LocalStore
+
+REGIONS = {"us-east-1": {"prefix": "na", "capacity": 3}, "eu-west-2": {"prefix": "eu", "capacity": 2}}
+
+
+@pytest.fixture
+def batchlambda(aws, monkeypatch):
+    for name, value in {"ECS_SERVICE_NAME": "pro", "ECS_CLUSTER_NAME": "RTCWCluster", "AWS_REGION": "us-east-1",
+                        "DNS_HOSTED_ZONE_NAME": "example.com", "RTCW_REGIONS": json.dumps(REGIONS)}.items():
+        monkeypatch.setenv(name, value)
+    aws.on("ecs:describe_services", lambda cluster, services: {"services": [{"desiredCount": 0}]})
+    module = load_lambda("batchlambda")
+    module.stores = {region: LocalStore() for region in REGIONS}
+    monkeypatch.setattr(module, "get_store", lambda region=None: module.stores[region or "us-east-1"])
+    return module
+
+
+def call(module, method, batch_id=None, body=None):
+    event = {"resource": "/batch/{id}" if batch_id else "/batch", "httpMethod": method,
+             "pathParameters": {"id": batch_id} if batch_id else None, "body": json.dumps(body) if body else None}
+    response = module.handler(event, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def desired(store, service="pro"):
+    return store.get("counter", service)[servicecount.ATTRIBUTE]
+
+
+def start(module, servers):
+    status, result = call(module, "POST", body={"name": "cup", "servers": servers})
+    assert status == 200
+    return result
+
+
+def test_start_reserves_and_scales_every_region(batchlambda):
+    result = start(batchlambda, [{"region": "us-east-1", "count": 2}, {"region": "eu-west-2", "count": 2}])
+    assert result["requested"] == 4 and not result["ready"]
+    assert sorted(server["hostname"] for server in result["servers"]) == [
+        "eu1.example.com", "eu2.example.com", "na1.example.com", "na2.example.com"]
+    assert desired(batchlambda.stores["us-east-1"]) == 2 and desired(batchlambda.stores["eu-west-2"]) == 2
+    assert all(slot["batch_id"] == result["id"] for slot in batchlambda.stores["eu-west-2"].query("slot"))
+
+
+def test_a_full_region_starts_what_fits(batchlambda):
+    slots.reserve(batchlambda.stores["eu-west-2"], "eu-west-2", "example.com", 2, "someone")
+    result = start(batchlambda, [{"region": "eu-west-2", "count": 2}])
+    assert result["started"][0]["started"] == 1
+    assert "1 could not be started" in result["message"]
+
+
+def test_bad_requests_are_rejected(batchlambda):
+    assert call(batchlambda, "POST", body={"servers": [{"region": "eu-west-2", "count": 3}]})[0] == 400
+    assert call(batchlambda, "POST", body={"servers": [{"region": "mars", "count": 1}]})[0] == 400
+    assert call(batchlambda, "GET", "us-east-1.nothere")[0] == 404
+    assert call(batchlambda, "GET", "mars.abc")[0] == 404
+
+
+def test_manifest_is_ready_when_every_server_has_an_ip(batchlambda):
+    batch_id = start(batchlambda, [{"region": "eu-west-2", "count": 1}])["id"]
+    store = batchlambda.stores["eu-west-2"]
+    slot = slots.bind(store, "eu-west-2", "example.com", 2, "arn:batch", profile="default")
+    slots.annotate(store, slot, ip="1.2.3.4")
+    status, result = call(batchlambda, "GET", batch_id)
+    assert status == 200 and result["ready"]
+    assert result["servers"] == [{"region": "eu-west-2", "slot": 1, "hostname": "eu1.example.com",
+                                  "profile": "default", "ready": True, "ip": "1.2.3.4"}]
+
+
+def test_teardown_stops_only_the_batch(batchlambda, aws):
+    store = batchlambda.stores["us-east-1"]
+    slots.bind(store, "us-east-1", "example.com", 3, "arn:other", profile="default")
+    servicecount.increment(store, aws.factory("ecs", "us-east-1"), "RTCWCluster", "pro", 3)
+    batch_id = start(batchlambda, [{"region": "us-east-1", "count": 2}])["id"]
+    slots.bind(store, "us-east-1", "example.com", 3, "arn:batch", profile="default")
+    aws.on("ecs:list_tasks", {"taskArns": ["arn:batch", "arn:other"]})
+    aws.on("ecs:describe_tasks", lambda cluster, tasks: {"tasks": [{"taskArn": arn, "group": "service:pro"} for arn in tasks]})
+
+    status, result = call(batchlambda, "DELETE", batch_id)
+    assert status == 200 and result["stopped"] == {"us-east-1": 2}
+    assert desired(store) == 1
+    assert [kwargs["tasks"] for kwargs in aws.called("ecs:update_task_protection")] == [["arn:other"]]
+    # the slot still waiting for its task is given back
+    remaining = {slot["task_arn"]: slot for slot in store.query("slot")}
+    assert set(remaining) == {"arn:batch", "arn:other"}
+    assert not batchlambda.batch.held(remaining["arn:batch"])
+    assert call(batchlambda, "GET", batch_id)[1]["state"] == "stopped"
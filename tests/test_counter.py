@@ -0,0 +1,114 @@
+"""The desired-count counter against DynamoDB conditional updates, through moto."""
+import threading
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+from rtcwcommon import clients, servicecount
+from rtcwcommon.state import ConditionFailed, DynamoStore
+
+TABLE = "rtcw-state"
+
+
+@pytest.fixture
+def store(monkeypatch):
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SECURITY_TOKEN", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        clients.reset()
+        clients.get_client("dynamodb", "us-east-1").create_table(
+            TableName=TABLE,
+            KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}, {"AttributeName": "sk", "KeyType": "RANGE"}],
+            AttributeDefinitions=[{"AttributeName": "pk", "AttributeType": "S"},
+                                  {"AttributeName": "sk", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST")
+        serialise(clients.get_client("dynamodb", "us-east-1"))
+        yield DynamoStore(TABLE, "us-east-1")
+        clients.reset()
+
+
+def serialise(client):
+    """One request at a time: DynamoDB applies each conditional write atomically, moto does not across threads."""
+    lock = threading.Lock()
+
+    def locked(call):
+        def wrapper(**kwargs):
+            with lock:
+                return call(**kwargs)
+        return wrapper
+
+    for name in ("get_item", "put_item", "update_item", "delete_item", "query"):
+        setattr(client, name, locked(getattr(client, name)))
+
+
+class FakeEcs:
+    def __init__(self, desired=0):
+        self.desired = desired
+        self.updates = []
+        self.lock = threading.Lock()
+
+    def describe_services(self, cluster, services):
+        return {"services": [{"serviceName": services[0], "desiredCount": self.desired}]}
+
+    def update_service(self, cluster, service, desiredCount):
+        with self.lock:
+            self.updates.append(desiredCount)
+            self.desired = desiredCount
+
+
+def test_add_stops_at_maximum(store):
+    assert store.add("counter", "svc", "desired", 2, maximum=3) == 2
+    with pytest.raises(ConditionFailed):
+        store.add("counter", "svc", "desired", 2, maximum=3)
+    assert store.add("counter", "svc", "desired", 1, maximum=3) == 3
+    assert store.get("counter", "svc", consistent=True)["desired"] == 3
+
+
+def test_add_stops_at_minimum(store):
+    store.put("counter", "svc", {"desired": 1})
+    assert store.add("counter", "svc", "desired", -1, minimum=0) == 0
+    with pytest.raises(ConditionFailed):
+        store.add("counter", "svc", "desired", -1, minimum=0)
+
+
+def test_add_creates_a_missing_counter(store):
+    assert store.add("counter", "new", "desired", 1, maximum=3) == 1
+
+
+def test_put_if_is_conditional(store):
+    store.put_if("slot", "1", {"state": "reserved"}, {"pk": None})
+    with pytest.raises(ConditionFailed):
+        store.put_if("slot", "1", {"state": "reserved"}, {"pk": None})
+    store.delete_if("slot", "1", {"state": "reserved"})
+    assert store.get("slot", "1", consistent=True) is None
+
+
+def test_concurrent_increments_never_pass_the_maximum(store):
+    ecs = FakeEcs()
+    servicecount.resync(store, ecs, "cluster", "svc")
+    results = []
+    barrier = threading.Barrier(8)
+
+    def start():
+        barrier.wait()
+        results.append(servicecount.increment(store, ecs, "cluster", "svc", maximum=3))
+
+    threads = [threading.Thread(target=start) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len([r for r in results if r is not None]) == 3
+    assert store.get("counter", "svc", consistent=True)["desired"] == 3
+    assert ecs.desired == 3
+
+
+def test_decrement_stops_at_zero(store):
+    ecs = FakeEcs(desired=1)
+    servicecount.resync(store, ecs, "cluster", "svc")
+    assert servicecount.decrement(store, ecs, "cluster", "svc") == 0
+    assert servicecount.decrement(store, ecs, "cluster", "svc") == 0
+    assert ecs.updates == [0]
+    assert ecs.desired == 0
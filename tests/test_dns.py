@@ -0,0 +1,107 @@
+"""Route53 changes: coalescing, failure reporting and the single retry layer."""
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from conftest import load_lambda
+from rtcwcommon import clients, dns
+
+QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/123/rtcwdemand-dns-changes"
+
+
+@pytest.fixture(autouse=True)
+def fast(monkeypatch):
+    monkeypatch.setattr(dns, "bucket", dns.TokenBucket(1000))
+    monkeypatch.setattr(dns.time, "sleep", lambda seconds: None)
+    monkeypatch.setenv("DNS_HOSTED_ZONE", "Z1")
+    monkeypatch.delenv("DNS_QUEUE_URL", raising=False)
+
+
+def error(code, message=""):
+    return ClientError({"Error": {"Code": code, "Message": message}}, "ChangeResourceRecordSets")
+
+
+def batches(aws):
+    return [[(change["Action"], change["ResourceRecordSet"]["Name"]) for change in call["ChangeBatch"]["Changes"]]
+            for call in aws.called("route53:change_resource_record_sets")]
+
+
+def test_coalesce_keeps_the_latest_intent_per_name():
+    intents = [dns.make_intent("UPSERT", "na1.example.com", "1.1.1.1", "Z1", "2024-01-01T00:00:02.000Z"),
+               dns.make_intent("DELETE", "NA1.example.com.", "1.1.1.1", "Z1", "2024-01-01T00:00:01.000Z"),
+               dns.make_intent("UPSERT", "na2.example.com", "2.2.2.2", "Z1", "2024-01-01T00:00:01.000Z"),
+               dns.make_intent("UPSERT", "na1.example.com", "3.3.3.3", "Z2", "2024-01-01T00:00:00.000Z")]
+    zones = dns.coalesce(intents)
+    assert {zone: [(i["action"], i["ip"]) for i in found] for zone, found in zones.items()} == {
+        "Z1": [("UPSERT", "1.1.1.1"), ("UPSERT", "2.2.2.2")], "Z2": [("UPSERT", "3.3.3.3")]}
+
+
+def test_one_batch_per_zone(aws):
+    intents = [dns.make_intent("UPSERT", "na1.example.com", "1.1.1.1", "Z1"),
+               dns.make_intent("UPSERT", "na2.example.com", "2.2.2.2", "Z1")]
+    assert dns.apply_intents(intents) == []
+    assert batches(aws) == [[("UPSERT", "na1.example.com"), ("UPSERT", "na2.example.com")]]
+
+
+def test_invalid_batch_is_split_and_only_real_failures_are_reported(aws):
+    def change(HostedZoneId, ChangeBatch):
+        changes = ChangeBatch["Changes"]
+        if len(changes) > 1:
+            raise error("InvalidChangeBatch", "one of them is wrong")
+        name = changes[0]["ResourceRecordSet"]["Name"]
+        if name == "na2.example.com":
+            raise error("InvalidChangeBatch", "Tried to delete resource record set na2.example.com but it was not found")
+        if name == "na3.example.com":
+            raise error("InvalidChangeBatch", "RRSet with DNS name na3.example.com is not permitted in zone")
+        return {}
+    aws.on("route53:change_resource_record_sets", change)
+    intents = [dns.make_intent("UPSERT", "na1.example.com", "1.1.1.1", "Z1"),
+               dns.make_intent("DELETE", "na2.example.com", "2.2.2.2", "Z1"),
+               dns.make_intent("UPSERT", "na3.example.com", "3.3.3.3", "Z1")]
+    assert dns.apply_intents(intents) == [intents[2]]
+    assert len(batches(aws)) == 4
+
+
+def test_throttled_requests_are_retried_up_to_max_attempts(aws):
+    attempts = []
+
+    def throttled(succeed_after, **kwargs):
+        attempts.append(kwargs)
+        if len(attempts) <= succeed_after:
+            raise error("Throttling")
+        return {}
+    changes = [dns.record_change("UPSERT", "na1.example.com", "1.1.1.1")]
+    aws.on("route53:change_resource_record_sets", lambda **kwargs: throttled(2, **kwargs))
+    assert dns.apply_changes("Z1", changes)
+    assert len(attempts) == 3
+
+    attempts.clear()
+    aws.on("route53:change_resource_record_sets", lambda **kwargs: throttled(dns.MAX_ATTEMPTS, **kwargs))
+    assert not dns.apply_changes("Z1", changes)
+    assert len(attempts) == dns.MAX_ATTEMPTS
+
+
+def test_route53_clients_leave_retries_to_dns():
+    assert clients.get_client("route53").meta.config.retries == {"total_max_attempts": 1, "mode": "standard"}
+    assert clients.get_client("ecs").meta.config.retries["mode"] == "adaptive"
+
+
+def test_queued_changes_never_touch_route53(aws, monkeypatch):
+    monkeypatch.setenv("DNS_QUEUE_URL", QUEUE_URL)
+    assert dns.submit("DELETE", "na1.example.com", "1.1.1.1")
+    assert aws.called("route53:change_resource_record_sets") == []
+    [message] = aws.called("sqs:send_message")
+    assert json.loads(message["MessageBody"])["action"] == "DELETE"
+
+
+def test_consumer_returns_only_failed_messages(aws):
+    def change(HostedZoneId, ChangeBatch):
+        if HostedZoneId == "Z2":
+            raise error("AccessDenied")
+        return {}
+    aws.on("route53:change_resource_record_sets", change)
+    records = [{"messageId": str(n), "body": json.dumps(dns.make_intent("UPSERT", name, "1.1.1.1", zone))}
+               for n, (name, zone) in enumerate([("na1.example.com", "Z1"), ("na2.example.com", "Z2")])]
+    records.append({"messageId": "bad", "body": "not json"})
+    assert load_lambda("dnsqueue").handler({"Records": records}, None) == {"batchItemFailures": [{"itemIdentifier": "1"}]}
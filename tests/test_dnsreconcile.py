@@ -0,0 +1,64 @@
+"""The DNS reconciler: its diff, and one run against fake AWS clients."""
+import json
+import time
+
+import pytest
+
+from conftest import load_lambda
+from rtcwcommon import dns, slots
+from rtcwcommon.state import get_store
+
+NOW = int(time.time())
+
+
+@pytest.fixture
+def reconcile(aws, monkeypatch):
+    for name, value in {"ECS_SERVICE_NAME": "pro", "ECS_CLUSTER_NAME": "RTCWCluster", "AWS_REGION": "us-east-1",
+                        "DNS_HOSTED_ZONE": "Z1", "DNS_HOSTED_ZONE_NAME": "example.com", "READY_TIMEOUT": "60",
+                        "RTCW_REGIONS": json.dumps({"us-east-1": {"prefix": "na", "capacity": 3}})}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(dns, "bucket", dns.TokenBucket(1000))
+    return load_lambda("dnsreconcile")
+
+
+def summary(changes):
+    return [(c["Action"], c["ResourceRecordSet"]["Name"], c["ResourceRecordSet"]["ResourceRecords"][0]["Value"],
+             c["ResourceRecordSet"]["TTL"]) for c in changes]
+
+
+def test_diff_fixes_wrong_and_missing_records_and_deletes_stale_ones(reconcile):
+    records = {"na1.example.com": ("1.1.1.1", 60), "na2.example.com": ("9.9.9.9", 60),
+               "na3.example.com": ("3.3.3.3", 300), "na4.example.com": ("4.4.4.4", 60)}
+    desired = {"na1.example.com": "1.1.1.1", "na2.example.com": "2.2.2.2", "na5.example.com": "5.5.5.5"}
+    assert summary(reconcile.diff(records, desired, {"na4.example.com"})) == [
+        ("UPSERT", "na2.example.com", "2.2.2.2", 60),
+        ("UPSERT", "na5.example.com", "5.5.5.5", 60),
+        ("DELETE", "na3.example.com", "3.3.3.3", 300)]
+
+
+def test_diff_of_matching_records_is_empty(reconcile):
+    assert reconcile.diff({"na1.example.com": ("1.1.1.1", 60)}, {"na1.example.com": "1.1.1.1"}, set()) == []
+
+
+def test_run_frees_gone_tasks_and_publishes_missed_ones(reconcile, aws):
+    started = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(NOW - 3600))
+    store = get_store("us-east-1")
+    slots.bind(store, "us-east-1", "example.com", 3, "arn:gone", NOW - 3600)
+    slots.annotate(store, store.get("slot", "1"), ip="1.1.1.1")
+    aws.on("route53:list_resource_record_sets", {"ResourceRecordSets": [
+        {"Name": "na1.example.com.", "Type": "A", "TTL": 60, "ResourceRecords": [{"Value": "1.1.1.1"}]},
+        {"Name": "na3.example.com.", "Type": "A", "TTL": 60, "ResourceRecords": [{"Value": "3.3.3.3"}]},
+        {"Name": "example.com.", "Type": "A", "TTL": 60, "ResourceRecords": [{"Value": "8.8.8.8"}]}]})
+    aws.on("ecs:list_tasks", {"taskArns": ["arn:missed"]})
+    aws.on("ecs:describe_tasks", {"tasks": [{"taskArn": "arn:missed", "lastStatus": "RUNNING", "group": "service:pro",
+                                             "startedAt": started, "attachments": [{"details": [
+                                                 {"name": "networkInterfaceId", "value": "eni-1"}]}]}]})
+    aws.on("ec2:describe_network_interfaces", {"NetworkInterfaces": [
+        {"NetworkInterfaceId": "eni-1", "Association": {"PublicIp": "2.2.2.2"}}]})
+
+    assert reconcile.handler({}, None) == "2 record(s), 1 live server(s), 2 change(s), 1 slot(s) freed."
+    [batch] = aws.called("route53:change_resource_record_sets")
+    assert summary(batch["ChangeBatch"]["Changes"]) == [("UPSERT", "na1.example.com", "2.2.2.2", 60),
+                                                        ("DELETE", "na3.example.com", "3.3.3.3", 60)]
+    assert store.get("task", "arn:gone")["dns_deleted"]
+    assert store.get("slot", "1")["task_arn"] == "arn:missed"
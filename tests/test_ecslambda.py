@@ -0,0 +1,73 @@
+"""Start requests through ecslambda, with one in-memory store per region."""
+import json
+
+import pytest
+
+from conftest import load_lambda
+from rtcwcommon import slots
+from rtcwcommon.state import LocalStore
+
+REGIONS = {"us-east-1": {"prefix": "na", "capacity": 1}, "eu-west-2": {"prefix": "eu", "capacity": 1}}
+
+
+@pytest.fixture
+def ecslambda(aws, monkeypatch):
+    for name, value in {"ECS_SERVICE_NAME": "pro", "ECS_CLUSTER_NAME": "RTCWCluster", "AWS_REGION": "us-east-1",
+                        "DNS_HOSTED_ZONE_NAME": "example.com", "RTCW_REGIONS": json.dumps(REGIONS),
+                        "LATENCY_TABLE": "/nonexistent"}.items():
+        monkeypatch.setenv(name, value)
+    desired = {}
+    aws.on("ecs:describe_services", lambda cluster, services: {
+        "services": [{"serviceName": name, "desiredCount": desired.get(name, 0)} for name in services]})
+    aws.on("ecs:update_service", lambda cluster, service, desiredCount: desired.update({service: desiredCount}))
+    module = load_lambda("ecslambda")
+    module.stores = {region: LocalStore() for region in REGIONS}
+    monkeypatch.setattr(module, "get_store", lambda region=None: module.stores[region or "us-east-1"])
+    return module
+
+
+def starts(store):
+    return sum(item["starts"] for item in store.query("history"))
+
+
+def body(response):
+    return json.loads(response["body"])
+
+
+def test_start_counts_demand_once(ecslambda):
+    response = body(ecslambda.handler({"region": "eu-west-2", "event": "increment"}, None))
+    assert response["hostname"] == "eu1.example.com"
+    assert starts(ecslambda.stores["eu-west-2"]) == 1
+    assert starts(ecslambda.stores["us-east-1"]) == 0
+
+
+def test_auto_start_counts_demand_where_it_is_served(ecslambda, aws):
+    slots.reserve(ecslambda.stores["us-east-1"], "us-east-1", "example.com", 1, "someone")
+    response = body(ecslambda.handler({"region": "auto", "event": "increment", "source_ip": "10.0.0.1"}, None))
+    assert response["region"] == "eu-west-2" and response["selected"] == "least_loaded"
+    assert starts(ecslambda.stores["eu-west-2"]) == 1
+    assert starts(ecslambda.stores["us-east-1"]) == 0
+
+
+def test_auto_start_counts_demand_once_when_every_region_is_full(ecslambda):
+    for region in REGIONS:
+        slots.reserve(ecslambda.stores[region], region, "example.com", 1, "someone")
+    response = body(ecslambda.handler({"region": "auto", "event": "increment", "source_ip": "10.0.0.1"}, None))
+    assert "hostname" not in response
+    assert starts(ecslambda.stores["us-east-1"]) == 1
+    assert starts(ecslambda.stores["eu-west-2"]) == 0
+
+
+def test_wait_rejects_unknown_regions(ecslambda, aws):
+    response = ecslambda.handler({"resource": "/wait/{token}", "pathParameters": {"token": "xx-evil-1.1.abc"}}, None)
+    assert response["statusCode"] == 404
+    assert aws.calls == []
+
+
+def test_wait_returns_the_ready_server(ecslambda):
+    store = ecslambda.stores["eu-west-2"]
+    slots.reserve(store, "eu-west-2", "example.com", 1, "req")
+    slots.annotate(store, slots.bind(store, "eu-west-2", "example.com", 1, "arn:task"), ip="1.2.3.4")
+    response = ecslambda.handler({"resource": "/wait/{token}", "pathParameters": {"token": "eu-west-2.1.req"}}, None)
+    assert response["statusCode"] == 200
+    assert body(response)["ip"] == "1.2.3.4"
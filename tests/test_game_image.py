@@ -0,0 +1,31 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+from stacks import game_image
+
+SETTINGS = {"main_region": "us-east-1",
+            "env_vars": {"CONF_CHECKVERSION": "3", "MAPS": "mp_ice"},
+            "game_image": {"settings_ref": "abc123"}}
+MANIFEST = '{"schemaVersion": 2, "mediaType": "application/vnd.docker.distribution.manifest.v2+json"}'
+
+
+@pytest.fixture
+def ecr():
+    with mock_aws():
+        yield boto3.client("ecr", region_name="us-east-1")
+
+
+def test_first_deploy_has_no_repository_to_check(ecr):
+    game_image.check_pushed(SETTINGS, ecr)
+
+
+def test_missing_tag_stops_the_synth(ecr):
+    ecr.create_repository(repositoryName=game_image.GAME_REPOSITORY_NAME)
+    ecr.put_image(repositoryName=game_image.GAME_REPOSITORY_NAME, imageManifest=MANIFEST, imageTag="older")
+    with pytest.raises(ValueError, match="tools/build_image.py"):
+        game_image.check_pushed(SETTINGS, ecr)
+
+    ecr.put_image(repositoryName=game_image.GAME_REPOSITORY_NAME, imageManifest=MANIFEST,
+                  imageTag=game_image.image_tag(SETTINGS))
+    game_image.check_pushed(SETTINGS, ecr)
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from rtcwcommon import idempotency
+from rtcwcommon.state import LocalStore
+
+# LocalStore hides items past expires_at by the clock
+NOW = time.time()
+
+
+def test_retry_gets_the_first_response():
+    store = LocalStore()
+    assert idempotency.begin(store, "start#abc", now=NOW) is None
+    with pytest.raises(idempotency.InProgress):
+        idempotency.begin(store, "start#abc", now=NOW + 1)
+    idempotency.finish(store, "start#abc", {"statusCode": 200}, now=NOW + 2)
+    assert idempotency.begin(store, "start#abc", now=NOW + 3) == {"statusCode": 200}
+
+
+def test_abandoned_key_can_run_again():
+    store = LocalStore()
+    idempotency.begin(store, "start#abc", now=NOW)
+    idempotency.abandon(store, "start#abc")
+    assert idempotency.begin(store, "start#abc", now=NOW + 1) is None
+
+
+def test_stale_pending_key_is_taken_over():
+    store = LocalStore()
+    idempotency.begin(store, "start#abc", now=NOW)
+    assert idempotency.begin(store, "start#abc", now=NOW + idempotency.PENDING_TIMEOUT + 1) is None
+
+
+def test_key_only_from_the_header():
+    event = {"headers": {"Idempotency-Key": "abc"}, "requestContext": {"identity": {"sourceIp": "1.2.3.4"}}}
+    assert idempotency.key_from_event(event, "start/us-east-1") == "start/us-east-1#abc"
+    del event["headers"]
+    assert idempotency.key_from_event(event, "start/us-east-1") is None
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from rtcwcommon import instrument
+
+
+@pytest.fixture
+def exporter():
+    exporter = instrument.MemoryExporter()
+    instrument.use_exporter(exporter)
+    instrument.flush("drop", force=True)
+    del exporter.lines[:]
+    return exporter
+
+
+def test_unsampled_invocations_are_dropped(exporter, monkeypatch):
+    monkeypatch.setenv("INSTRUMENT_SAMPLE_RATE", "0")
+    instrument.record_call("ecs:UpdateService", 12.5)
+    assert instrument.flush("ecslambda", 20) == []
+    assert exporter.lines == []
+
+
+def test_sampled_invocations_are_exported(exporter, monkeypatch):
+    monkeypatch.setenv("INSTRUMENT_SAMPLE_RATE", "1")
+    instrument.record_call("ecs:UpdateService", 12.5)
+    instrument.record_call("ecs:UpdateService", 7.5)
+    with instrument.phase("reserve"):
+        pass
+    lines = instrument.flush("ecslambda", 20)
+    assert len(lines) == 3
+    summary = json.loads(lines[0])
+    assert summary["HandlerTime"] == 20
+    assert summary["sampleRate"] == 1
+    assert exporter.values("AwsCallTime") == [12.5, 7.5, 12.5, 7.5]
+    assert len(exporter.values("PhaseTime")) == 1
+
+
+@pytest.mark.parametrize("kwargs, counter", [({"failed": True}, None), ({}, "AwsRetries"),
+                                             ({}, "AwsThrottles"), ({"force": True}, None)])
+def test_eventful_invocations_are_always_exported(exporter, monkeypatch, kwargs, counter):
+    monkeypatch.setenv("INSTRUMENT_SAMPLE_RATE", "0")
+    if counter:
+        instrument.count(counter)
+    assert instrument.flush("ecslambda", 20, **kwargs)
+    if counter:
+        assert exporter.values(counter) == [1]
+
+
+def test_flush_starts_over(exporter, monkeypatch):
+    monkeypatch.setenv("INSTRUMENT_SAMPLE_RATE", "1")
+    instrument.record_call("ecs:UpdateService", 12.5)
+    instrument.flush("ecslambda")
+    instrument.flush("ecslambda")
+    assert exporter.values("AwsCallTime") == [12.5, 12.5]
+
+
+def test_handler_flushes_failures(exporter, monkeypatch):
+    monkeypatch.setenv("INSTRUMENT_SAMPLE_RATE", "0")
+
+    @instrument.handler("broken")
+    def handler(event, context):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        handler({}, None)
+    assert exporter.values("HandlerErrors") == [1]
+
+
+def test_attached_client_calls_are_timed(exporter, monkeypatch):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    monkeypatch.setenv("INSTRUMENT_SAMPLE_RATE", "1")
+    with moto.mock_aws():
+        client = instrument.attach(boto3.client("sqs", region_name="us-east-1", aws_access_key_id="testing",
+                                                aws_secret_access_key="testing"), "sqs")
+        url = client.create_queue(QueueName="dns-changes")["QueueUrl"]
+        client.send_message(QueueUrl=url, MessageBody="{}")
+    instrument.flush("dnsqueue")
+    operations = [json.loads(line).get("Operation") for line in exporter.lines]
+    assert operations == [None, "sqs:CreateQueue", "sqs:SendMessage"]
+    assert len(exporter.values("AwsCallTime")) == 4
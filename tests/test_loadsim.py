@@ -0,0 +1,30 @@
+"""A short load simulator run: every handler answers the replayed events without errors."""
+import argparse
+import re
+
+import pytest
+
+import loadsim
+
+
+def test_replay_has_no_errors(capsys):
+    args = argparse.Namespace(starts_per_minute=60, task_events_per_minute=240, idle_checks_per_minute=12,
+                              duplicate_fraction=0.25, duration=10, speed=100, task_lifetime=2, capacity=50,
+                              concurrency=4, aws_latency_ms=0)
+    loadsim.run(args)
+    out = capsys.readouterr().out
+    rows = {match.group(1): (int(match.group(2)), int(match.group(3)))
+            for match in re.finditer(r"^(\w+)\s+(\d+)\s+(\d+)\s+[\d.]+", out, re.M)}
+    for name in ("ecslambda", "r53lambda", "ecsdecrement", "dnsqueue"):
+        events, errors = rows[name]
+        assert events > 0, name
+        assert errors == 0, name
+
+
+def test_fake_clients_validate_parameters():
+    botocore = pytest.importorskip("botocore.exceptions")
+    aws = loadsim.FakeAws(0)
+    ecs = aws.factory("ecs", "us-east-1")
+    with pytest.raises(botocore.ParamValidationError):
+        ecs.update_service(cluster="rtcw", service="rtcw", desiredCount="1")
+    assert ecs.update_service(cluster="rtcw", service="rtcw", desiredCount=1) == {"service": {"desiredCount": 1}}
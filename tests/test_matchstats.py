@@ -0,0 +1,115 @@
+import base64
+import gzip
+import json
+import os
+
+import pytest
+
+from conftest import load_lambda
+from rtcwcommon import matchstats
+from rtcwcommon.state import get_store
+
+LOGGED_AT = 1700000000000  # 2023-11-14
+ROUND = ['{"gameinfo": {"match_id": "42", "round": "2", "map": "te_escape2", "winner": "Axis"},',
+         ' "stats": [{"A1B2": {"alias": "player {1}", "team": "Axis", "categories": {"kills": 3, "accuracy": "41.5"}}},',
+         '           {"C3D4": {"alias": "other", "team": "Allies", "categories": {"kills": "1", "deaths": 3}}}]}']
+
+
+def read(path):
+    with gzip.open(path, "rt") as fp:
+        return [json.loads(line) for line in fp]
+
+
+def files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), str(directory)).replace(os.sep, "/")
+                  for root, dirs, names in os.walk(str(directory)) for name in names)
+
+
+def test_parser_carries_a_document_across_batches():
+    parser = matchstats.StreamParser()
+    assert parser.feed("ClientConnect: 1") == []
+    assert parser.feed(ROUND[0]) == []
+    assert parser.feed(ROUND[1]) == []
+    parser = matchstats.StreamParser(parser.pending())
+    documents = parser.feed(ROUND[2])
+    assert len(documents) == 1 and documents[0]["gameinfo"]["match_id"] == "42"
+    assert parser.pending() == []
+
+
+def test_parser_drops_documents_over_the_byte_cap():
+    parser = matchstats.StreamParser()
+    parser.feed('{"stats": [')
+    parser.feed('"' + "x" * matchstats.MAX_DOCUMENT_BYTES + '",')
+    assert parser.pending() == []
+    assert parser.feed("]}") == []
+
+
+def test_rows_are_one_per_player():
+    document = json.loads("\n".join(ROUND))
+    rows = matchstats.rows(document, "us-east-1", "abc", LOGGED_AT)
+    assert [row["guid"] for row in rows] == ["A1B2", "C3D4"]
+    assert rows[0]["round"] == 2 and rows[0]["kills"] == 3 and rows[0]["accuracy"] == 41.5
+    assert rows[1]["kills"] == 1 and rows[1]["headshots"] is None
+    assert set(rows[0]) == set(name for name, kind in matchstats.SCHEMA)
+
+
+def test_local_sink_layout(tmp_path):
+    rows = matchstats.rows(json.loads("\n".join(ROUND)), "us-east-1", "abc", LOGGED_AT)
+    keys = matchstats.write(matchstats.LocalSink(str(tmp_path)), rows, "json", name="batch")
+    assert keys == ["matches/region=us-east-1/date=2023-11-14/" + str(LOGGED_AT) + "-batch.json.gz"]
+    assert files(tmp_path) == keys
+    written = read(str(tmp_path.joinpath(*keys[0].split("/"))))
+    assert [row["alias"] for row in written] == ["player {1}", "other"]
+    assert list(written[0]) == [name for name, kind in matchstats.SCHEMA]
+
+
+def test_parquet_is_the_default(tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    rows = matchstats.rows(json.loads("\n".join(ROUND)), "us-east-1", "abc", LOGGED_AT)
+    keys = matchstats.write(matchstats.LocalSink(str(tmp_path)), rows, name="batch")
+    assert keys == ["matches/region=us-east-1/date=2023-11-14/" + str(LOGGED_AT) + "-batch.parquet"]
+    table = parquet.read_table(str(tmp_path.joinpath(*keys[0].split("/"))))
+    assert table.column_names == [name for name, kind in matchstats.SCHEMA]
+    assert str(table.schema.field("kills").type) == "int64" and str(table.schema.field("accuracy").type) == "double"
+    assert table.to_pylist() == rows
+
+
+def payload(stream, lines, first_id=0):
+    data = {"messageType": "DATA_MESSAGE", "logStream": stream,
+            "logEvents": [{"id": str(first_id + n), "timestamp": LOGGED_AT, "message": line}
+                          for n, line in enumerate(lines)]}
+    return {"awslogs": {"data": base64.b64encode(gzip.compress(json.dumps(data).encode())).decode()}}
+
+
+def test_handler_keeps_pending_lines_until_the_round_ends(tmp_path, monkeypatch):
+    monkeypatch.setenv("STATS_DIRECTORY", str(tmp_path))
+    monkeypatch.setenv("STATS_FORMAT", "json")
+    stream = "rtcw_container/RTCWProTask/abc"
+    main = load_lambda("matchstats")
+    assert main.handler(payload(stream, ROUND[:2]), None) == {"rows": 0, "keys": []}
+    assert get_store().get("statsbuf", stream)["lines"] == ROUND[:2]
+    result = main.handler(payload(stream, ROUND[2:], first_id=2), None)
+    assert result["rows"] == 2
+    assert get_store().get("statsbuf", stream) is None
+    assert files(tmp_path) == result["keys"]
+
+
+def test_failed_write_keeps_the_buffer(tmp_path, monkeypatch):
+    monkeypatch.setenv("STATS_DIRECTORY", str(tmp_path))
+    monkeypatch.setenv("STATS_FORMAT", "json")
+    stream = "rtcw_container/RTCWProTask/abc"
+    main = load_lambda("matchstats")
+    main.handler(payload(stream, ROUND[:2]), None)
+
+    def broken(sink, rows, format="json", name=None):
+        raise IOError("s3 is down")
+
+    monkeypatch.setattr(matchstats, "write", broken)
+    with pytest.raises(IOError):
+        main.handler(payload(stream, ROUND[2:], first_id=2), None)
+    assert get_store().get("statsbuf", stream)["lines"] == ROUND[:2]
+
+    monkeypatch.undo()
+    monkeypatch.setenv("STATS_DIRECTORY", str(tmp_path))
+    monkeypatch.setenv("STATS_FORMAT", "json")
+    assert main.handler(payload(stream, ROUND[2:], first_id=2), None)["rows"] == 2
@@ -0,0 +1,78 @@
+"""Pre-warmed servers: launch, hold and claim against the in-memory store."""
+import json
+import time
+
+import pytest
+
+from rtcwcommon import prewarm, slots
+from rtcwcommon.state import LocalStore
+
+REGION = "us-east-1"
+ZONE = "example.com"
+NOW = int(time.time())
+HOUR = prewarm.hour_key(NOW)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setenv("RTCW_REGIONS", json.dumps({REGION: {"prefix": "na", "capacity": 3}}))
+    return LocalStore()
+
+
+@pytest.fixture
+def ecs(aws):
+    aws.on("ecs:describe_services", lambda cluster, services: {"services": [{"desiredCount": 0}]})
+    return aws.factory("ecs", REGION)
+
+
+def launch(store, ecs, index, profile=None, hold=600):
+    return prewarm.launch(store, ecs, "cluster", "svc", REGION, ZONE, 3, HOUR, index, hold, NOW, profile)
+
+
+def test_launch_holds_a_slot_once_per_hour_and_index(store, ecs, aws):
+    slot = launch(store, ecs, 0)
+    assert slot["prewarm_id"] == HOUR + "#0" and slot["state"] == "reserved"
+    assert aws.called("ecs:update_service")[-1]["desiredCount"] == 1
+    assert store.get("prewarm", HOUR + "#0")["slot"] == slot["number"]
+    assert launch(store, ecs, 0) is None
+    assert slots.in_use(store, NOW) == 0
+
+
+def test_unclaimed_server_is_held_until_prewarm_until(store, ecs):
+    slot = launch(store, ecs, 0, hold=600)
+    assert prewarm.held(slot, NOW + 599)
+    assert not prewarm.held(slot, NOW + 600)
+    assert not prewarm.held(dict(slot, claimed_by="req"), NOW)
+
+
+def test_claim_prefers_a_server_that_is_up(store, ecs):
+    launch(store, ecs, 0)
+    launch(store, ecs, 1)
+    bound = slots.bind(store, REGION, ZONE, 3, "arn:task", NOW)
+    slots.annotate(store, store.get("slot", str(bound["number"])), ip="1.2.3.4")
+    store.put("idle", "arn:task", {"idle_since": NOW})
+
+    claimed = prewarm.claim(store, "req-1", NOW + 5)
+    assert (claimed["task_arn"], claimed["claimed_by"]) == ("arn:task", "req-1")
+    assert store.get("idle", "arn:task") is None
+    record = store.get("prewarm", claimed["prewarm_id"])
+    assert record["claimed_at"] == NOW + 5 and record["ready_when_claimed"]
+    assert not prewarm.held(store.get("slot", str(claimed["number"])), NOW + 5)
+
+    assert prewarm.claim(store, "req-2", NOW + 6)["number"] != claimed["number"]
+    assert prewarm.claim(store, "req-3", NOW + 7) is None
+
+
+def test_claim_only_takes_the_requested_profile(store, ecs):
+    launch(store, ecs, 0, profile="6v6")
+    assert prewarm.claim(store, "req", NOW, profile="3v3") is None
+    assert prewarm.claim(store, "req", NOW, profile="6v6")["profile"] == "6v6"
+
+
+def test_summary_counts_hits_and_waste():
+    records = [{"slot": 1, "launched_at": 0, "claimed_at": 60, "ready_when_claimed": True},
+               {"slot": 2, "launched_at": 0, "stopped_at": 120},
+               {"skipped": "full", "launched_at": 0}]
+    summary = prewarm.summarize(records, typical_start=90, now=1000)
+    assert (summary["launched"], summary["skipped"], summary["hits"], summary["hit_rate"]) == (2, 1, 1, 0.5)
+    assert summary["wasted_minutes"] == 3.0 and summary["latency_saved_seconds"] == 90
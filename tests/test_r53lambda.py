@@ -0,0 +1,109 @@
+"""Task state changes through r53lambda, with fake AWS clients and a fake game server."""
+import copy
+import json
+import os
+
+import pytest
+
+from conftest import ROOT, load_lambda
+from rtcwcommon import q3status, servicecount
+from rtcwcommon.state import get_store
+
+TASK_ARN = "arn:aws:ecs:us-east-1:123:task/RTCWCluster/abc"
+
+
+def load_event(name):
+    with open(os.path.join(ROOT, "tools", "events", name + ".json")) as fp:
+        return json.load(fp)
+
+
+@pytest.fixture
+def r53lambda(aws, monkeypatch):
+    server = q3status.FakeStatusServer(players=[(0, 50, "player")]).start()
+    for name, value in {"ECS_SERVICE_NAME": "pro", "ECS_CLUSTER_NAME": "RTCWCluster",
+                        "DNS_HOSTED_ZONE": "Z1", "DNS_HOSTED_ZONE_NAME": "example.com",
+                        "RTCW_REGIONS": json.dumps({"us-east-1": {"prefix": "na", "capacity": 3}}),
+                        "RTCW_PORT": str(server.port), "READY_TIMEOUT": "2"}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("DNS_QUEUE_URL", raising=False)
+    aws.on("ec2:describe_network_interfaces", {"NetworkInterfaces": [{"Association": {"PublicIp": "127.0.0.1"}}]})
+    yield load_lambda("r53lambda")
+    server.stop()
+
+
+def event(name, **detail):
+    result = load_event(name)
+    result["detail"].update(detail)
+    return result
+
+
+def record_changes(aws):
+    return [(change["Action"], change["ResourceRecordSet"]["Name"], change["ResourceRecordSet"]["ResourceRecords"][0]["Value"])
+            for call in aws.called("route53:change_resource_record_sets") for change in call["ChangeBatch"]["Changes"]]
+
+
+def test_running_then_stopped(r53lambda, aws):
+    r53lambda.handler(event("task_running"), None)
+    assert get_store().get("task", TASK_ARN)["published"]
+    assert get_store().get("slot", "1")["task_arn"] == TASK_ARN
+    r53lambda.handler(event("task_stopped"), None)
+    assert record_changes(aws) == [("UPSERT", "na1.example.com", "127.0.0.1"), ("DELETE", "na1.example.com", "127.0.0.1")]
+    assert get_store().get("slot", "1") is None
+    assert get_store().get("task", TASK_ARN)["dns_deleted"]
+
+
+def test_spot_interruption_moves_the_replacement_on_demand(r53lambda, aws, monkeypatch):
+    monkeypatch.setenv("USE_SPOT", "true")
+    monkeypatch.setenv("SPOT_FALLBACK_ON_INTERRUPTION", "true")
+    desired = {"pro-spot": 2, "pro": 0}
+    running = ["arn:other"]
+    aws.on("ecs:describe_services", lambda cluster, services: {
+        "services": [{"serviceName": name, "desiredCount": desired[name]} for name in services]})
+    aws.on("ecs:update_service", lambda cluster, service, desiredCount: desired.update({service: desiredCount}))
+    aws.on("ecs:list_tasks", {"taskArns": running + [TASK_ARN]})
+    r53lambda.handler(event("task_running", group="service:pro-spot"), None)
+
+    r53lambda.handler(event("task_stopped", group="service:pro-spot", stopCode="SpotInterruption"), None)
+    assert desired == {"pro-spot": 1, "pro": 1}
+    assert aws.called("ecs:update_task_protection") == [
+        {"cluster": "RTCWCluster", "tasks": running + [TASK_ARN], "protectionEnabled": True,
+         "expiresInMinutes": servicecount.PROTECTION_MINUTES}]
+    assert get_store().get("task", TASK_ARN)["dns_deleted"]
+    assert get_store().get("slot", "1")["replaces"] == TASK_ARN
+
+
+def test_running_after_stopped_is_ignored(r53lambda, aws):
+    r53lambda.handler(event("task_stopped"), None)
+    r53lambda.handler(event("task_running"), None)
+    assert record_changes(aws) == []
+    assert get_store().query("slot") == []
+    assert get_store().get("task", TASK_ARN)["dns_deleted"]
+
+
+def test_running_after_a_failed_delete_is_ignored(r53lambda, aws):
+    r53lambda.handler(event("task_running"), None)
+    aws.on("route53:change_resource_record_sets", failing_change)
+    r53lambda.handler(event("task_stopped"), None)
+    aws.responses.pop("route53:change_resource_record_sets")
+    r53lambda.handler(event("task_running"), None)
+    assert [change[0] for change in record_changes(aws)] == ["UPSERT", "DELETE"]
+    assert get_store().get("task", TASK_ARN)["stopped"]
+
+
+def test_stopped_while_waiting_for_the_server(r53lambda, aws, monkeypatch):
+    wait_until_ready = r53lambda.wait_until_ready
+
+    def stop_meanwhile(*args):
+        r53lambda.handler(event("task_stopped"), None)
+        return wait_until_ready(*args)
+
+    monkeypatch.setattr(r53lambda, "wait_until_ready", stop_meanwhile)
+    r53lambda.handler(event("task_running"), None)
+    assert record_changes(aws) == [("DELETE", "na1.example.com", "127.0.0.1")]
+    assert get_store().query("slot") == []
+    assert get_store().get("task", TASK_ARN)["dns_deleted"]
+
+
+def failing_change(**kwargs):
+    from botocore.exceptions import ClientError
+    raise ClientError({"Error": {"Code": "InvalidInput", "Message": "broken"}}, "ChangeResourceRecordSets")
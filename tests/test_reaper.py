@@ -0,0 +1,139 @@
+"""The idle reaper against real getstatus answers from q3status.FakeStatusServer."""
+import functools
+import socket
+import time
+
+import pytest
+
+from conftest import load_lambda
+from rtcwcommon import clients, q3status, servicecount
+from rtcwcommon.state import get_store
+
+SERVICE = "RTCWProService"
+CLUSTER = "RTCWCluster2"
+
+
+class FakeEcs:
+    def __init__(self, task_arns):
+        self.task_arns = list(task_arns)
+        self.desired = len(self.task_arns)
+        self.protected = []
+        self.updates = []
+
+    def describe_services(self, cluster, services):
+        return {"services": [{"serviceName": name, "desiredCount": self.desired if name == SERVICE else 0}
+                             for name in services]}
+
+    def list_tasks(self, cluster, desiredStatus):
+        return {"taskArns": list(self.task_arns)}
+
+    def describe_tasks(self, cluster, tasks):
+        return {"tasks": [{"taskArn": arn, "lastStatus": "RUNNING", "group": "service:" + SERVICE} for arn in tasks]}
+
+    def update_task_protection(self, cluster, tasks, protectionEnabled, expiresInMinutes):
+        assert len(tasks) <= servicecount.PROTECTION_BATCH
+        self.protected.append(list(tasks))
+        return {"protectedTasks": [{"taskArn": arn} for arn in tasks], "failures": []}
+
+    def update_service(self, cluster, service, desiredCount):
+        self.updates.append((service, desiredCount))
+        self.desired = desiredCount
+
+
+@pytest.fixture
+def reaper(monkeypatch):
+    monkeypatch.setenv("ECS_SERVICE_NAME", SERVICE)
+    monkeypatch.setenv("ECS_CLUSTER_NAME", CLUSTER)
+    # a server that does not answer costs the full timeout, keep it short
+    monkeypatch.setattr(q3status, "query_many", functools.partial(q3status.query_many, timeout=0.2, attempts=1))
+    servers = []
+    silent_sockets = []
+
+    def run(*players, silent=0, force=False, idle_window=0, held=(), silent_since=None):
+        """Reap servers with the given player lists, plus silent ones that never answer."""
+        store = get_store()
+        arns = []
+        ports = []
+        for names in players:
+            servers.append(q3status.FakeStatusServer(players=[(0, 50, name) for name in names]).start())
+            ports.append(servers[-1].port)
+        for _ in range(silent):
+            silent_sockets.append(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+            silent_sockets[-1].bind(("127.0.0.1", 0))
+            ports.append(silent_sockets[-1].getsockname()[1])
+        for index, port in enumerate(ports):
+            arn = "arn:aws:ecs:us-east-1:123456789012:task/" + CLUSTER + "/task" + str(index)
+            store.put("task", arn, {"ip": "127.0.0.1", "port": port})
+            arns.append(arn)
+        for number, index in enumerate(held, 1):
+            store.put("slot", str(number), {"number": number, "task_arn": arns[index], "prewarm_id": "p" + str(number),
+                                            "prewarm_until": time.time() + 600})
+        if silent_since is not None:
+            for arn in arns[len(players):]:
+                store.put("idle", arn, {"silent_since": silent_since, "idle_since": silent_since})
+        ecs = FakeEcs(arns)
+        clients.use_factory(lambda service, region: ecs)
+        return load_lambda("ecsdecrement").reap("us-east-1", idle_window, force, 30 * 60), ecs, arns
+
+    yield run
+    for server in servers:
+        server.stop()
+    for sock in silent_sockets:
+        sock.close()
+
+
+def test_empty_server_is_reaped_and_busy_one_kept(reaper):
+    message, ecs, arns = reaper([], ["player"])
+    assert message == "Taking down 1 idle server(s), 1 kept."
+    assert ecs.protected == [[arns[1]]]
+    assert ecs.updates == [(SERVICE, 1)]
+
+
+def test_bots_do_not_count_as_players(reaper, monkeypatch):
+    monkeypatch.setattr(q3status.FakeStatusServer, "response", lambda self: (
+        q3status.STATUS_RESPONSE + b'\n\\sv_hostname\\fake\n0 0 "bot"\n'))
+    message, ecs, arns = reaper(["bot"])
+    assert message == "Taking down 1 idle server(s), 0 kept."
+
+
+def test_idle_window_is_waited_out(reaper):
+    message, ecs, arns = reaper([], idle_window=600)
+    assert message == "No idle servers, 1 kept."
+    assert get_store().get("idle", arns[0])["idle_since"] > 0
+    assert ecs.updates == []
+
+
+def test_silent_server_is_kept_even_by_the_cron(reaper):
+    message, ecs, arns = reaper([], silent=1, force=True)
+    assert message == "Taking down 1 idle server(s), 1 kept."
+    assert ecs.protected == [[arns[1]]]
+    assert get_store().get("idle", arns[1])["responding"] is False
+
+
+def test_silence_is_remembered(reaper):
+    message, ecs, arns = reaper(silent=1)
+    first = get_store().get("idle", arns[0])
+    assert first["silent_since"] == first["checked_at"]
+    message, ecs, arns = reaper(silent=1)
+    second = get_store().get("idle", arns[0])
+    assert second["silent_since"] == first["silent_since"] and second["checked_at"] > first["checked_at"]
+    assert message == "No idle servers, 1 kept."
+
+
+def test_server_silent_for_too_long_is_reaped(reaper):
+    message, ecs, arns = reaper(["player"], silent=1, silent_since=time.time() - 31 * 60)
+    assert message == "Taking down 1 idle server(s), 1 kept."
+    assert ecs.protected == [[arns[0]]]
+
+
+def test_held_prewarm_server_is_kept_by_the_cron(reaper):
+    message, ecs, arns = reaper([], [], force=True, held=[1])
+    assert message == "Taking down 1 idle server(s), 1 kept."
+    assert ecs.protected == [[arns[1]]]
+
+
+def test_protection_goes_out_ten_tasks_at_a_time(reaper):
+    message, ecs, arns = reaper([], *[["player"]] * 23)
+    assert message == "Taking down 1 idle server(s), 23 kept."
+    assert [len(call) for call in ecs.protected] == [10, 10, 3]
+    assert sorted(arn for call in ecs.protected for arn in call) == sorted(arns[1:])
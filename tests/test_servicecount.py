@@ -0,0 +1,58 @@
+from rtcwcommon import servicecount
+from rtcwcommon.state import LocalStore
+
+
+class FakeEcs:
+    def __init__(self, desired, running=()):
+        self.desired = dict(desired)
+        self.running = dict(running)
+        self.protected = []
+
+    def describe_services(self, cluster, services):
+        return {"services": [{"serviceName": name, "desiredCount": self.desired.get(name, 0)} for name in services]}
+
+    def update_service(self, cluster, service, desiredCount):
+        self.desired[service] = desiredCount
+
+    def list_tasks(self, cluster, serviceName, desiredStatus):
+        return {"taskArns": list(self.running.get(serviceName, []))}
+
+    def update_task_protection(self, cluster, tasks, protectionEnabled, expiresInMinutes):
+        assert len(tasks) <= servicecount.PROTECTION_BATCH
+        self.protected.append((list(tasks), expiresInMinutes))
+
+
+def counters(store, ecs, *services):
+    for service in services:
+        servicecount.resync(store, ecs, "cluster", service)
+
+
+def test_move_shifts_one_server():
+    store = LocalStore()
+    ecs = FakeEcs({"svc-spot": 2, "svc": 1})
+    counters(store, ecs, "svc-spot", "svc")
+    assert servicecount.move(store, ecs, "cluster", "svc-spot", "svc", maximum=5)
+    assert ecs.desired == {"svc-spot": 1, "svc": 2}
+    assert ecs.protected == []
+
+
+def test_move_protects_the_running_tasks_of_the_source():
+    store = LocalStore()
+    running = ["arn:" + str(n) for n in range(12)]
+    ecs = FakeEcs({"svc-spot": 13}, {"svc-spot": running})
+    counters(store, ecs, "svc-spot", "svc")
+    assert servicecount.move(store, ecs, "cluster", "svc-spot", "svc", maximum=5, protect_running=True)
+    assert ecs.protected == [(running[:10], servicecount.PROTECTION_MINUTES),
+                             (running[10:], servicecount.PROTECTION_MINUTES)]
+    assert ecs.desired == {"svc-spot": 12, "svc": 1}
+
+
+def test_move_needs_a_server_and_room():
+    store = LocalStore()
+    ecs = FakeEcs({"svc-spot": 0, "svc": 1})
+    counters(store, ecs, "svc-spot", "svc")
+    assert not servicecount.move(store, ecs, "cluster", "svc-spot", "svc", maximum=5)
+    ecs.desired["svc-spot"] = 1
+    counters(store, ecs, "svc-spot")
+    assert not servicecount.move(store, ecs, "cluster", "svc-spot", "svc", maximum=1)
+    assert ecs.desired == {"svc-spot": 1, "svc": 1}
@@ -0,0 +1,62 @@
+"""Slot reservation, binding and release against the in-memory store."""
+import json
+
+import pytest
+
+from rtcwcommon import slots
+from rtcwcommon.state import LocalStore
+
+REGION = "us-east-1"
+ZONE = "example.com"
+NOW = 1700000000
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setenv("RTCW_REGIONS", json.dumps({REGION: {"prefix": "na", "capacity": 2}}))
+    return LocalStore()
+
+
+def test_reserve_takes_the_lowest_free_slot(store):
+    first = slots.reserve(store, REGION, ZONE, 2, "req-1", NOW)
+    second = slots.reserve(store, REGION, ZONE, 2, "req-2", NOW)
+    assert (first["hostname"], second["hostname"]) == ("na1.example.com", "na2.example.com")
+    assert slots.reserve(store, REGION, ZONE, 2, "req-3", NOW) is None
+    assert slots.in_use(store, NOW) == 2
+
+
+def test_expired_reservations_are_reused(store):
+    slots.reserve(store, REGION, ZONE, 1, "old", NOW)
+    later = NOW + slots.RESERVATION_TIMEOUT + 1
+    assert slots.in_use(store, later) == 0
+    assert slots.reserve(store, REGION, ZONE, 1, "new", later)["request_id"] == "new"
+
+
+def test_bind_takes_the_oldest_reservation_of_the_profile(store):
+    slots.reserve(store, REGION, ZONE, 2, "big", NOW, profile="6v6")
+    slots.reserve(store, REGION, ZONE, 2, "small", NOW + 1, profile="3v3")
+    bound = slots.bind(store, REGION, ZONE, 2, "arn:task", NOW + 2, "3v3")
+    assert (bound["number"], bound["request_id"], bound["state"]) == (2, "small", "running")
+    assert slots.bind(store, REGION, ZONE, 2, "arn:task", NOW + 3, "3v3") == store.get("slot", "2")
+
+
+def test_unasked_task_gets_a_free_slot_or_none(store):
+    slots.reserve(store, REGION, ZONE, 2, "req", NOW, profile="3v3")
+    assert slots.bind(store, REGION, ZONE, 2, "arn:a", NOW, "6v6")["number"] == 2
+    assert slots.bind(store, REGION, ZONE, 2, "arn:b", NOW, "6v6") is None
+
+
+def test_release_frees_only_the_tasks_slot(store):
+    slots.bind(store, REGION, ZONE, 2, "arn:a", NOW)
+    slots.bind(store, REGION, ZONE, 2, "arn:b", NOW)
+    assert slots.release(store, "arn:a")["number"] == 1
+    assert slots.release(store, "arn:a") is None
+    assert [slot["task_arn"] for slot in store.query("slot")] == ["arn:b"]
+
+
+def test_requeued_slot_keeps_its_hostname_for_the_replacement(store):
+    slots.bind(store, REGION, ZONE, 2, "arn:a", NOW)
+    slots.bind(store, REGION, ZONE, 2, "arn:b", NOW)
+    slots.requeue(store, "arn:a", NOW + 10)
+    replacement = slots.bind(store, REGION, ZONE, 2, "arn:c", NOW + 20)
+    assert (replacement["hostname"], replacement["replaces"]) == ("na1.example.com", "arn:a")
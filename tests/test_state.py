@@ -0,0 +1,114 @@
+import time
+
+import pytest
+
+from rtcwcommon import clients
+from rtcwcommon.state import ConditionFailed, DynamoStore, LocalStore, get_store, use_store
+
+
+def test_put_get_delete():
+    store = LocalStore()
+    store.put("task", "arn:1", {"ip": "1.2.3.4"})
+    assert store.get("task", "arn:1") == {"ip": "1.2.3.4", "pk": "task", "sk": "arn:1"}
+    store.get("task", "arn:1")["ip"] = "changed"
+    assert store.get("task", "arn:1")["ip"] == "1.2.3.4"
+    store.delete("task", "arn:1")
+    assert store.get("task", "arn:1") is None
+
+
+def test_put_if_only_creates_once():
+    store = LocalStore()
+    store.put_if("slot", "1", {"state": "reserved"}, {"pk": None})
+    with pytest.raises(ConditionFailed):
+        store.put_if("slot", "1", {"state": "reserved"}, {"pk": None})
+
+
+def test_put_if_and_delete_if_compare_attributes():
+    store = LocalStore()
+    store.put("slot", "1", {"state": "reserved", "reserved_at": 10})
+    with pytest.raises(ConditionFailed):
+        store.put_if("slot", "1", {"state": "running"}, {"reserved_at": 11})
+    store.put_if("slot", "1", {"state": "running"}, {"reserved_at": 10, "task_arn": None})
+    with pytest.raises(ConditionFailed):
+        store.delete_if("slot", "1", {"state": "reserved"})
+    store.delete_if("slot", "1", {"state": "running"})
+    assert store.get("slot", "1") is None
+
+
+def test_add_respects_bounds():
+    store = LocalStore()
+    assert store.add("counter", "svc", "desired", 2, maximum=3) == 2
+    with pytest.raises(ConditionFailed):
+        store.add("counter", "svc", "desired", 2, maximum=3)
+    assert store.add("counter", "svc", "desired", -2, minimum=0) == 0
+    with pytest.raises(ConditionFailed):
+        store.add("counter", "svc", "desired", -1, minimum=0)
+    assert store.get("counter", "svc")["desired"] == 0
+
+
+def test_add_keeps_the_first_expiry():
+    store = LocalStore()
+    later = int(time.time()) + 100
+    store.add("history", "h", "starts", 1, expires_at=later)
+    store.add("history", "h", "starts", 1, expires_at=later + 50)
+    assert store.get("history", "h") == {"starts": 2, "expires_at": later, "pk": "history", "sk": "h"}
+
+
+def test_expired_items_are_gone():
+    store = LocalStore()
+    store.put("idem", "old", {"expires_at": int(time.time()) - 1})
+    store.put("idem", "new", {"expires_at": int(time.time()) + 60})
+    assert store.get("idem", "old") is None
+    assert [item["sk"] for item in store.query("idem")] == ["new"]
+
+
+def test_query_is_per_partition_and_sorted():
+    store = LocalStore()
+    for sk in ("2", "1", "3"):
+        store.put("slot", sk, {})
+    store.put("task", "1", {})
+    assert [item["sk"] for item in store.query("slot")] == ["1", "2", "3"]
+
+
+def test_get_store_is_local_without_a_table():
+    assert isinstance(get_store(), LocalStore)
+    assert get_store("eu-west-2") is get_store("us-east-1")
+
+
+def test_use_store_serves_every_region_and_table(monkeypatch):
+    store = LocalStore()
+    use_store(store)
+    assert get_store() is store
+    assert get_store("eu-west-2") is store
+    monkeypatch.setenv("STATE_TABLE_NAME", "rtcw-state")
+    assert get_store("us-east-1") is store
+    use_store(None)
+    assert isinstance(get_store("us-east-1"), DynamoStore)
+
+
+@pytest.fixture
+def dynamo(monkeypatch):
+    moto = pytest.importorskip("moto")
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SECURITY_TOKEN", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    with moto.mock_aws():
+        clients.reset()
+        clients.get_client("dynamodb", "us-east-1").create_table(
+            TableName="rtcw-state",
+            KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}, {"AttributeName": "sk", "KeyType": "RANGE"}],
+            AttributeDefinitions=[{"AttributeName": "pk", "AttributeType": "S"},
+                                  {"AttributeName": "sk", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST")
+        yield DynamoStore("rtcw-state", "us-east-1")
+        clients.reset()
+
+
+def test_dynamo_hides_items_the_ttl_has_not_deleted_yet(dynamo):
+    dynamo.put("idem", "old", {"expires_at": int(time.time()) - 1})
+    dynamo.put("idem", "new", {"expires_at": int(time.time()) + 60})
+    assert dynamo.get("idem", "old") is None
+    assert [item["sk"] for item in dynamo.query("idem")] == ["new"]
+    dynamo.put_if("idem", "old", {"state": "fresh"}, {"pk": None})
+    assert dynamo.get("idem", "old")["state"] == "fresh"
+    with pytest.raises(ConditionFailed):
+        dynamo.put_if("idem", "new", {"state": "fresh"}, {"pk": None})
@@ -0,0 +1,76 @@
+"""Build the baked game image and push it to the main region's ECR repository.
+
+Run it before `cdk deploy` whenever docker/Dockerfile, the pinned config ref
+or MAPS change; the stacks reference the same content-hashed tag and synth
+fails until it is pushed. ECR replication copies the image to the other
+regions.
+
+    python tools/build_image.py
+    python tools/build_image.py --no-push
+"""
+import argparse
+import base64
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+
+from mysettings import settings
+from stacks import game_image, regions
+
+
+def docker(*args, **kwargs):
+    print("docker " + " ".join(args))
+    subprocess.run(["docker"] + list(args), check=True, **kwargs)
+
+
+def already_pushed(ecr, tag):
+    try:
+        ecr.describe_images(repositoryName=game_image.GAME_REPOSITORY_NAME, imageIds=[{"imageTag": tag}])
+    except ecr.exceptions.ImageNotFoundException:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and push the baked rtcw game image.")
+    parser.add_argument("--no-push", action="store_true", help="only build the image locally")
+    parser.add_argument("--force", action="store_true", help="push even if the tag already exists")
+    args = parser.parse_args()
+
+    if not settings.get("game_image"):
+        sys.exit("settings has no game_image section, the stacks use msh100/rtcw from Docker Hub")
+
+    tag = game_image.image_tag(settings)
+    region = settings["main_region"]
+    repository = settings["account"] + ".dkr.ecr." + region + ".amazonaws.com/" + game_image.GAME_REPOSITORY_NAME
+
+    ecr = None
+    if not args.no_push:
+        import boto3
+        ecr = boto3.client("ecr", region_name=region)
+        if not args.force and already_pushed(ecr, tag):
+            print(repository + ":" + tag + " is already pushed")
+            return
+
+    build_args = []
+    for name, value in sorted(game_image.build_args(settings).items()):
+        build_args += ["--build-arg", name + "=" + value]
+    docker("build", "--pull", "-t", repository + ":" + tag, *build_args, os.path.join(ROOT, "docker"))
+
+    if args.no_push:
+        print("Built " + repository + ":" + tag)
+        return
+
+    token = ecr.get_authorization_token()["authorizationData"][0]
+    user, password = base64.b64decode(token["authorizationToken"]).decode().split(":", 1)
+    docker("login", "--username", user, "--password-stdin", token["proxyEndpoint"], input=password.encode())
+    docker("push", repository + ":" + tag)
+    print("Pushed " + repository + ":" + tag + ", replicating to " +
+          ", ".join(r for r in regions.names(settings) if r != region))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Build the client prefix -> region latency table behind /start/auto.
+
+Reads round trip measurements as CSV rows of `prefix,region,rtt_ms` (e.g.
+from players' pings or an internet measurement platform; any number of rows
+per prefix and region, a header row is skipped), ranks the regions of every
+IPv4 prefix by median RTT and writes the table rtcwcommon.nearest loads:
+
+    python tools/build_latency_table.py measurements.csv
+
+Prefixes may nest, the most specific one wins for the addresses it covers.
+Adjacent ranges with the same ranking are merged to keep the table small.
+Redeploy to ship a new table with ecslambda.
+"""
+import argparse
+import collections
+import csv
+import ipaddress
+import json
+import os
+import statistics
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+OUTPUT = os.path.join(ROOT, "lambdas", "ecslambda", "latency_table.json")
+
+
+def read_measurements(path, known=None):
+    """{network: {region: [rtt, ...]}} from the CSV at path, IPv4 only."""
+    measurements = collections.defaultdict(lambda: collections.defaultdict(list))
+    with open(path) as fp:
+        for row in csv.reader(fp):
+            if len(row) < 3 or row[0].startswith("#"):
+                continue
+            try:
+                network = ipaddress.ip_network(row[0].strip(), strict=False)
+                rtt = float(row[2])
+            except ValueError:
+                continue  # header or a broken row
+            region = row[1].strip()
+            if network.version == 4 and (not known or region in known):
+                measurements[network][region].append(rtt)
+    return measurements
+
+
+def rank(measurements, max_regions):
+    """[first, last, regions by median RTT] per network, unordered and possibly nested."""
+    ranges = []
+    for network, rtts in measurements.items():
+        regions = sorted(rtts, key=lambda region: (statistics.median(rtts[region]), region))
+        ranges.append([int(network.network_address), int(network.broadcast_address), regions[:max_regions]])
+    return ranges
+
+
+def flatten(ranges):
+    """Disjoint sorted ranges, where a nested prefix overrides the one containing it.
+
+    CIDR blocks either nest or do not overlap, so a sweep keeping the open
+    blocks on a stack splits the containing block around the nested ones.
+    """
+    segments = []
+    stack = []  # open blocks, innermost last: (last, regions)
+    cursor = 0
+    for first, last, regions in sorted(ranges, key=lambda r: (r[0], r[0] - r[1])):
+        while stack and stack[-1][0] < first:
+            end, outer = stack.pop()
+            if cursor <= end:
+                segments.append([cursor, end, outer])
+                cursor = end + 1
+        if stack and cursor < first:
+            segments.append([cursor, first - 1, stack[-1][1]])
+        cursor = first
+        stack.append((last, regions))
+    while stack:
+        end, outer = stack.pop()
+        if cursor <= end:
+            segments.append([cursor, end, outer])
+            cursor = end + 1
+    return segments
+
+
+def merge(segments):
+    merged = []
+    for segment in segments:
+        if merged and merged[-1][1] + 1 == segment[0] and merged[-1][2] == segment[2]:
+            merged[-1][1] = segment[1]
+        else:
+            merged.append(list(segment))
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("measurements", help="CSV of prefix,region,rtt_ms")
+    parser.add_argument("--output", default=OUTPUT, help="table to write (default: next to ecslambda)")
+    parser.add_argument("--regions", help="comma separated regions to keep, default all measured ones")
+    parser.add_argument("--max-regions", type=int, default=3, help="regions kept per prefix, best first")
+    args = parser.parse_args()
+
+    known = set(args.regions.split(",")) if args.regions else None
+    measurements = read_measurements(args.measurements, known)
+    table = merge(flatten(rank(measurements, args.max_regions)))
+    with open(args.output, "w") as fp:
+        json.dump({"built_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "ranges": table},
+                  fp, separators=(",", ":"))
+    print("%d prefixes -> %d ranges in %s" % (len(measurements), len(table), args.output))
+
+
+if __name__ == "__main__":
+    main()
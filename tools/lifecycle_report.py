@@ -0,0 +1,86 @@
+"""Time-to-playable report from the lifecycle items r53lambda records.
+
+Reads the "lifecycle" items of each region's state table (or a JSON-lines
+export made with --export) and prints p50/p95 per phase and region, plus
+the phase that dominates a cold start.
+
+    python tools/lifecycle_report.py --regions us-east-1,eu-west-2 --export lifecycle.jsonl
+    python tools/lifecycle_report.py --file lifecycle.jsonl --since 2021-07-01
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas", "layer", "python"))
+
+from rtcwcommon import lifecycle
+from rtcwcommon.state import DynamoStore
+
+DEFAULT_TABLE = "rtcwdemand-state"
+
+
+def load_from_tables(regions, table_name):
+    records = []
+    for region in regions:
+        records.extend(DynamoStore(table_name, region).query("lifecycle"))
+    return records
+
+
+def load_from_file(path):
+    with open(path) as fp:
+        return [json.loads(line) for line in fp if line.strip()]
+
+
+def in_window(record, since, until):
+    published_at = record.get("published_at") or 0
+    return (since is None or published_at >= since) and (until is None or published_at < until)
+
+
+def print_report(summary):
+    header = "%-12s %-6s %6s %10s %10s" % ("region", "phase", "count", "p50 (s)", "p95 (s)")
+    print(header)
+    print("-" * len(header))
+    for region in sorted(summary):
+        phases = summary[region]
+        for phase in lifecycle.PHASES:
+            if phase in phases:
+                stats = phases[phase]
+                print("%-12s %-6s %6d %10.1f %10.1f" % (region, phase, stats["count"], stats["p50"] / 1000.0, stats["p95"] / 1000.0))
+        parts = {phase: stats["p50"] for phase, stats in phases.items() if phase != "total"}
+        if parts:
+            dominant = max(parts, key=parts.get)
+            print("%-12s dominant phase: %s" % (region, dominant))
+        print("")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time-to-playable report per region and phase.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--regions", help="comma separated regions to read the state tables of")
+    source.add_argument("--file", help="JSON-lines file of lifecycle items")
+    parser.add_argument("--table", default=DEFAULT_TABLE)
+    parser.add_argument("--since", help="only starts published at or after this UTC date/time (ISO 8601)")
+    parser.add_argument("--until", help="only starts published before this UTC date/time (ISO 8601)")
+    parser.add_argument("--export", help="also write the loaded items to this JSON-lines file")
+    args = parser.parse_args()
+
+    if args.file:
+        records = load_from_file(args.file)
+    else:
+        records = load_from_tables(args.regions.split(","), args.table)
+
+    if args.export:
+        with open(args.export, "w") as fp:
+            for record in records:
+                fp.write(json.dumps(record) + "\n")
+
+    since = lifecycle.parse_time(args.since) if args.since else None
+    until = lifecycle.parse_time(args.until) if args.until else None
+    records = [r for r in records if in_window(r, since, until)]
+    print("%d start(s)\n" % len(records))
+    print_report(lifecycle.summarize(records))
+
+
+if __name__ == "__main__":
+    main()
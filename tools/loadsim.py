@@ -0,0 +1,361 @@
+"""Offline load simulator for the rtcwdemand control plane.
+
+Replays the recorded events in tools/events against ecslambda, r53lambda and
+ecsdecrement in-process, at configurable rates, with fake AWS clients
+(canned responses, optional injected latency; with botocore installed every
+call's parameters are validated against the service model the way a real
+client would), the in-memory state store and
+a fake RTCW server answering getstatus on localhost. Queued DNS intents are
+then drained through the dnsqueue consumer. It reports handler latency
+distributions, AWS calls per event and cold vs warm start cost, without
+network access or an AWS account.
+
+    python tools/loadsim.py --starts-per-minute 300 --task-events-per-minute 3000 --duration 60 --speed 10
+"""
+import argparse
+import collections
+import contextlib
+import copy
+import importlib.util
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+LAYER = os.path.join(ROOT, "lambdas", "layer", "python")
+EVENTS = os.path.join(ROOT, "tools", "events")
+sys.path.insert(0, LAYER)
+
+try:
+    import botocore.session
+    import botocore.validate
+except ImportError:
+    botocore = None
+
+from rtcwcommon import clients, instrument, q3status, state
+from rtcwcommon.lifecycle import percentile
+
+REGION = "us-east-1"
+ACCOUNT = "123456789012"
+HANDLERS = ["ecslambda", "r53lambda", "ecsdecrement", "dnsqueue"]
+SQS_BATCH = 100
+
+
+class FakeAws:
+    """Canned responses for the AWS operations the lambdas use.
+
+    Calls are counted per (handler, "service:Operation"); the handler is taken
+    from a thread-local set by the simulator around each invocation.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.desired = collections.Counter()
+        self.running_tasks = set()
+        self.messages = []
+        self.models = {}
+
+    def factory(self, service, region):
+        return FakeClient(self, service, region)
+
+    def validate(self, service, operation, kwargs):
+        """Reject parameters botocore would reject before sending the request."""
+        if botocore is None:
+            return
+        with self.lock:
+            if service not in self.models:
+                self.models[service] = botocore.session.get_session().get_service_model(service)
+        input_shape = self.models[service].operation_model(operation).input_shape
+        if input_shape is not None:
+            botocore.validate.validate_parameters(kwargs, input_shape)
+
+    def record(self, service, operation):
+        handler = getattr(self.local, "handler", "other")
+        with self.lock:
+            self.calls[(handler, service + ":" + operation)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def ecs_describe_services(self, region, **kwargs):
+        return {"services": [{"desiredCount": self.desired[region], "runningCount": len(self.running_tasks)}]}
+
+    def ecs_update_service(self, region, desiredCount, **kwargs):
+        self.desired[region] = desiredCount
+        return {"service": {"desiredCount": desiredCount}}
+
+    def ecs_list_tasks(self, region, **kwargs):
+        with self.lock:
+            return {"taskArns": sorted(self.running_tasks)[:100]}
+
+    def ecs_describe_tasks(self, region, tasks, **kwargs):
+        return {"tasks": [{"taskArn": arn, "lastStatus": "RUNNING", "group": "service:" + os.environ["ECS_SERVICE_NAME"],
+                           "attachments": []} for arn in tasks]}
+
+    def ec2_describe_network_interfaces(self, region, NetworkInterfaceIds, **kwargs):
+        # every task is the fake status server on localhost
+        return {"NetworkInterfaces": [{"NetworkInterfaceId": eni, "Association": {"PublicIp": "127.0.0.1"}}
+                                      for eni in NetworkInterfaceIds]}
+
+    def route53_list_resource_record_sets(self, region, **kwargs):
+        return {"ResourceRecordSets": []}
+
+    def sqs_send_message(self, region, MessageBody, **kwargs):
+        with self.lock:
+            self.messages.append(MessageBody)
+        return {"MessageId": uuid.uuid4().hex}
+
+
+class FakeClient:
+
+    def __init__(self, aws, service, region):
+        self.aws = aws
+        self.service = service
+        self.region = region
+
+    def __getattr__(self, operation):
+        respond = getattr(self.aws, self.service + "_" + operation, None)
+
+        def call(**kwargs):
+            name = "".join(part.title() for part in operation.split("_"))
+            self.aws.validate(self.service, name, kwargs)
+            self.aws.record(self.service, name)
+            started = time.perf_counter()
+            try:
+                if respond is None:
+                    return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+                return respond(self.region, **kwargs)
+            finally:
+                # what the botocore hooks record for real clients
+                instrument.record_call(self.service + ":" + name, (time.perf_counter() - started) * 1000)
+        return call
+
+
+class CountingStore(state.LocalStore):
+    """LocalStore that books every operation as the DynamoDB call it stands for."""
+
+    def __init__(self, aws):
+        super().__init__()
+        self.aws = aws
+        self.depth = threading.local()
+        for method, operation in (("get", "GetItem"), ("put", "PutItem"), ("delete", "DeleteItem"),
+                                  ("put_if", "PutItem"), ("delete_if", "DeleteItem"),
+                                  ("add", "UpdateItem"), ("query", "Query")):
+            setattr(self, method, self._counted(getattr(self, method), operation))
+
+    def _counted(self, method, operation):
+        def call(*args, **kwargs):
+            # LocalStore uses its own methods internally, only the outer call is a request
+            depth = getattr(self.depth, "value", 0)
+            if not depth:
+                self.aws.record("dynamodb", operation)
+            self.depth.value = depth + 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.depth.value = depth
+        return call
+
+
+def load_event(name):
+    with open(os.path.join(EVENTS, name + ".json")) as fp:
+        return json.load(fp)
+
+
+def load_handler(name):
+    path = os.path.join(ROOT, "lambdas", name, "main.py")
+    spec = importlib.util.spec_from_file_location("sim_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def cold_import(name, env):
+    """Seconds to import a handler module in a fresh interpreter."""
+    handler_dir = os.path.join(ROOT, "lambdas", name)
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    child_env = dict(env, PYTHONPATH=LAYER + os.pathsep + handler_dir)
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=child_env, cwd=handler_dir)
+    return float(out.stdout.strip()) if out.returncode == 0 else None
+
+
+def build_schedule(args, templates):
+    """[(offset seconds, handler, event)] for the whole run."""
+    schedule = []
+    starts = int(args.starts_per_minute * args.duration / 60.0)
+    for index in range(starts):
+        event = copy.deepcopy(templates["api_start"])
+        event["requestContext"]["identity"]["sourceIp"] = "10.%d.%d.%d" % ((index >> 16) & 255, (index >> 8) & 255, index & 255)
+        schedule.append((index * args.duration / max(starts, 1), "ecslambda", event))
+
+    # each task produces a RUNNING and a STOPPED event task_lifetime seconds later
+    task_events = int(args.task_events_per_minute * args.duration / 60.0)
+    tasks = max(task_events // 2, 1) if task_events else 0
+    for index in range(tasks):
+        offset = index * args.duration / tasks
+        task_arn = "arn:aws:ecs:%s:%s:task/RTCWCluster2/%s" % (REGION, ACCOUNT, uuid.uuid4().hex)
+        for name, delay in (("task_running", 0), ("task_stopped", args.task_lifetime)):
+            event = copy.deepcopy(templates[name])
+            event["detail"]["taskArn"] = task_arn
+            event["detail"]["attachments"][0]["details"][1]["value"] = "eni-" + uuid.uuid4().hex[:17]
+            schedule.append((offset + delay, "r53lambda", event))
+        if args.duplicate_fraction and index % max(int(1 / args.duplicate_fraction), 1) == 0:
+            # EventBridge delivers at least once
+            schedule.append((offset + 0.01, "r53lambda", copy.deepcopy(schedule[-2][2])))
+
+    checks = int(args.idle_checks_per_minute * args.duration / 60.0)
+    for index in range(checks):
+        schedule.append((index * args.duration / max(checks, 1), "ecsdecrement", {"event": "idle-check"}))
+    schedule.sort(key=lambda entry: entry[0])
+    return schedule
+
+
+def run(args):
+    aws = FakeAws(args.aws_latency_ms / 1000.0)
+    server = q3status.FakeStatusServer().start()
+    env = {"AWS_REGION": REGION,
+           "ECS_SERVICE_NAME": "RTCWProService",
+           "ECS_CLUSTER_NAME": "RTCWCluster2",
+           "DNS_HOSTED_ZONE": "Z1ABCD",
+           "DNS_HOSTED_ZONE_NAME": "example.com",
+           "DNS_QUEUE_URL": "https://sqs.%s.amazonaws.com/%s/rtcwdemand-dns-changes" % (REGION, ACCOUNT),
+           "RTCW_REGIONS": json.dumps({REGION: {"prefix": "na", "capacity": args.capacity}}),
+           "RTCW_PORT": str(server.port),
+           "READY_TIMEOUT": "5",
+           "WAIT_SECONDS": "0",
+           "IDLE_MINUTES": "0"}
+    os.environ.pop("STATE_TABLE_NAME", None)
+    os.environ.update(env)
+
+    cold = {name: cold_import(name, dict(os.environ)) for name in HANDLERS}
+
+    clients.use_factory(aws.factory)
+    state.use_store(CountingStore(aws))
+    exporter = instrument.MemoryExporter()
+    instrument.use_exporter(exporter)
+    logging.disable(logging.CRITICAL)
+    handlers = {name: load_handler(name) for name in HANDLERS}
+    templates = {name: load_event(name) for name in ["api_start", "task_running", "task_stopped"]}
+    schedule = build_schedule(args, templates)
+
+    latencies = collections.defaultdict(list)
+    first_call = {}
+    counts = collections.Counter()
+    errors = collections.Counter()
+    lock = threading.Lock()
+
+    def invoke(name, event):
+        aws.local.handler = name
+        if name == "r53lambda":
+            detail = event["detail"]
+            with aws.lock:
+                if detail["desiredStatus"] == "RUNNING":
+                    aws.running_tasks.add(detail["taskArn"])
+                else:
+                    aws.running_tasks.discard(detail["taskArn"])
+        start = time.perf_counter()
+        try:
+            handlers[name].handler(event, None)
+        except Exception:
+            with lock:
+                errors[name] += 1
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies[name].append(elapsed)
+            counts[name] += 1
+            first_call.setdefault(name, elapsed)
+
+    output = io.StringIO()
+    began = time.perf_counter()
+    with contextlib.redirect_stdout(output), ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for offset, name, event in schedule:
+            delay = offset / args.speed - (time.perf_counter() - began)
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(invoke, name, event)
+    replay_seconds = time.perf_counter() - began
+
+    # drain the DNS queue the way the consumer's SQS event source would
+    # the consumer needs botocore to classify Route53 errors
+    drained = botocore is not None
+    if drained:
+        with contextlib.redirect_stdout(output):
+            messages, aws.messages = aws.messages, []
+            for index in range(0, len(messages), SQS_BATCH):
+                batch = [{"messageId": str(n), "body": body} for n, body in enumerate(messages[index:index + SQS_BATCH])]
+                invoke("dnsqueue", {"Records": batch})
+            counts["dns intents"] = len(messages)
+
+    server.stop()
+    clients.use_factory(None)
+    state.use_store(None)
+    instrument.use_exporter(instrument.StdoutExporter())
+    logging.disable(logging.NOTSET)
+    report(args, schedule, replay_seconds, latencies, first_call, counts, errors, aws, cold, drained, output, exporter)
+
+
+def report(args, schedule, replay_seconds, latencies, first_call, counts, errors, aws, cold, drained, output, exporter):
+    print("Replayed %d events in %.1fs (%.0f events/min simulated at %.0fx speed, %d workers)"
+          % (len(schedule), replay_seconds, len(schedule) * 60.0 / args.duration, args.speed, args.concurrency))
+    print("")
+    header = "%-13s %7s %6s %9s %9s %9s %9s" % ("handler", "events", "errors", "p50 ms", "p95 ms", "p99 ms", "max ms")
+    print(header)
+    print("-" * len(header))
+    for name in HANDLERS:
+        samples = [s * 1000 for s in latencies.get(name, [])]
+        if samples:
+            print("%-13s %7d %6d %9.2f %9.2f %9.2f %9.2f" % (name, counts[name], errors[name], percentile(samples, 50),
+                                                            percentile(samples, 95), percentile(samples, 99), max(samples)))
+    if not drained:
+        print("(dnsqueue not drained: botocore is not installed)")
+
+    print("")
+    print("AWS calls per event:")
+    per_handler = collections.defaultdict(dict)
+    for (handler, operation), total in aws.calls.items():
+        per_handler[handler][operation] = total
+    for name in HANDLERS:
+        if counts[name]:
+            line = ", ".join("%s %.2f" % (operation, total / float(counts[name]))
+                             for operation, total in sorted(per_handler[name].items()))
+            print("  %-13s %s" % (name, line or "none"))
+
+    print("")
+    print("Cold vs warm:")
+    for name in HANDLERS:
+        samples = latencies.get(name)
+        if samples:
+            cold_ms = "%.1f" % (cold[name] * 1000) if cold[name] is not None else "n/a"
+            print("  %-13s import %s ms, first invocation %.2f ms, warm p50 %.2f ms"
+                  % (name, cold_ms, first_call[name] * 1000, percentile([s * 1000 for s in samples[1:] or samples], 50)))
+    print("")
+    print("%d metric line(s) emitted, %d instrumentation line(s) at sample rate %s"
+          % (output.getvalue().count('"_aws"'), len(exporter.lines), instrument.sample_rate()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay control plane events against the lambdas offline.")
+    parser.add_argument("--starts-per-minute", type=float, default=300)
+    parser.add_argument("--task-events-per-minute", type=float, default=3000)
+    parser.add_argument("--idle-checks-per-minute", type=float, default=12)
+    parser.add_argument("--duplicate-fraction", type=float, default=0.05, help="share of task events delivered twice")
+    parser.add_argument("--duration", type=float, default=60, help="simulated seconds")
+    parser.add_argument("--speed", type=float, default=10, help="how much faster than real time to replay")
+    parser.add_argument("--task-lifetime", type=float, default=20, help="simulated seconds between RUNNING and STOPPED")
+    parser.add_argument("--capacity", type=int, default=1000, help="servers allowed in the simulated region")
+    parser.add_argument("--concurrency", type=int, default=32, help="handler invocations in flight at once")
+    parser.add_argument("--aws-latency-ms", type=float, default=0, help="latency added to every fake AWS call")
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
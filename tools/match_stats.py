@@ -0,0 +1,94 @@
+"""Run game server logs through the match stats pipeline locally, and read its output.
+
+    python tools/match_stats.py replay server.log --region eu-west-2 --out stats
+    python tools/match_stats.py summary stats
+
+replay feeds a log (one line per log event, e.g. from `docker logs` or
+`aws logs get-log-events --output text`) through the same parser as the
+matchstats lambda and writes to a local directory laid out like the bucket.
+summary reads such a directory, or a synced copy of the bucket, and prints
+rows per partition and the top players by kills.
+"""
+import argparse
+import collections
+import gzip
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(ROOT, "lambdas", "layer", "python"))
+
+from rtcwcommon import matchstats
+
+
+def replay(args):
+    parser = matchstats.StreamParser()
+    rows = []
+    rounds = 0
+    logged_at = int(time.time() * 1000)
+    with open(args.log) as fp:
+        for line in fp:
+            for document in parser.feed(line.rstrip("\n")):
+                rounds += 1
+                rows.extend(matchstats.rows(document, args.region, args.server, logged_at))
+    keys = matchstats.write(matchstats.LocalSink(args.out), rows, args.format) if rows else []
+    print("%d round(s), %d row(s)%s" % (rounds, len(rows), "".join("\n  " + key for key in keys)))
+    if parser.pending():
+        print("%d line(s) of an unfinished document left over" % len(parser.pending()))
+
+
+def read(path):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(path).to_pylist()
+    with gzip.open(path, "rt") as fp:
+        return [json.loads(line) for line in fp]
+
+
+def summary(args):
+    partitions = collections.Counter()
+    kills = collections.Counter()
+    aliases = {}
+    for directory, _, files in os.walk(args.directory):
+        for name in files:
+            if not (name.endswith(".parquet") or name.endswith(".json.gz")):
+                continue
+            for row in read(os.path.join(directory, name)):
+                partitions[(row["region"], time.strftime("%Y-%m-%d", time.gmtime(row["logged_at"] / 1000.0)))] += 1
+                kills[row["guid"]] += row.get("kills") or 0
+                aliases[row["guid"]] = row.get("alias")
+    for (region, date), count in sorted(partitions.items()):
+        print("%-15s %s %6d row(s)" % (region, date, count))
+    print("Top players by kills:")
+    for guid, total in kills.most_common(args.top):
+        print("  %-24s %6d" % (aliases[guid] or guid, total))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command")
+
+    replay_parser = commands.add_parser("replay", help="parse a log into a local stats directory")
+    replay_parser.add_argument("log")
+    replay_parser.add_argument("--region", default="local")
+    replay_parser.add_argument("--server", default="replay", help="server column, the task id in the lambda")
+    replay_parser.add_argument("--out", default="stats")
+    replay_parser.add_argument("--format", choices=matchstats.FORMATS, default=matchstats.DEFAULT_FORMAT,
+                               help="parquet needs pyarrow, json does not")
+    replay_parser.set_defaults(run=replay)
+
+    summary_parser = commands.add_parser("summary", help="summarise a stats directory")
+    summary_parser.add_argument("directory")
+    summary_parser.add_argument("--top", type=int, default=10)
+    summary_parser.set_defaults(run=summary)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.error("pick a command: replay or summary")
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
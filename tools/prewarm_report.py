@@ -0,0 +1,94 @@
+"""Pre-warm report: hit rate, wasted server minutes and start latency saved.
+
+Reads the "prewarm" items of each region's state table (or a JSON-lines
+export made with --export). Latency saved is measured against the p50
+time-to-playable of the region's cold starts from the lifecycle items, or
+--typical-seconds when there are none. --forecast also lists the hours of
+the week the prewarm lambda currently expects players in.
+
+    python tools/prewarm_report.py --regions us-east-1,eu-west-2 --forecast
+    python tools/prewarm_report.py --file prewarm.jsonl --typical-seconds 110
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas", "layer", "python"))
+
+from rtcwcommon import lifecycle, prewarm
+from rtcwcommon.state import DynamoStore
+
+DEFAULT_TABLE = "rtcwdemand-state"
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def typical_start(records, fallback):
+    """p50 request-to-playable of cold starts, in seconds."""
+    totals = [r["phases"]["total"] for r in records
+              if "total" in r.get("phases", {}) and r.get("requested_at")]
+    return lifecycle.percentile(totals, 50) / 1000.0 if totals else fallback
+
+
+def print_summary(region, summary, typical):
+    print(region)
+    print("  launched %d, skipped (region full) %d, claimed %d" % (summary["launched"], summary["skipped"], summary["hits"]))
+    if summary["hit_rate"] is not None:
+        print("  hit rate %.0f%%" % (summary["hit_rate"] * 100))
+    print("  wasted %.0f server minute(s)" % summary["wasted_minutes"])
+    print("  latency saved %.0fs in total" % summary["latency_saved_seconds"] +
+          (", %.0fs per hit (cold start p50 %.0fs)" % (summary["saved_per_hit_seconds"], typical)
+           if summary["saved_per_hit_seconds"] is not None else ""))
+
+
+def print_forecast(history, threshold):
+    hours = {hour: p for hour, p in prewarm.forecast(history).items() if p["probability"] >= threshold}
+    print("  expected hours (UTC): " + (", ".join("%s %02d:00 (%.0f%%, %.1f starts)" % (DAYS[hour // 24], hour % 24,
+                                                                                     hours[hour]["probability"] * 100,
+                                                                                     hours[hour]["starts"])
+                                                 for hour in sorted(hours)) or "none yet"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-warm hit rate, waste and latency saved per region.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--regions", help="comma separated regions to read the state tables of")
+    source.add_argument("--file", help="JSON-lines file of prewarm items")
+    parser.add_argument("--table", default=DEFAULT_TABLE)
+    parser.add_argument("--typical-seconds", type=float, default=120, help="cold start time when there is no lifecycle data")
+    parser.add_argument("--forecast", action="store_true", help="also list the hours pre-warming is expected for")
+    parser.add_argument("--threshold", type=float, default=0.5, help="share of weeks an hour needs starts in, for --forecast")
+    parser.add_argument("--export", help="also write the loaded prewarm items to this JSON-lines file")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as fp:
+            records = [json.loads(line) for line in fp if line.strip()]
+        by_region = {}
+        for record in records:
+            by_region.setdefault(record["region"], {"prewarm": [], "lifecycle": [], "history": []})["prewarm"].append(record)
+    else:
+        by_region = {}
+        for region in args.regions.split(","):
+            store = DynamoStore(args.table, region)
+            by_region[region] = {"prewarm": store.query("prewarm"),
+                                 "lifecycle": store.query("lifecycle"),
+                                 "history": store.query("history") if args.forecast else []}
+
+    if args.export:
+        with open(args.export, "w") as fp:
+            for data in by_region.values():
+                for record in data["prewarm"]:
+                    fp.write(json.dumps(record) + "\n")
+
+    for region in sorted(by_region):
+        data = by_region[region]
+        typical = typical_start(data["lifecycle"], args.typical_seconds)
+        print_summary(region, prewarm.summarize(data["prewarm"], typical), typical)
+        if args.forecast and data["history"]:
+            print_forecast(data["history"], args.threshold)
+        print("")
+
+
+if __name__ == "__main__":
+    main()
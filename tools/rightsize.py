@@ -0,0 +1,172 @@
+"""Task size recommendations per region and size profile, from the telemetry sidecar.
+
+Reads the samples docker/telemetry.py logged to each region's
+rtcwdemand-telemetry log group (or a JSON-lines export made with --export)
+and, per region and profile, relates CPU and memory to the player count:
+
+  - p95 CPU (in CPU units) and p99 memory of the samples with players,
+  - a least-squares fit of CPU against players, extrapolated to a full
+    server when the profile is named like "6v6",
+  - how often the server was throttled or slow to answer getstatus, the
+    signs of stalled frames.
+
+The recommendation is the smallest Fargate size that keeps the expected
+CPU under --target-cpu percent and memory under the limit with
+--memory-headroom to spare. Put it in settings["profiles"].
+
+    python tools/rightsize.py --regions us-east-1,eu-west-2 --hours 168
+    python tools/rightsize.py --file telemetry.jsonl
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas", "layer", "python"))
+
+from rtcwcommon.lifecycle import percentile
+
+LOG_GROUP = "rtcwdemand-telemetry"
+# valid Fargate (cpu, memory MiB) pairs, smallest first
+FARGATE_SIZES = ([(256, memory) for memory in (512, 1024, 2048)]
+                 + [(512, memory) for memory in range(1024, 4097, 1024)]
+                 + [(1024, memory) for memory in range(2048, 8193, 1024)]
+                 + [(2048, memory) for memory in range(4096, 16385, 1024)]
+                 + [(4096, memory) for memory in range(8192, 30721, 1024)])
+SLOW_STATUS_MS = 100
+
+
+def fetch(region, hours):
+    """Telemetry samples of one region from CloudWatch Logs."""
+    import boto3
+    client = boto3.client("logs", region_name=region)
+    paginator = client.get_paginator("filter_log_events")
+    samples = []
+    pages = paginator.paginate(logGroupName=LOG_GROUP,
+                               startTime=int((time.time() - hours * 3600) * 1000),
+                               filterPattern="{ $.telemetry = 1 }")
+    for page in pages:
+        for event in page["events"]:
+            try:
+                samples.append(json.loads(event["message"]))
+            except ValueError:
+                continue
+    return samples
+
+
+def full_server(profile):
+    """Players of a full server for profiles named like "6v6", else None."""
+    match = re.match(r"^(\d+)v(\d+)$", profile)
+    return int(match.group(1)) + int(match.group(2)) if match else None
+
+
+def fit(points):
+    """(slope, intercept) of a least-squares line through (x, y) points, None when x does not vary."""
+    count = len(points)
+    mean_x = sum(x for x, y in points) / float(count)
+    mean_y = sum(y for x, y in points) / float(count)
+    spread = sum((x - mean_x) ** 2 for x, y in points)
+    if not spread:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+    return slope, mean_y - slope * mean_x
+
+
+def recommend(cpu_units, memory_mib):
+    for cpu, memory in FARGATE_SIZES:
+        if cpu >= cpu_units and memory >= memory_mib:
+            return cpu, memory
+    return FARGATE_SIZES[-1]
+
+
+def analyse(samples, target_cpu, memory_headroom):
+    """Summary and recommended size of one region and profile, None without samples under load."""
+    loaded = [s for s in samples if s.get("Players")]
+    if not loaded:
+        return None
+    cpu_units = [s["CpuUtilization"] / 100.0 * s["cpu_limit"] for s in loaded]
+    memory = [s["MemoryMiB"] for s in loaded]
+    status = [s["StatusMs"] for s in loaded if s.get("StatusMs") is not None]
+    peak_players = max(s["Players"] for s in loaded)
+    observed_cpu = percentile(cpu_units, 95)
+    expected_cpu = observed_cpu
+
+    line = fit([(s["Players"], units) for s, units in zip(loaded, cpu_units)])
+    full = full_server(samples[0].get("Profile", ""))
+    at_full = None
+    if line and full and full > peak_players:
+        # extrapolated with the p95 residual, so the estimate is not an average
+        residual = percentile([units - (line[0] * s["Players"] + line[1]) for s, units in zip(loaded, cpu_units)], 95)
+        at_full = line[0] * full + line[1] + max(residual, 0)
+        expected_cpu = max(expected_cpu, at_full)
+
+    by_players = {}
+    for s, units in zip(loaded, cpu_units):
+        by_players.setdefault(s["Players"], []).append(units)
+
+    current = (loaded[-1]["cpu_limit"], loaded[-1]["memory_limit"])
+    return {"samples": len(loaded),
+            "peak_players": peak_players,
+            "current": current,
+            "cpu_p95": observed_cpu,
+            "cpu_at_full": at_full,
+            "memory_p99": percentile(memory, 99),
+            "throttled": sum(1 for s in loaded if s.get("ThrottledMs")) / float(len(loaded)),
+            "slow_status": sum(1 for ms in status if ms > SLOW_STATUS_MS) / float(len(status)) if status else 0.0,
+            "cpu_by_players": {players: percentile(values, 95) for players, values in sorted(by_players.items())},
+            "recommended": recommend(expected_cpu / (target_cpu / 100.0), percentile(memory, 99) * memory_headroom)}
+
+
+def print_report(region, profile, result):
+    print(region + " " + profile)
+    if result is None:
+        print("  no samples with players yet\n")
+        return
+    print("  %d samples with players, up to %d players" % (result["samples"], result["peak_players"]))
+    print("  CPU p95 %.0f units%s of %d, memory p99 %.0f MiB of %d" % (
+        result["cpu_p95"], ", %.0f expected when full" % result["cpu_at_full"] if result["cpu_at_full"] else "",
+        result["current"][0], result["memory_p99"], result["current"][1]))
+    print("  throttled in %.0f%% of samples, getstatus slower than %dms in %.0f%%" % (
+        result["throttled"] * 100, SLOW_STATUS_MS, result["slow_status"] * 100))
+    print("  CPU p95 by players: " + ", ".join("%d: %.0f" % (players, units) for players, units in result["cpu_by_players"].items()))
+    recommended = result["recommended"]
+    verdict = "keep" if tuple(recommended) == tuple(result["current"]) else "change to"
+    print('  %s {"cpu": %d, "memory": %d}\n' % (verdict, recommended[0], recommended[1]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Task size recommendations from the telemetry sidecar's samples.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--regions", help="comma separated regions to read the telemetry logs of")
+    source.add_argument("--file", help="JSON-lines file of telemetry samples")
+    parser.add_argument("--hours", type=float, default=168, help="how far back to read the logs")
+    parser.add_argument("--target-cpu", type=float, default=70, help="highest expected CPU use, percent of the task's CPU")
+    parser.add_argument("--memory-headroom", type=float, default=1.25, help="memory limit over the p99 working set")
+    parser.add_argument("--export", help="also write the loaded samples to this JSON-lines file")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as fp:
+            samples = [json.loads(line) for line in fp if line.strip()]
+    else:
+        regions = args.regions.split(",")
+        with ThreadPoolExecutor(max_workers=len(regions)) as pool:
+            samples = [sample for found in pool.map(lambda region: fetch(region, args.hours), regions) for sample in found]
+
+    if args.export:
+        with open(args.export, "w") as fp:
+            for sample in samples:
+                fp.write(json.dumps(sample) + "\n")
+
+    groups = {}
+    for sample in samples:
+        groups.setdefault((sample.get("Region", ""), sample.get("Profile", "default")), []).append(sample)
+    for region, profile in sorted(groups):
+        print_report(region, profile, analyse(groups[(region, profile)], args.target_cpu, args.memory_headroom))
+
+
+if __name__ == "__main__":
+    main()
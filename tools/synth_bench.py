@@ -0,0 +1,110 @@
+"""Synth benchmark: how long `cdk synth` takes as regions are added.
+
+Builds the app in-process from mysettings.py with the first N regions of
+REGIONS (the configured ones first, the rest with generated prefixes), so
+nothing is deployed. VPC lookups are answered from dummy context values the
+way cdk.context.json answers them after the first real synth; the lookups
+a fresh checkout would make are counted as "lookups".
+
+    python tools/synth_bench.py --regions 3,6,12 --repeat 3
+"""
+import argparse
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+
+import aws_cdk as cdk
+
+from mysettings import settings as base_settings
+from stacks import regions
+from stacks.rtcw_on_demand import RtcwOnDemandStack
+
+REGIONS = ["us-east-1", "eu-west-2", "sa-east-1", "us-west-2", "eu-central-1", "ap-southeast-2",
+           "ap-northeast-1", "ca-central-1", "eu-north-1", "ap-south-1", "us-east-2", "eu-west-1",
+           "ap-southeast-1", "us-west-1", "eu-west-3", "ap-northeast-2"]
+
+
+def settings_for(count):
+    """mysettings.py with count regions; the configured ones keep their entries."""
+    settings = copy.deepcopy(base_settings)
+    configured = {config.name: config for config in regions.load(base_settings)}
+    entries = {}
+    names = list(configured) + [name for name in REGIONS if name not in configured]
+    for index, name in enumerate(names[:count]):
+        config = configured.get(name)
+        if config:
+            entries[config.code] = config._asdict()
+        else:
+            entries["R" + str(index)] = {"name": name, "prefix": "r" + str(index), "morning_hour": 8, "capacity": 1}
+    settings["regions"] = entries
+    settings.pop("capacity", None)
+    return settings
+
+
+def dummy_vpc(region):
+    return {"vpcId": "vpc-00000000",
+            "vpcCidrBlock": "10.0.0.0/16",
+            "availabilityZones": [],
+            "subnetGroups": [{"name": "Public", "type": "Public",
+                              "subnets": [{"subnetId": "subnet-00000000", "cidr": "10.0.0.0/24",
+                                           "availabilityZone": region + "a", "routeTableId": "rtb-00000000"}]}]}
+
+
+def key_region(key):
+    """Region of a context key like "vpc-provider:account=123:filter.isDefault=true:region=us-east-1"."""
+    fields = dict(part.split("=", 1) for part in key.split(":") if "=" in part)
+    return fields["region"]
+
+
+def synth(settings, context):
+    """Seconds to build and synthesize the app, and the context lookups it still needs."""
+    outdir = tempfile.mkdtemp(prefix="rtcw-synth-")
+    try:
+        started = time.perf_counter()
+        app = cdk.App(context=context, outdir=outdir)
+        for region in regions.load(settings):
+            RtcwOnDemandStack(app, "RtcwOnDemandStack" + region.code,
+                              env=cdk.Environment(account=settings["account"], region=region.name),
+                              settings=settings)
+        cdk.Tags.of(app).add("purpose", "rtcwdemand")
+        built = time.perf_counter()
+        assembly = app.synth()
+        done = time.perf_counter()
+        return built - started, done - built, list(assembly.manifest.missing or [])
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+
+def bench(count, repeat):
+    settings = settings_for(count)
+    # the first synth reports the lookups, the timed ones get them from context
+    missing = synth(settings, {})[2]
+    context = {lookup.key: dummy_vpc(key_region(lookup.key)) for lookup in missing}
+    timings = [synth(settings, context) for _ in range(repeat)]
+    best = min(timings, key=lambda timing: timing[0] + timing[1])
+    return {"regions": count, "lookups": len(missing),
+            "construct": best[0], "synth": best[1], "total": best[0] + best[1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the synthesis of the app for growing region counts.")
+    parser.add_argument("--regions", default="3,6,12", help="comma separated region counts, at most " + str(len(REGIONS)))
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per count, the best one is reported")
+    args = parser.parse_args()
+
+    os.chdir(ROOT)  # lambda assets are relative to the repository
+    print("%8s %8s %10s %8s %8s" % ("regions", "lookups", "construct", "synth", "total"))
+    for count in [int(value) for value in args.regions.split(",")]:
+        result = bench(min(count, len(REGIONS)), args.repeat)
+        print("%8d %8d %9.2fs %7.2fs %7.2fs" % (result["regions"], result["lookups"], result["construct"],
+                                                result["synth"], result["total"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Start, watch and tear down the servers of a tournament in one go.
+
+    python tools/tournament.py start --name "spring cup" --server us-east-1:6:6v6 --server eu-west-2:4:6v6 --server sa-east-1:2
+    python tools/tournament.py start plan.json --output manifest.json
+    python tools/tournament.py status us-east-1.3f2a9c0d1e4b
+    python tools/tournament.py stop us-east-1.3f2a9c0d1e4b
+
+A plan file is the POST /batch body: {"name": ..., "hold_hours": ...,
+"servers": [{"region": ..., "count": ..., "profile": ...}]}. The batch API
+scales every region at once; start then polls GET /batch/{id} until every
+server is playable and prints the manifest of hostnames and IPs. The
+servers stay up between matches (the idle reaper and the daily cron skip
+them) until `stop` or the end of hold_hours.
+
+The API is https://<dns_api_url> from mysettings.py unless --url is given,
+the key comes from --key or RTCW_BATCH_KEY (settings["batch_api_key"]).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+
+POLL_SECONDS = 10
+
+
+def default_url():
+    try:
+        from mysettings import settings
+    except ImportError:
+        return None
+    return "https://" + settings["dns_api_url"]
+
+
+def call(args, method, path, body=None):
+    """(status, decoded body) of an API request."""
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(args.url.rstrip("/") + path, data=data, method=method,
+                                     headers={"x-api-key": args.key, "Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=35) as response:
+            return response.status, json.loads(response.read().decode())
+    except urllib.error.HTTPError as error:
+        return error.code, json.loads(error.read().decode() or "{}")
+
+
+def parse_server(value):
+    """region:count[:profile] -> batch entry."""
+    parts = value.split(":")
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError("expected region:count[:profile], got " + value)
+    entry = {"region": parts[0], "count": int(parts[1])}
+    if len(parts) == 3:
+        entry["profile"] = parts[2]
+    return entry
+
+
+def print_manifest(manifest, output=None):
+    for server in manifest["servers"]:
+        address = server["hostname"] + (":" + str(server["port"]) if server.get("port") else "")
+        print("%-15s %-28s %-16s %s" % (server["region"], address, server.get("ip", "-"),
+                                       "ready" if server["ready"] else "starting"))
+    print("%d/%d ready, held until %s UTC" % (len([s for s in manifest["servers"] if s["ready"]]), manifest["requested"],
+                                              time.strftime("%Y-%m-%d %H:%M", time.gmtime(manifest["hold_until"]))))
+    if output:
+        with open(output, "w") as fp:
+            json.dump(manifest, fp, indent=2)
+
+
+def start(args):
+    if args.plan:
+        with open(args.plan) as fp:
+            body = json.load(fp)
+    else:
+        body = {"servers": args.server or []}
+    if args.name:
+        body["name"] = args.name
+    if args.hold_hours:
+        body["hold_hours"] = args.hold_hours
+    status, result = call(args, "POST", "/batch", body)
+    print(result.get("message"))
+    if status != 200:
+        return 1
+    batch_id = result["id"]
+    print("Batch " + batch_id)
+
+    deadline = time.time() + args.wait
+    manifest = result
+    while not manifest["ready"] and time.time() < deadline:
+        time.sleep(POLL_SECONDS)
+        status, polled = call(args, "GET", "/batch/" + batch_id)
+        if status == 200:
+            manifest = polled
+            print("%d/%d ready" % (len([s for s in manifest["servers"] if s["ready"]]), len(manifest["servers"])))
+    print_manifest(manifest, args.output)
+    return 0 if manifest["ready"] else 2
+
+
+def status(args):
+    code, manifest = call(args, "GET", "/batch/" + args.id)
+    if code != 200:
+        print(manifest.get("message"))
+        return 1
+    print(manifest["name"] + " (" + manifest["state"] + ")")
+    print_manifest(manifest, args.output)
+    return 0
+
+
+def stop(args):
+    code, result = call(args, "DELETE", "/batch/" + args.id)
+    print(result.get("message"))
+    return 0 if code == 200 else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=default_url(), help="API base URL, default https://<dns_api_url>")
+    parser.add_argument("--key", default=os.environ.get("RTCW_BATCH_KEY"), help="batch API key, default $RTCW_BATCH_KEY")
+    commands = parser.add_subparsers(dest="command")
+
+    start_parser = commands.add_parser("start", help="start a batch and wait for its manifest")
+    start_parser.add_argument("plan", nargs="?", help="JSON plan, the POST /batch body")
+    start_parser.add_argument("--server", action="append", type=parse_server, help="region:count[:profile], repeatable")
+    start_parser.add_argument("--name")
+    start_parser.add_argument("--hold-hours", type=float, help="keep the servers up this long (default 12, at most 48)")
+    start_parser.add_argument("--wait", type=int, default=600, help="seconds to wait for every server to be playable")
+    start_parser.add_argument("--output", help="also write the manifest as JSON here")
+    start_parser.set_defaults(run=start)
+
+    status_parser = commands.add_parser("status", help="manifest of a batch")
+    status_parser.add_argument("id")
+    status_parser.add_argument("--output", help="also write the manifest as JSON here")
+    status_parser.set_defaults(run=status)
+
+    stop_parser = commands.add_parser("stop", help="tear a batch down")
+    stop_parser.add_argument("id")
+    stop_parser.set_defaults(run=stop)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.error("pick a command: start, status or stop")
+    if not args.url or not args.key:
+        parser.error("--url (or mysettings.py) and --key (or RTCW_BATCH_KEY) are required")
+    sys.exit(args.run(args))
+
+
+if __name__ == "__main__":
+    main()